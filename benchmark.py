@@ -0,0 +1,489 @@
+from __future__ import print_function
+import sys
+import argparse
+
+import torch
+
+from lib.utils.timer import Timer
+
+def parse_args():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description='Micro benchmarks of ssds.pytorch components')
+    parser.add_argument('bench', choices=sorted(benchmarks),
+            help='the component to benchmark')
+    parser.add_argument('-r', '--repeat', dest='repeat',
+            help='number of timed runs per case, default is 5', default=5, type=int)
+    parser.add_argument('-b', '--batch', dest='batch',
+            help='batch size for the batched benchmarks, default is 8', default=8, type=int)
+
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+
+    args = parser.parse_args()
+    return args
+
+
+def _time(fn, repeat):
+    _t = Timer()
+    for _ in range(repeat):
+        _t.tic()
+        result = fn()
+        _t.toc()
+    return result, _t.average_time*1000
+
+
+def _random_boxes(num, max_size=0.2):
+    """random point form boxes inside the unit square"""
+    wh = torch.rand(num, 2) * max_size + 0.005
+    xy = torch.rand(num, 2) * (1 - wh)
+    return torch.cat((xy, xy + wh), 1)
+
+
+def benchmark_nms(args):
+    from lib.utils.nms.nms_factory import nms_map, approximate_nms_map
+    print('{:>8s} {:>12s} {:>10s} {:>6s}'.format('boxes', 'backend', 'time', 'kept'))
+    for num in [100, 500, 1000, 2000, 5000, 10000, 20000]:
+        boxes = _random_boxes(num)
+        scores = torch.rand(num)
+        for name, nms_fn in sorted(nms_map.items()) + sorted(approximate_nms_map.items()):
+            (keep, count), ms = _time(lambda: nms_fn(boxes, scores, 0.6, num), args.repeat)
+            print('{:>8d} {:>12s} {:>8.2f}ms {:>6d}'.format(num, name, ms, count))
+
+
+def _random_predictions(batch, num_priors, num_classes):
+    """random loc preds, softmax scores and center form priors"""
+    loc = torch.randn(batch, num_priors, 4) * 0.5
+    conf = torch.softmax(torch.randn(batch * num_priors, num_classes) * 3, dim=1)
+    priors = torch.cat((torch.rand(num_priors, 2), torch.rand(num_priors, 2) * 0.2 + 0.01), 1)
+    return (loc, conf), priors
+
+
+def _detections(output):
+    """set of (image, class, score) of the detections in a Detect output"""
+    idx = (output[:, :, :, 0] > 0).nonzero()
+    scores = output[idx[:, 0], idx[:, 1], idx[:, 2], 0]
+    return set((b, c, round(score, 6)) for (b, c, _), score in zip(idx.cpu().tolist(), scores.cpu().tolist()))
+
+
+def benchmark_detect(args):
+    from lib.utils.config_parse import cfg, AttrDict
+    from lib.layers.functions.detection import Detect
+    num_classes = 37
+    # roughly the prior count of the 800x600 ssd_lite shelf models
+    predictions, priors = _random_predictions(args.batch, 10000, num_classes)
+
+    def detector(**options):
+        post = AttrDict(cfg.POST_PROCESS)
+        post.NUM_CLASSES = num_classes
+        post.MAX_DETECTIONS = 200
+        post.update(options)
+        return Detect(post, priors)
+
+    reference, ms = _time(lambda: detector().forward(predictions), args.repeat)
+    reference_dets = _detections(reference)
+    print('{:>12s} {:>8s} {:>10s} {:>6s} {:>10s}'.format('engine', 'top_k', 'time', 'dets', 'recall'))
+    print('{:>12s} {:>8s} {:>8.2f}ms {:>6d} {:>10s}'.format('loop', '-', ms, len(reference_dets), '-'))
+    for top_k in [0, 5000, 2000, 1000, 500, 200]:
+        output, ms = _time(lambda: detector(VECTORIZED=True, PRE_NMS_TOP_K=top_k).forward(predictions), args.repeat)
+        dets = _detections(output)
+        recall = len(dets & reference_dets) / float(max(len(reference_dets), 1))
+        print('{:>12s} {:>8d} {:>8.2f}ms {:>6d} {:>10.3f}'.format('vectorized', top_k, ms, len(dets), recall))
+
+    # sigmoid heads: the same scores handed over as logits, and top-1 class per prior
+    loc, conf = predictions
+    logits = (loc, torch.log(conf / (1 - conf)))
+    for name, inputs, options in [('logits', logits, dict(SIGMOID_LOGITS=True)),
+                                  ('top1', predictions, dict(TOP1_CLASS=True)),
+                                  ('logits+top1', logits, dict(SIGMOID_LOGITS=True, TOP1_CLASS=True))]:
+        output, ms = _time(lambda: detector(VECTORIZED=True, **options).forward(inputs), args.repeat)
+        dets = _detections(output)
+        recall = len(dets & reference_dets) / float(max(len(reference_dets), 1))
+        print('{:>12s} {:>8s} {:>8.2f}ms {:>6d} {:>10.3f}'.format(name, '-', ms, len(dets), recall))
+
+
+def _shelf_priorbox(cache_dir=None):
+    """priors of an 800x600 input, 4 feature levels with tiled sub-anchors for the extreme ratios"""
+    from lib.layers.functions.prior_box import PriorBox
+    image_size = [600, 800]
+    feature_maps = [(38, 50), (19, 25), (10, 13), (5, 7)]
+    aspect_ratios = [[0.2, 0.5, 2, 4], [0.25, 0.5, 2, 3], [0.5, 2], [0.5, 2]]
+    return PriorBox(image_size, feature_maps, aspect_ratios, [0.05, 0.6], cache_dir=cache_dir)
+
+
+def benchmark_priors(args):
+    import tempfile
+    import shutil
+    cache_dir = tempfile.mkdtemp()
+    priorbox = _shelf_priorbox(cache_dir)
+    try:
+        for name, fn, repeat in [('loop', priorbox.forward_loop, args.repeat),
+                                 ('vectorized', priorbox.generate, args.repeat),
+                                 ('cold cache', priorbox.forward, 1),
+                                 ('warm cache', priorbox.forward, args.repeat)]:
+            output, ms = _time(fn, repeat)
+            print('{:>10s} {:>8.2f}ms {:>8d}'.format(name, ms, output.size(0)))
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def benchmark_match(args):
+    from lib.utils.box_utils import match_with_ignorance
+    priors = _shelf_priorbox().prior_set()
+    num_priors = len(priors)
+    print('{:>8s} {:>8s} {:>10s}'.format('gts', 'matcher', 'time'))
+    for num_gts in [10, 50, 150, 300]:
+        truths = _random_boxes(num_gts, 0.15).to(priors.center.device)
+        labels = torch.randint(1, 37, (num_gts,), device=truths.device).float()
+        for name, grid in [('dense', False), ('grid', True)]:
+            loc_t = torch.zeros(1, num_priors, 4, device=truths.device)
+            conf_t = torch.zeros(1, num_priors, device=truths.device).long()
+            _, ms = _time(lambda: match_with_ignorance(0.5, 0.4, truths, priors, [0.1, 0.2], labels,
+                                                       loc_t, conf_t, 0, grid), args.repeat)
+            print('{:>8d} {:>8s} {:>8.2f}ms'.format(num_gts, name, ms))
+
+
+def benchmark_match_batch(args):
+    from lib.utils.box_utils import match_with_ignorance, match_batch, pad_targets
+    priors = _shelf_priorbox().prior_set('cpu')
+    num_priors = len(priors)
+    print('{:>6s} {:>10s} {:>10s}'.format('batch', 'matcher', 'time'))
+    for batch in [8, 16, 32, 64]:
+        targets = []
+        for _ in range(batch):
+            num_gts = int(torch.randint(1, 150, (1,)))
+            labels = torch.randint(1, 37, (num_gts, 1)).float().cpu()
+            targets.append(torch.cat((_random_boxes(num_gts, 0.15).cpu(), labels), 1))
+        loc_t = torch.zeros(batch, num_priors, 4, device='cpu')
+        conf_t = torch.zeros(batch, num_priors, device='cpu').long()
+
+        def per_image():
+            for idx, anno in enumerate(targets):
+                match_with_ignorance(0.5, 0.4, anno[:, :4], priors, [0.1, 0.2], anno[:, 4], loc_t, conf_t, idx)
+        _, ms = _time(per_image, args.repeat)
+        print('{:>6d} {:>10s} {:>8.2f}ms'.format(batch, 'per image', ms))
+        _, ms = _time(lambda: match_batch(0.5, 0.4, *(pad_targets(targets) + (priors, [0.1, 0.2]))), args.repeat)
+        print('{:>6d} {:>10s} {:>8.2f}ms'.format(batch, 'batched', ms))
+
+
+def _peak_memory(fn):
+    """result of fn and the peak of the cuda memory allocated while running it, in MB"""
+    if not torch.cuda.is_available():
+        return fn(), float('nan')
+    torch.cuda.synchronize()
+    base = torch.cuda.memory_allocated()
+    torch.cuda.reset_max_memory_allocated()
+    result = fn()
+    torch.cuda.synchronize()
+    return result, (torch.cuda.max_memory_allocated() - base) / 2.0**20
+
+
+def benchmark_focal(args):
+    from lib.utils.config_parse import cfg, AttrDict
+    from lib.layers.modules.focal_loss import FocalLoss
+    num_classes = 37
+    priors = _shelf_priorbox().prior_set()
+    device = priors.center.device
+    matcher = AttrDict(cfg.MATCHER)
+    matcher.NUM_CLASSES = num_classes
+    # conf_t with ~2% positives and ~1% ignored priors
+    conf_t = torch.zeros(args.batch, len(priors), device=device).long()
+    pos = torch.rand(conf_t.size(), device=device)
+    conf_t[pos < 0.02] = torch.randint(1, num_classes, conf_t.size(), device=device)[pos < 0.02]
+    conf_t[pos > 0.99] = -2
+    conf = torch.randn(args.batch * len(priors), num_classes, device=device) * 2
+    print('{:>8s} {:>6s} {:>10s} {:>10s}'.format('distr', 'fused', 'time', 'peak'))
+    for distr in ['sigmoid', 'softmax']:
+        for fused in [False, True]:
+            loss_cfg = AttrDict(cfg.LOSS)
+            loss_cfg.update(dict(CONF_DISTR=distr, FUSED=fused))
+            criterion = FocalLoss(matcher, priors, torch.cuda.is_available(), loss_cfg)
+
+            def step():
+                inputs = conf.clone().requires_grad_()
+                loss = criterion.focal_loss(inputs, conf_t.clone())
+                loss.backward()
+                return loss.detach(), inputs.grad
+            _, ms = _time(step, args.repeat)
+            _, peak = _peak_memory(step)
+            print('{:>8s} {:>6s} {:>8.2f}ms {:>8.1f}MB'.format(distr, str(fused), ms, peak))
+
+
+def benchmark_mining(args):
+    from lib.layers.modules.multibox_loss import hard_negatives
+    num_priors = len(_shelf_priorbox().prior_set())
+    print('{:>8s} {:>6s} {:>10s} {:>10s}'.format('priors', 'batch', 'mining', 'time'))
+    for batch in [args.batch, 4 * args.batch]:
+        loss_c = torch.rand(batch, num_priors)
+        pos = torch.rand(batch, num_priors) < 0.02
+        loss_c[pos] = 0
+        num_neg = torch.clamp(3 * pos.long().sum(1, keepdim=True), max=num_priors - 1)
+
+        def double_sort():
+            _, loss_idx = loss_c.sort(1, descending=True)
+            _, idx_rank = loss_idx.sort(1)
+            return idx_rank < num_neg.expand_as(idx_rank)
+        _, ms = _time(double_sort, args.repeat)
+        print('{:>8d} {:>6d} {:>10s} {:>8.2f}ms'.format(num_priors, batch, 'sort', ms))
+        _, ms = _time(lambda: hard_negatives(loss_c, num_neg), args.repeat)
+        print('{:>8d} {:>6d} {:>10s} {:>8.2f}ms'.format(num_priors, batch, 'topk', ms))
+
+
+def benchmark_decode(args):
+    import cv2
+    import numpy as np
+    from lib.utils.image_io import decode_reduced
+    from lib.utils.data_augment import min_crop_ratio
+    input_size = (800, 600)
+    train_size = [int(np.ceil(s / min_crop_ratio())) for s in input_size]
+    print('{:>10s} {:>12s} {:>10s} {:>12s}'.format('photo', 'decode', 'time', 'decoded'))
+    for width, height in [(1200, 900), (2400, 1800), (4032, 3024)]:
+        # smooth content compresses like a photo, noise would not
+        small = np.random.randint(0, 256, (height // 32, width // 32, 3)).astype(np.uint8)
+        photo = cv2.GaussianBlur(cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC), (5, 5), 0)
+        data = cv2.imencode('.jpg', photo, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+        name = '{}x{}'.format(width, height)
+        image, ms = _time(lambda: cv2.resize(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR),
+                                             input_size), args.repeat)
+        print('{:>10s} {:>12s} {:>8.2f}ms {:>12s}'.format(name, 'full+resize', ms, '-'))
+        for case, min_size in [('test', input_size), ('train', train_size)]:
+            (image, _), ms = _time(lambda: decode_reduced(data, min_size), args.repeat)
+            print('{:>10s} {:>12s} {:>8.2f}ms {:>12s}'.format(
+                name, 'reduced ' + case, ms, '{}x{}'.format(image.shape[1], image.shape[0])))
+
+
+def benchmark_crop(args):
+    import random
+    import numpy as np
+    from lib.utils.data_augment import _crop, _crop_search, _crop_search_loop
+
+    class _Preproc(object):
+        ambigous_skus = [2, 3, 4]
+        ambigous_skus_crop_ratio = 0.02
+    image = np.zeros((900, 1200, 3), dtype=np.uint8)
+    samples = 200 * args.repeat
+    print('{:>6s} {:>10s} {:>12s} {:>10s} {:>10s}'.format('boxes', 'search', 'per sample', 'crop area', 'kept'))
+    for num_boxes in [5, 30, 100]:
+        # small shelf skus, the crops are searched for them
+        wh = np.random.uniform(30, 80, (num_boxes, 2))
+        xy = np.random.uniform(0, 1, (num_boxes, 2)) * ([1200, 900] - wh)
+        boxes = np.hstack((xy, xy + wh))
+        labels = np.random.randint(1, 37, num_boxes).astype(np.float64)
+        for name, search in [('loop', _crop_search_loop), ('vectorized', _crop_search)]:
+            random.seed(0)
+
+            def run():
+                stats = []
+                for _ in range(samples):
+                    image_t, boxes_t, _ = _crop(_Preproc, image, boxes.copy(), labels.copy(), search)
+                    stats.append((image_t.shape[0] * image_t.shape[1] / (900. * 1200), len(boxes_t)))
+                return np.mean(stats, 0)
+            (area, kept), ms = _time(run, 1)
+            print('{:>6d} {:>10s} {:>10.3f}ms {:>10.3f} {:>10.1f}'.format(num_boxes, name, ms / samples, area, kept))
+
+
+def benchmark_warp(args):
+    import random
+    import numpy as np
+    from lib.utils.data_augment import preproc
+
+    image = np.random.randint(0, 256, (1800, 2400, 3)).astype(np.uint8)
+    wh = np.random.uniform(60, 160, (60, 2))
+    xy = np.random.uniform(0, 1, (60, 2)) * ([2400, 1800] - wh)
+    targets = np.hstack((xy, xy + wh, np.random.randint(1, 37, (60, 1))))
+    samples = 20 * args.repeat
+    print('{:>12s} {:>12s} {:>10s} {:>10s}'.format('warp', 'per sample', 'kept', 'mean px'))
+    for name, options in [('staged', {}), ('fused', {'fused': True}), ('plan 1.25', {'plan_margin': 1.25})]:
+        transform = preproc([300, 300], (104, 117, 123), 0.6, **options)
+        random.seed(0)
+
+        def run():
+            stats = []
+            for _ in range(samples):
+                image_t, targets_t = transform(image.copy(), targets.copy())
+                stats.append((len(targets_t), float(image_t.mean())))
+            return np.mean(stats, 0)
+        (kept, mean), ms = _time(run, 1)
+        print('{:>12s} {:>10.3f}ms {:>10.1f} {:>10.2f}'.format(name, ms / samples, kept, mean))
+
+
+def benchmark_photometric(args):
+    import cv2
+    import numpy as np
+    import imgaug.augmenters as iaa
+    from lib.utils import photometric as ph
+
+    def float_convert(image, alpha=1, beta=0):
+        # the float64 round-trip _distort used before the lookup tables
+        return np.uint8(np.clip(image.astype(float) * alpha + beta, 0, 255))
+
+    def float_saturation(image, alpha):
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        image[:, :, 1] = float_convert(image[:, :, 1], alpha)
+        return cv2.cvtColor(image, cv2.COLOR_HSV2BGR)
+
+    def lut_saturation(image, alpha):
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        image = cv2.LUT(image, ph.channel_lut(ph.linear_lut(alpha), 1))
+        return cv2.cvtColor(image, cv2.COLOR_HSV2BGR)
+
+    image = np.random.randint(0, 256, (300, 300, 3)).astype(np.uint8)
+    ops = [
+        ('brightness', lambda im: float_convert(im, 1.2, 10), lambda im: cv2.LUT(im, ph.linear_lut(1.2, 10))),
+        ('saturation', lambda im: float_saturation(im, 1.2), lambda im: lut_saturation(im, 1.2)),
+        ('gaussian', iaa.GaussianBlur(sigma=0.8).augment_image, lambda im: ph.gaussian_blur(im, 0.8)),
+        ('average', iaa.AverageBlur(k=4).augment_image, lambda im: ph.average_blur(im, 4)),
+        ('sharpen', iaa.Sharpen(alpha=0.3, lightness=1.2).augment_image, lambda im: ph.sharpen(im, 0.3, 1.2)),
+        ('noise', iaa.AdditiveGaussianNoise(scale=3, per_channel=True).augment_image,
+         lambda im: ph.additive_noise(im, 3, True)),
+        ('contrast', iaa.ContrastNormalization(1.1).augment_image, lambda im: ph.contrast(im, 1.1)),
+    ]
+    samples = 100 * args.repeat
+    print('{:>11s} {:>14s} {:>14s}'.format('op', 'before img/s', 'after img/s'))
+    for name, before, after in ops:
+        rates = []
+        for fn in (before, after):
+            _, ms = _time(lambda: [fn(image.copy()) for _ in range(samples)][-1], 1)
+            rates.append(samples * 1000. / ms)
+        print('{:>11s} {:>14.0f} {:>14.0f}'.format(name, rates[0], rates[1]))
+
+
+def benchmark_rotation(args):
+    import math
+    import numpy as np
+    from lib.utils.data_augment import _rotate_boxes, _rotate_boxes_loop
+
+    width, height = 2400, 1800
+    print('{:>6s} {:>8s} {:>10s} {:>10s}'.format('boxes', 'dtype', 'loop', 'vectorized'))
+    for dtype in (np.float64, np.float32):
+        rng = np.random.RandomState(0)
+        for num_boxes in [10, 100, 300]:
+            # boxes up to the image sides, some are clipped after the rotation
+            wh = rng.uniform(20, 400, (num_boxes, 2))
+            xy = rng.uniform(0, 1, (num_boxes, 2)) * ([width, height] - wh)
+            boxes = np.hstack((xy, xy + wh)).astype(dtype)
+            times = [0., 0.]
+            for a in range(1, 6):
+                top = int(width * math.sin(a * math.pi / 180.0))
+                right = int(height * math.sin(a * math.pi / 180.0))
+                for k, fn in enumerate((_rotate_boxes_loop, _rotate_boxes)):
+                    _, ms = _time(lambda: fn(boxes, a, top, width + right, height + top), args.repeat)
+                    times[k] += ms / 5
+            print('{:>6d} {:>8s} {:>8.3f}ms {:>8.3f}ms'.format(num_boxes, np.dtype(dtype).name, times[0], times[1]))
+
+
+def benchmark_uint8(args):
+    import pickle
+    import numpy as np
+    from lib.utils.data_augment import _preproc_for_test_with_resized_img, normalize_batch
+    from lib.dataset.dataset_factory import detection_collate
+
+    means = (103.94, 116.78, 123.68)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    image = np.random.randint(0, 256, (600, 800, 3)).astype(np.uint8)
+    targets = np.random.rand(50, 5)
+    print('{:>6s} {:>10s} {:>10s} {:>10s} {:>12s}'.format('batch', 'ipc MB', 'collate', 'to device', 'normalize'))
+    for mean in [means, None]:
+        batch = [(torch.from_numpy(_preproc_for_test_with_resized_img(image, mean)), targets)
+                 for _ in range(args.batch)]
+        # what the workers send through the DataLoader queue
+        ipc = len(pickle.dumps(batch[0][0].numpy(), protocol=pickle.HIGHEST_PROTOCOL)) * args.batch / 1e6
+        (images, _), collate_ms = _time(lambda: detection_collate(batch), args.repeat)
+        if device == 'cuda':
+            images = images.pin_memory()
+            torch.cuda.synchronize()
+
+        def to_device():
+            out = images.to(device, non_blocking=True)
+            if device == 'cuda':
+                torch.cuda.synchronize()
+            return out
+        on_device, copy_ms = _time(to_device, args.repeat)
+
+        def normalize():
+            out = normalize_batch(on_device, means)
+            if device == 'cuda':
+                torch.cuda.synchronize()
+            return out
+        _, normalize_ms = _time(normalize, args.repeat)
+        print('{:>6s} {:>10.1f} {:>8.2f}ms {:>8.2f}ms {:>10.2f}ms'.format(
+            'float' if mean else 'uint8', ipc, collate_ms, copy_ms, normalize_ms))
+
+
+def benchmark_input(args):
+    import numpy as np
+    from lib.utils.data_augment import _preproc_for_test_with_resized_img
+    from lib.layers.modules.image_input import ImageInput
+
+    means = (103.94, 116.78, 123.68)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    image = np.random.randint(0, 256, (800, 600, 3)).astype(np.uint8)
+    image_input = ImageInput(means, hwc=True).to(device)
+
+    def sync(x):
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        return x
+    print('{:>8s} {:>12s} {:>10s} {:>10s}'.format('input', 'preprocess', 'to device', 'total'))
+    for name in ['float', 'uint8']:
+        if name == 'float':
+            x, pre_ms = _time(lambda: torch.from_numpy(_preproc_for_test_with_resized_img(image, means)).unsqueeze(0),
+                              args.repeat)
+            _, dev_ms = _time(lambda: sync(x.to(device)), args.repeat)
+        else:
+            x, pre_ms = _time(lambda: torch.from_numpy(image).unsqueeze(0), args.repeat)
+            _, dev_ms = _time(lambda: sync(image_input(x.to(device))), args.repeat)
+        print('{:>8s} {:>10.2f}ms {:>8.2f}ms {:>8.2f}ms'.format(name, pre_ms, dev_ms, pre_ms + dev_ms))
+
+
+def benchmark_targets(args):
+    import numpy as np
+    from lib.dataset.dataset_factory import detection_collate, padded_collate
+    from lib.utils.box_utils import pad_targets
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    image = torch.zeros(3, 8, 8)
+    batch = [(image, np.random.rand(np.random.randint(100, 300), 5)) for _ in range(args.batch)]
+
+    def sync(x):
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        return x
+    print('{:>8s} {:>10s} {:>10s} {:>10s}'.format('targets', 'collate', 'to device', 'pad'))
+    for name, collate in [('list', detection_collate), ('padded', padded_collate)]:
+        (_, targets), collate_ms = _time(lambda: collate(batch), args.repeat)
+        if device == 'cuda':
+            targets = [t.pin_memory() for t in targets] if name == 'list' else tuple(t.pin_memory() for t in targets)
+
+        def to_device():
+            if name == 'list':
+                return sync([t.to(device, non_blocking=True) for t in targets])
+            return sync(tuple(t.to(device, non_blocking=True) for t in targets))
+        on_device, copy_ms = _time(to_device, args.repeat)
+        _, pad_ms = _time(lambda: sync(pad_targets(on_device)), args.repeat)
+        print('{:>8s} {:>8.3f}ms {:>8.3f}ms {:>8.3f}ms'.format(name, collate_ms, copy_ms, pad_ms))
+
+
+benchmarks = {
+                'targets': benchmark_targets,
+                'input': benchmark_input,
+                'uint8': benchmark_uint8,
+                'rotation': benchmark_rotation,
+                'photometric': benchmark_photometric,
+                'warp': benchmark_warp,
+                'crop': benchmark_crop,
+                'focal': benchmark_focal,
+                'nms': benchmark_nms,
+                'detect': benchmark_detect,
+                'priors': benchmark_priors,
+                'match': benchmark_match,
+                'match_batch': benchmark_match_batch,
+                'mining': benchmark_mining,
+                'decode': benchmark_decode,
+            }
+
+if __name__ == '__main__':
+    args = parse_args()
+    benchmarks[args.bench](args)
@@ -10,7 +10,8 @@ if '/data/software/opencv-3.3.1/lib/python2.7/dist-packages' in sys.path:
 import cv2
 
 from lib.ssds import ObjectDetector
-from lib.utils.config_parse import cfg_from_file
+from lib.utils.config_parse import cfg_from_file, cfg
+from lib.utils.image_io import imread_reduced
 
 VOC_CLASSES = ( 'aeroplane', 'bicycle', 'bird', 'boat',
     'bottle', 'bus', 'car', 'cat', 'chair',
@@ -52,7 +53,7 @@ def demo(args, image_path):
     # 2. load detector based on the configure file
     object_detector = ObjectDetector()
 
-    # 3. load image
+    # 3. load image, at full resolution since the detections are drawn on it
     image = cv2.imread(image_path)
 
     # 4. detect
@@ -126,7 +127,7 @@ def time_benchmark(args, image_path):
     object_detector = ObjectDetector()
 
     # 3. load image
-    image = cv2.imread(image_path)
+    image, _ = imread_reduced(image_path, cfg.MODEL.IMAGE_SIZE[::-1])
 
     # 4. time test
     warmup = 20
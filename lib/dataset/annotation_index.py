@@ -0,0 +1,148 @@
+import os
+import json
+import multiprocessing
+import numpy as np
+
+
+def file_stamp(path):
+    """(mtime, size) of a file, an annotation is parsed again when it changes"""
+    st = os.stat(path)
+    return st.st_mtime, st.st_size
+
+
+def _parse_all(parse, sources, workers):
+    if workers > 1 and len(sources) > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            return pool.map(parse, sources, chunksize=max(1, len(sources) // (workers * 4)))
+        finally:
+            pool.close()
+            pool.join()
+    return [parse(source) for source in sources]
+
+
+class AnnotationIndex(object):
+    """Annotations of a dataset as flat arrays, the targets of image i are
+    boxes[offsets[i]:offsets[i+1]] and labels[offsets[i]:offsets[i+1]].
+    The arrays are saved as .npy files in index_dir and memory-mapped, the
+    DataLoader workers share their pages instead of parsing the annotation
+    files on every sample.
+
+    Arguments:
+        keys (list): image keys, in dataset order
+        boxes (ndarray): float32 boxes, Shape: [num_boxes,4]
+        labels (ndarray): int32 labels, Shape: [num_boxes]
+        offsets (ndarray): int64 start of the boxes of each image, Shape: [num_images+1]
+        stamps (ndarray): float64 (mtime, size) of each source, Shape: [num_images,2]
+        tag (string): what else the targets depend on (e.g. the class mapping)
+    """
+    _arrays = ('boxes', 'labels', 'offsets', 'stamps')
+
+    def __init__(self, keys, boxes, labels, offsets, stamps, tag=''):
+        self.keys = keys
+        self.boxes = boxes
+        self.labels = labels
+        self.offsets = offsets
+        self.stamps = stamps
+        self.tag = tag
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, index):
+        """target of image index, [[xmin, ymin, xmax, ymax, label_ind], ... ]"""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        target = np.empty((end - start, 5))
+        target[:, :4] = self.boxes[start:end]
+        target[:, 4] = self.labels[start:end]
+        return target
+
+    @classmethod
+    def load(cls, index_dir):
+        """Memory-mapped index saved in index_dir, None when there is none or
+        it is incomplete"""
+        try:
+            with open(os.path.join(index_dir, 'meta.json'), 'r') as f:
+                meta = json.load(f)
+            arrays = [np.load(os.path.join(index_dir, name + '.npy'), mmap_mode='r') for name in cls._arrays]
+        except (IOError, OSError, ValueError):
+            return None
+        index = cls(meta['keys'], *arrays, tag=meta['tag'])
+        if len(index.offsets) != len(index.keys) + 1 or len(index.stamps) != len(index.keys) or \
+                index.offsets[-1] != len(index.boxes) or len(index.boxes) != len(index.labels):
+            return None
+        return index
+
+    def save(self, index_dir):
+        """write aside and rename, meta.json last so that load never sees a partial index"""
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+        tmp = '.{}.tmp'.format(os.getpid())
+        for name in self._arrays:
+            path = os.path.join(index_dir, name + '.npy')
+            with open(path + tmp, 'wb') as f:
+                np.save(f, getattr(self, name))
+            os.rename(path + tmp, path)
+        path = os.path.join(index_dir, 'meta.json')
+        with open(path + tmp, 'w') as f:
+            json.dump({'keys': self.keys, 'tag': self.tag}, f)
+        os.rename(path + tmp, path)
+
+    @classmethod
+    def build(cls, index_dir, keys, sources, parse, stamps=None, tag='', workers=0):
+        """Index of the images keys, updated from the one saved in index_dir:
+        only the images that are new or whose stamp changed are parsed, by
+        workers processes.
+
+        Arguments:
+            keys (list): image keys, in dataset order
+            sources (list): what parse reads the target of each image from
+            parse (callable): source -> [[xmin, ymin, xmax, ymax, label_ind], ... ],
+                picklable when workers > 1
+            stamps (list): (mtime, size) of each image, file_stamp of the sources by default
+            tag (string): the saved index is dropped when its tag differs
+        Return:
+            the index, memory-mapped when it could be saved
+        """
+        if stamps is None:
+            stamps = [file_stamp(source) for source in sources]
+        stamps = np.array(stamps, dtype=np.float64).reshape(-1, 2)
+        old = cls.load(index_dir)
+        if old is not None and old.tag != tag:
+            old = None
+        old_pos = {key: i for i, key in enumerate(old.keys)} if old is not None else {}
+
+        reuse = [old_pos.get(key) for key in keys]
+        reuse = [i if i is not None and np.array_equal(old.stamps[i], stamps[k]) else None
+                 for k, i in enumerate(reuse)]
+        if old is not None and reuse == list(range(len(old))):
+            return old
+
+        todo = [k for k, i in enumerate(reuse) if i is None]
+        if todo:
+            print('parsing {} annotations for {}'.format(len(todo), index_dir))
+        parsed = dict(zip(todo, _parse_all(parse, [sources[k] for k in todo], workers)))
+        boxes, labels, counts = [], [], []
+        for k, i in enumerate(reuse):
+            if i is None:
+                target = np.asarray(parsed[k], dtype=np.float64).reshape(-1, 5)
+                boxes.append(target[:, :4])
+                labels.append(target[:, 4])
+            else:
+                start, end = old.offsets[i], old.offsets[i + 1]
+                boxes.append(old.boxes[start:end])
+                labels.append(old.labels[start:end])
+            counts.append(len(labels[-1]))
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        index = cls(list(keys),
+                    np.concatenate(boxes).astype(np.float32).reshape(-1, 4) if boxes else np.zeros((0, 4), np.float32),
+                    np.concatenate(labels).astype(np.int32) if labels else np.zeros(0, np.int32),
+                    offsets, stamps, tag)
+        try:
+            index.save(index_dir)
+        except (IOError, OSError) as e:
+            print('annotation index is not saved to {}: {}'.format(index_dir, e))
+            return index
+        saved = cls.load(index_dir)
+        return saved if saved is not None else index
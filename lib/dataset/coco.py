@@ -11,6 +11,9 @@ import json
 import uuid
 
 from lib.utils.pycocotools.coco import COCO
+from .annotation_index import AnnotationIndex, file_stamp
+from .image_cache import ImageCache
+from lib.utils.image_io import imread_reduced
 from lib.utils.pycocotools.cocoeval import COCOeval
 #from lib.utils.pycocotools import mask as COCOmask
 
@@ -31,10 +34,15 @@ class COCODetection(data.Dataset):
             (eg: take in caption string, return tensor of word indices)
         dataset_name (string, optional): which dataset to load
             (default: 'VOC2007')
+        image_cache (tuple, optional): (byte budget, max side) of the decoded
+            images shared by the workers, no cache when the budget is 0
+        decode_size (tuple, optional): (width, height) the images must keep,
+            the jpegs are decoded reduced down to it
     """
 
     def __init__(self, root, image_sets, preproc=None, target_transform=None,
-                 dataset_name='COCO'):
+                 dataset_name='COCO', annotation_index=False, image_cache=(0, 0),
+                 decode_size=None):
         self.root = root
         self.cache_path = os.path.join(self.root, 'cache')
         self.image_set = image_sets
@@ -43,6 +51,7 @@ class COCODetection(data.Dataset):
         self.name = dataset_name
         self.ids = list()
         self.annotations = list()
+        stamps = list()
         self._view_map = {
             'minival2014' : 'val2014',          # 5k val2014 subset
             'valminusminival2014' : 'val2014',  # val2014 \setminus minival2014
@@ -77,6 +86,16 @@ class COCODetection(data.Dataset):
                 print('test set will not load annotations!')
             else:
                 self.annotations.extend(self._load_coco_annotations(coco_name, indexes,_COCO))
+                stamps.extend([file_stamp(annofile)] * len(indexes))
+        if annotation_index and self.annotations:
+            # flat memory-mapped arrays shared by the workers instead of one array per image
+            roidb = self.annotations
+            index_dir = os.path.join(self.cache_path, '_'.join(s + y for y, s in image_sets) + '_anno_index')
+            self.annotations = AnnotationIndex.build(index_dir, self.ids, range(len(roidb)), roidb.__getitem__,
+                                                     stamps=stamps, tag=repr(self._classes))
+        self.decode_size = decode_size
+        cache_bytes, cache_max_side = image_cache
+        self.image_cache = ImageCache(len(self.ids), cache_bytes, cache_max_side) if cache_bytes > 0 else None
 
 
     def image_path_from_index(self, name, index):
@@ -186,10 +205,15 @@ class COCODetection(data.Dataset):
         #     if index < lens:
         #         break
         # img_id = self.image_path_from_index(name, self.ids[index])
-        img_id = self.ids[index]
         target = self.annotations[index]
 
-        img = cv2.imread(img_id, cv2.IMREAD_COLOR)
+        if self.image_cache is not None:
+            img, (scale_x, scale_y) = self.image_cache.read(index, lambda: self._read_image(index, self.decode_size))
+        else:
+            img, (scale_x, scale_y) = self._read_image(index, self.decode_size)
+        if scale_x != 1 or scale_y != 1:
+            # the roidb arrays are kept, scale a copy
+            target = target * np.array([scale_x, scale_y, scale_x, scale_y, 1])
         height, width, _ = img.shape
 
         if self.target_transform is not None:
@@ -207,6 +231,13 @@ class COCODetection(data.Dataset):
     def __len__(self):
         return len(self.ids)
 
+    def _read_image(self, index, decode_size=None):
+        """image index and its (x, y) scale to the full resolution, reduced
+        towards decode_size (width, height) when given"""
+        if decode_size:
+            return imread_reduced(self.ids[index], decode_size)
+        return cv2.imread(self.ids[index], cv2.IMREAD_COLOR), (1.0, 1.0)
+
     def pull_image(self, index):
         '''Returns the original image object at index in PIL form
 
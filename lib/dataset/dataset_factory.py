@@ -1,10 +1,12 @@
 from lib.dataset import voc
 from lib.dataset import newspage_dataset
+from lib.dataset import sharded_np_dataset
 #from lib.dataset import coco
 
 dataset_map = {
                 'voc': voc.VOCDetection,
-                'np':  newspage_dataset.NPSet
+                'np':  newspage_dataset.NPSet,
+                'np_shards': sharded_np_dataset.ShardedNPSet,
                 #'coco': coco.COCODetection,
             }
 
@@ -53,28 +55,97 @@ def detection_collate(batch):
 
     return (torch.stack(imgs, 0), targets)
 
-from lib.utils.data_augment import preproc
+
+from torch.nn.utils.rnn import pad_sequence
+
+def padded_collate(batch):
+    """detection_collate with the annotations of the batch in one padded
+    tensor, pinned and copied to the device in one go with the images.
+
+    Return:
+        A tuple containing:
+            1) (tensor) batch of images stacked on their 0 dim
+            2) (tuple) annotations padded with zeros, Shape: [batch,max_num_obj,5],
+               and the number of annotations of every image, Shape: [batch]
+    """
+    images, targets = detection_collate(batch)
+    # on the cpu whatever the default tensor type, the workers must not touch cuda
+    lengths = torch.LongTensor([anno.size(0) for anno in targets])
+    return images, (pad_sequence(targets, batch_first=True), lengths)
+
+
+from lib.utils.box_utils import pad_targets, match_batch
+
+class MatchingCollate(object):
+    """detection_collate that also matches the annotations to the priors and
+    encodes them, so that the matching runs in the DataLoader workers. The
+    batch is (images, targets, loc_t, conf_t), the targets of the loss
+    (match_with_ignorance, or match when the thresholds are equal).
+
+    Arguments:
+        priors: (PriorSet) Prior boxes on the cpu, the workers must not touch cuda.
+        cfg: (AttrDict) The MATCHER options.
+        padded: (bool) targets padded by padded_collate instead of a list
+    """
+    def __init__(self, priors, cfg, padded=False):
+        self.priors = priors
+        self.collate = padded_collate if padded else detection_collate
+        self.threshold = cfg.MATCHED_THRESHOLD
+        self.unmatched_threshold = cfg.UNMATCHED_THRESHOLD
+        self.variance = cfg.VARIANCE
+
+    def __call__(self, batch):
+        images, targets = self.collate(batch)
+        truths, labels, lengths = pad_targets(targets)
+        loc_t, conf_t = match_batch(self.threshold, self.unmatched_threshold,
+                                    truths, labels, lengths, self.priors, self.variance)
+        return images, targets, loc_t, conf_t
+
+
+import math
+from lib.utils.data_augment import preproc, min_crop_ratio
 import torch.utils.data as data
 
 def load_data(cfg, phase):
+    """DataLoader of a phase. The priors are only known once the model is
+    built, Solver then sets a MatchingCollate as the collate_fn of the train
+    loader (DATASET.MATCH_IN_WORKERS).
+    """
     if phase == 'train':
         #print('train')
         #print(cfg)
         #print(cfg.AMBIGOUS_SKUS)
-        dataset = dataset_map[cfg.DATASET](cfg.DATASET_DIR, cfg.TRAIN_SETS, preproc(cfg.IMAGE_SIZE, cfg.PIXEL_MEANS, cfg.PROB, None, cfg.AMBIGOUS_SKUS, cfg.AMBIGOUS_SKUS_CROP_RATIO))
+        options = dict(annotation_index=cfg.ANNOTATION_INDEX)
+        if cfg.REDUCED_DECODE:
+            # the smallest crop must still cover the network input
+            options['decode_size'] = [int(math.ceil(s / min_crop_ratio())) for s in cfg.IMAGE_SIZE[::-1]]
+        if cfg.IMAGE_CACHE_BYTES > 0:
+            options['image_cache'] = (cfg.IMAGE_CACHE_BYTES, cfg.IMAGE_CACHE_MAX_SIDE)
+        transform = preproc(cfg.IMAGE_SIZE, cfg.PIXEL_MEANS, cfg.PROB, None, cfg.AMBIGOUS_SKUS, cfg.AMBIGOUS_SKUS_CROP_RATIO,
+                            fused=cfg.FUSED_WARP, fast_photometric=cfg.FAST_PHOTOMETRIC,
+                            plan_margin=cfg.PLAN_MARGIN, uint8=cfg.UINT8_BATCHES)
+        dataset = dataset_map[cfg.DATASET](cfg.DATASET_DIR, cfg.TRAIN_SETS, transform, **options)
 
+        collate = padded_collate if cfg.PADDED_TARGETS else detection_collate
         data_loader = data.DataLoader(dataset, cfg.TRAIN_BATCH_SIZE, num_workers=cfg.NUM_WORKERS,
-                                  shuffle=True, collate_fn=detection_collate, pin_memory=True)
+                                  shuffle=True, collate_fn=collate, pin_memory=True)
     if phase == 'eval':
-        dataset = dataset_map[cfg.DATASET](cfg.DATASET_DIR, cfg.TEST_SETS, preproc(cfg.IMAGE_SIZE, cfg.PIXEL_MEANS, -1))
+        options = dict(annotation_index=cfg.ANNOTATION_INDEX)
+        if cfg.REDUCED_DECODE:
+            options['decode_size'] = cfg.IMAGE_SIZE[::-1]
+        dataset = dataset_map[cfg.DATASET](cfg.DATASET_DIR, cfg.TEST_SETS, preproc(cfg.IMAGE_SIZE, cfg.PIXEL_MEANS, -1, uint8=cfg.UINT8_BATCHES),
+                                           **options)
+        collate = padded_collate if cfg.PADDED_TARGETS else detection_collate
         data_loader = data.DataLoader(dataset, cfg.TEST_BATCH_SIZE, num_workers=cfg.NUM_WORKERS,
-                                  shuffle=False, collate_fn=detection_collate, pin_memory=True)
+                                  shuffle=False, collate_fn=collate, pin_memory=True)
     if phase == 'test':
-        dataset = dataset_map[cfg.DATASET](cfg.DATASET_DIR, cfg.TEST_SETS, preproc(cfg.IMAGE_SIZE, cfg.PIXEL_MEANS, -2))
+        dataset = dataset_map[cfg.DATASET](cfg.DATASET_DIR, cfg.TEST_SETS, preproc(cfg.IMAGE_SIZE, cfg.PIXEL_MEANS, -2),
+                                           annotation_index=cfg.ANNOTATION_INDEX)
         data_loader = data.DataLoader(dataset, cfg.TEST_BATCH_SIZE, num_workers=cfg.NUM_WORKERS,
                                   shuffle=False, collate_fn=detection_collate, pin_memory=True)
     if phase == 'visualize':
-        dataset = dataset_map[cfg.DATASET](cfg.DATASET_DIR, cfg.TEST_SETS, preproc(cfg.IMAGE_SIZE, cfg.PIXEL_MEANS, 1))
+        dataset = dataset_map[cfg.DATASET](cfg.DATASET_DIR, cfg.TEST_SETS, preproc(cfg.IMAGE_SIZE, cfg.PIXEL_MEANS, 1),
+                                           annotation_index=cfg.ANNOTATION_INDEX)
         data_loader = data.DataLoader(dataset, cfg.TEST_BATCH_SIZE, num_workers=cfg.NUM_WORKERS,
                                   shuffle=False, collate_fn=detection_collate, pin_memory=True)
     return data_loader
@@ -0,0 +1,92 @@
+import mmap
+import multiprocessing
+import cv2
+import numpy as np
+
+
+class ImageCache(object):
+    """LRU cache of decoded images shared by the DataLoader workers.
+
+    The pixels live in fixed size slots of an anonymous shared mapping and
+    the bookkeeping in shared arrays, all created before the workers fork,
+    so an image decoded by one worker is served to all of them. Images are
+    downscaled to max_side so that a slot holds max_side*max_side*3 bytes.
+
+    Arguments:
+        num_images (int): number of distinct images of the dataset
+        budget (int): bytes of pixels the cache may hold
+        max_side (int): longest side of the cached images
+    """
+
+    def __init__(self, num_images, budget, max_side):
+        self.num_images = num_images
+        self.max_side = max_side
+        self.slot_bytes = max_side * max_side * 3
+        self.num_slots = max(1, min(num_images, budget // self.slot_bytes))
+        self._pixels = mmap.mmap(-1, self.num_slots * self.slot_bytes)
+        self._lock = multiprocessing.Lock()
+
+        def shared(size, dtype):
+            return np.frombuffer(multiprocessing.RawArray('b', size * np.dtype(dtype).itemsize), dtype=dtype)
+        self._clock = shared(1, np.int64)
+        # slot of each image and image of each slot, -1 when none
+        self._slot = shared(num_images, np.int32)
+        self._slot[:] = -1
+        self._owner = shared(self.num_slots, np.int32)
+        self._owner[:] = -1
+        self._last_used = shared(self.num_slots, np.int64)
+        # cached (height, width) of each image and its (x, y) scale to the full resolution
+        self._shape = shared(num_images * 2, np.int32).reshape(num_images, 2)
+        self._scale = shared(num_images * 2, np.float64).reshape(num_images, 2)
+
+    def _slot_array(self, slot, height, width):
+        return np.frombuffer(self._pixels, dtype=np.uint8, count=height * width * 3,
+                             offset=slot * self.slot_bytes).reshape(height, width, 3)
+
+    def get(self, index):
+        """copy of the cached image index and its (x, y) scale, None when missing"""
+        with self._lock:
+            slot = self._slot[index]
+            if slot < 0:
+                return None
+            self._clock[0] += 1
+            self._last_used[slot] = self._clock[0]
+            height, width = self._shape[index]
+            return self._slot_array(slot, height, width).copy(), tuple(self._scale[index])
+
+    def put(self, index, image, image_scale=(1.0, 1.0)):
+        """caches image index downscaled to max_side (evicting the least recently
+        used image when full). image_scale is the (x, y) scale image already
+        has to the full resolution. Returns the cached image and its scale."""
+        orig_height, orig_width = image.shape[:2]
+        scale = float(self.max_side) / max(orig_height, orig_width)
+        if scale < 1:
+            image = cv2.resize(image, (max(1, min(self.max_side, int(round(orig_width * scale)))),
+                                       max(1, min(self.max_side, int(round(orig_height * scale))))),
+                               interpolation=cv2.INTER_AREA)
+        height, width = image.shape[:2]
+        image_scale = (image_scale[0] * width / float(orig_width), image_scale[1] * height / float(orig_height))
+        with self._lock:
+            if self._slot[index] >= 0:
+                return image, image_scale
+            free = np.flatnonzero(self._owner < 0)
+            slot = free[0] if len(free) else int(np.argmin(self._last_used))
+            if self._owner[slot] >= 0:
+                self._slot[self._owner[slot]] = -1
+            self._slot_array(slot, height, width)[...] = image
+            self._shape[index] = (height, width)
+            self._scale[index] = image_scale
+            self._owner[slot] = index
+            self._slot[index] = slot
+            self._clock[0] += 1
+            self._last_used[slot] = self._clock[0]
+        return image, image_scale
+
+    def read(self, index, load):
+        """image index through the cache, decoded by load() when missing (which
+        returns the image and its (x, y) scale), returned with the factors
+        (x, y) the target boxes must be scaled by"""
+        cached = self.get(index)
+        if cached is None:
+            return self.put(index, *load())
+        return cached
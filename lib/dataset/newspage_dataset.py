@@ -9,7 +9,26 @@ import torch.utils.data as data
 import cv2
 import numpy as np
 import json
+import multiprocessing
+from functools import partial
 from .voc_eval import voc_ap
+from .annotation_index import AnnotationIndex
+from .image_cache import ImageCache
+from lib.utils.image_io import imread_reduced
+
+
+def _bndboxes_to_target(bndboxes, name_to_seq):
+    res = [[int(obj["x"]), int(obj["y"]), int(obj["x"]) + int(obj["w"]), int(obj["y"]) + int(obj["h"]),
+            name_to_seq[obj['id']]]
+           for obj in bndboxes
+           if not ("ignore" in obj.keys() and obj["ignore"]) and obj['id'] in name_to_seq]
+    return np.array(res, dtype=np.float64).reshape(-1, 5)  # [xmin, ymin, xmax, ymax, label_ind]
+
+
+def _read_target(anno_file, name_to_seq):
+    with open(anno_file, "r") as json_file:
+        json_data = json.load(json_file)
+    return _bndboxes_to_target(json_data["bndboxes"], name_to_seq)
 
 
 class NPSet(data.Dataset):
@@ -29,11 +48,18 @@ class NPSet(data.Dataset):
             (default: 'VOC2007')
     """
 
-    def __init__(self, root,  image_sets=None, preproc=None):
+    def __init__(self, root,  image_sets=None, preproc=None, annotation_index=False, image_cache=(0, 0),
+                 decode_size=None):
         self.root = root
         self.preproc = preproc
+        # (width, height) the photos must keep, jpegs are decoded reduced down to it
+        self.decode_size = decode_size
         self.name, self.name_to_seq, self.seq_to_name, self.name_to_desc= self._parse_templates()
         self.ids, self.photo_dir, self.anno_dir = self._find_image_annotation_pair()
+        self.annotations = self._load_annotation_index() if annotation_index else None
+        # (byte budget, max side) of the decoded images shared by the workers
+        cache_bytes, cache_max_side = image_cache
+        self.image_cache = ImageCache(len(self.ids), cache_bytes, cache_max_side) if cache_bytes > 0 else None
         #print("id of 181004142415 is ", self.ids.index("OEX_181004142415.jpg") )
         if image_sets and isinstance(image_sets,list) and isinstance(image_sets[0],int) :
             self.ids=self.ids*image_sets[0]
@@ -62,16 +88,33 @@ class NPSet(data.Dataset):
         assert os.path.exists(anno_path), "Annotation folder is not found at {}".format(anno_path)
 
         all_files = os.listdir(photos_path)
+        # one listing instead of a stat per photo
+        anno_files = set(os.listdir(anno_path))
         photo_files = []
         for file in all_files:
             up_file=file.upper()
             if not up_file.startswith("."):
                 if up_file.endswith('.JPG') or up_file.endswith('.JPEG'):
-                    if os.path.exists(os.path.join(anno_path,file+".json")):
+                    if file+".json" in anno_files:
                         photo_files.append(file)
 
         return photo_files, photos_path, anno_path
 
+    def _load_annotation_index(self):
+        """AnnotationIndex of the photos, kept in root/cache and updated for the
+        new or modified annotation files"""
+        index_dir = os.path.join(self.root, 'cache', 'annotation_index')
+        anno_files = [os.path.join(self.anno_dir, img_id + ".json") for img_id in self.ids]
+        return AnnotationIndex.build(index_dir, self.ids, anno_files,
+                                     partial(_read_target, name_to_seq=self.name_to_seq),
+                                     tag=json.dumps(self.seq_to_name), workers=multiprocessing.cpu_count())
+
+    def _target(self, index):
+        if self.annotations is not None:
+            # ids may be repeated, the index holds them once
+            return self.annotations[index % len(self.annotations)]
+        return _read_target(os.path.join(self.anno_dir, self.ids[index] + ".json"), self.name_to_seq)
+
     def _to_target(self, bndboxes):
         """return nparray, shape(n, 5)
                              [
@@ -79,24 +122,7 @@ class NPSet(data.Dataset):
                               [xmin, ymin,xmax, ymax, label]
                               ]
         """
-        res = np.empty((0, 5))
-        for obj in bndboxes:
-            if "ignore" in obj.keys() and obj["ignore"]:
-                continue
-            name = obj['id']
-            bndbox = [
-                      int(obj["x"]),
-                      int(obj["y"]),
-                      int(obj["w"]),
-                      int(obj["h"])
-            ]
-            bndbox[2]=bndbox[0]+bndbox[2]
-            bndbox[3]=bndbox[1]+bndbox[3]
-            if name in self.name_to_seq.keys():
-                label_idx = self.name_to_seq[name]
-                bndbox.append(label_idx)
-                res = np.vstack((res, bndbox))  # [xmin, ymin, xmax, ymax, label_ind]
-        return res
+        return _bndboxes_to_target(bndboxes, self.name_to_seq)
 
     def read_all_images(self):
         images = list()
@@ -121,11 +147,15 @@ class NPSet(data.Dataset):
         #         x=10
         img_id = self.ids[index]
 
-        with open(os.path.join(self.anno_dir,img_id+".json"),"r") as json_file:
-            json_data = json.load(json_file)
-        bndboxes=json_data["bndboxes"]
-        target = self._to_target(bndboxes)
-        img = cv2.imread(os.path.join(self.photo_dir, img_id), cv2.IMREAD_COLOR)
+        target = self._target(index)
+        if self.image_cache is not None:
+            img, (scale_x, scale_y) = self.image_cache.read(index % self.image_cache.num_images,
+                                                            lambda: self._read_image(index, self.decode_size))
+        else:
+            img, (scale_x, scale_y) = self._read_image(index, self.decode_size)
+        if scale_x != 1 or scale_y != 1:
+            target[:, 0:4:2] *= scale_x
+            target[:, 1:4:2] *= scale_y
         #target= self.targets[index]
         height, width, _ = img.shape
 
@@ -140,9 +170,17 @@ class NPSet(data.Dataset):
     def __len__(self):
         return len(self.ids)
 
-    def pull_image(self, index):
+    def _read_image(self, index, decode_size=None):
+        """image index and its (x, y) scale to the full resolution, reduced
+        towards decode_size (width, height) when given"""
         img_id = self.ids[index]
-        return cv2.imread(os.path.join(self.photo_dir, img_id), cv2.IMREAD_COLOR)
+        if decode_size:
+            return imread_reduced(os.path.join(self.photo_dir, img_id), decode_size)
+        return cv2.imread(os.path.join(self.photo_dir, img_id), cv2.IMREAD_COLOR), (1.0, 1.0)
+
+    def pull_image(self, index):
+        # full resolution, the detections are compared to the annotations
+        return self._read_image(index)[0]
 
 
 
@@ -158,12 +196,7 @@ class NPSet(data.Dataset):
             list:  [img_id, [(label, bbox coords),...]]
                 eg: ('001718', [('dog', (96, 13, 438, 332))])
         '''
-        img_id = self.ids[index]
-
-        with open(os.path.join(self.anno_dir, img_id + ".json"), "r") as json_file:
-            json_data = json.load(json_file)
-        bndboxes = json_data["bndboxes"]
-        anno = self._to_target(bndboxes)
+        anno = self._target(index)
         return anno
     #
     # def pull_img_anno(self, index):
@@ -416,9 +449,8 @@ class NPSet(data.Dataset):
                 output_fp.write("\n]}")
 
 
-    def do_python_eval(self):
+    def _ground_truths(self):
         ground_trues = {}   # {"image_oo1":[{name:sku_x,bbox:[xmin,ymin,xmax,ymax]},....], "image_002"}
-        self.save_np_result()
         for i, img_id in enumerate(self.ids):
             with open(os.path.join(self.anno_dir, img_id + ".json"), "r") as json_file:
                 json_data = json.load(json_file)
@@ -445,6 +477,11 @@ class NPSet(data.Dataset):
                     objects.append(obj_struct)
 
             ground_trues[img_id] = objects
+        return ground_trues
+
+    def do_python_eval(self):
+        self.save_np_result()
+        ground_trues = self._ground_truths()
 
         aps = []
         use_07_metric = True
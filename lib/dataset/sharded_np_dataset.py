@@ -0,0 +1,164 @@
+import os
+import mmap
+import json
+import cv2
+import numpy as np
+from .newspage_dataset import NPSet
+from .annotation_index import AnnotationIndex, file_stamp
+from .image_cache import ImageCache
+from lib.utils.image_io import decode_reduced
+
+
+def _shard_dir(root):
+    return os.path.join(root, 'shards')
+
+
+def _shard_tag(seq_to_name, max_side):
+    return json.dumps([seq_to_name, max_side])
+
+
+def _packed_stamp(anno_file, image_file):
+    """stamp of a packed target, which is scaled with the image when the
+    pixels are downscaled, so it changes with either file"""
+    return tuple(a + i for a, i in zip(file_stamp(anno_file), file_stamp(image_file)))
+
+
+def pack_shards(root, shard_bytes=256 << 20, max_side=0):
+    """Packs the photos and annotations of the NPSet at root into root/shards
+    for ShardedNPSet: shard_*.bin files of about shard_bytes holding the
+    images back to back, table.npy with the (shard, offset, size, height,
+    width) of every image and the annotation index.
+
+    Arguments:
+        root (string): the NPSet folder
+        shard_bytes (int): size at which a new shard is started
+        max_side (int): 0 keeps the encoded jpeg bytes, otherwise the images are
+            stored as raw uint8 pixels downscaled to max_side (and the boxes with them)
+    """
+    dataset = NPSet(root)
+    out_dir = _shard_dir(root)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    tmp = '.{}.tmp'.format(os.getpid())
+
+    table = np.zeros((len(dataset.ids), 5), dtype=np.int64)
+    targets = []
+    shards, out, offset = [], None, 0
+    for i, img_id in enumerate(dataset.ids):
+        path = os.path.join(dataset.photo_dir, img_id)
+        target = dataset._target(i)
+        height = width = 0
+        if max_side:
+            img = cv2.imread(path, cv2.IMREAD_COLOR)
+            scale = float(max_side) / max(img.shape[:2])
+            if scale < 1:
+                size = (max(1, int(round(img.shape[1] * scale))), max(1, int(round(img.shape[0] * scale))))
+                target[:, 0:4:2] *= size[0] / float(img.shape[1])
+                target[:, 1:4:2] *= size[1] / float(img.shape[0])
+                img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+            height, width = img.shape[:2]
+            data = np.ascontiguousarray(img).tobytes()
+        else:
+            with open(path, 'rb') as f:
+                data = f.read()
+        if out is None or (offset > 0 and offset + len(data) > shard_bytes):
+            if out is not None:
+                out.close()
+                os.rename(os.path.join(out_dir, shards[-1]) + tmp, os.path.join(out_dir, shards[-1]))
+            shards.append('shard_{:05d}.bin'.format(len(shards)))
+            out = open(os.path.join(out_dir, shards[-1]) + tmp, 'wb')
+            offset = 0
+        out.write(data)
+        table[i] = (len(shards) - 1, offset, len(data), height, width)
+        offset += len(data)
+        targets.append(target)
+    if out is not None:
+        out.close()
+        os.rename(os.path.join(out_dir, shards[-1]) + tmp, os.path.join(out_dir, shards[-1]))
+
+    stamps = [_packed_stamp(os.path.join(dataset.anno_dir, img_id + ".json"), os.path.join(dataset.photo_dir, img_id))
+              for img_id in dataset.ids]
+    AnnotationIndex.build(os.path.join(out_dir, 'annotation_index'), dataset.ids, range(len(targets)),
+                          targets.__getitem__, stamps=stamps,
+                          tag=_shard_tag(dataset.seq_to_name, max_side))
+    with open(os.path.join(out_dir, 'table.npy') + tmp, 'wb') as f:
+        np.save(f, table)
+    os.rename(os.path.join(out_dir, 'table.npy') + tmp, os.path.join(out_dir, 'table.npy'))
+    with open(os.path.join(out_dir, 'meta.json') + tmp, 'w') as f:
+        json.dump({'ids': dataset.ids, 'shards': shards, 'max_side': max_side}, f)
+    os.rename(os.path.join(out_dir, 'meta.json') + tmp, os.path.join(out_dir, 'meta.json'))
+    return out_dir
+
+
+class ShardedNPSet(NPSet):
+    """NPSet read from the shards pack_shards wrote in root/shards instead
+    of the loose photos and json files. The shards are memory-mapped by each
+    process and read ahead on open; the targets come from the packed
+    annotation index.
+
+    Arguments:
+        root (string): the NPSet folder, as for NPSet
+        image_sets, preproc, image_cache: as for NPSet
+        annotation_index: ignored, the shards always carry the index
+    """
+
+    def __init__(self, root, image_sets=None, preproc=None, annotation_index=True, image_cache=(0, 0),
+                 decode_size=None):
+        self.root = root
+        self.preproc = preproc
+        self.decode_size = decode_size
+        self.name, self.name_to_seq, self.seq_to_name, self.name_to_desc = self._parse_templates()
+        shard_dir = _shard_dir(root)
+        with open(os.path.join(shard_dir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        self.ids = meta['ids']
+        self.shard_files = [os.path.join(shard_dir, name) for name in meta['shards']]
+        self.table = np.load(os.path.join(shard_dir, 'table.npy'), mmap_mode='r')
+        self.annotations = AnnotationIndex.load(os.path.join(shard_dir, 'annotation_index'))
+        if self.annotations is None or self.annotations.tag != _shard_tag(self.seq_to_name, meta['max_side']):
+            raise ValueError('the shards of {} do not match its templates.json, pack them again'.format(root))
+        self.photo_dir, self.anno_dir = None, None
+        self._shards, self._shards_pid = None, None
+
+        cache_bytes, cache_max_side = image_cache
+        self.image_cache = ImageCache(len(self.ids), cache_bytes, cache_max_side) if cache_bytes > 0 else None
+        if image_sets and isinstance(image_sets,list) and isinstance(image_sets[0],int) :
+            self.ids=self.ids*image_sets[0]
+        self.num_classes=len(self.seq_to_name)
+
+    def _shard(self, shard):
+        # mapped per process, the DataLoader workers do not inherit the maps
+        if self._shards_pid != os.getpid():
+            self._shards, self._shards_pid = [None] * len(self.shard_files), os.getpid()
+        if self._shards[shard] is None:
+            with open(self.shard_files[shard], 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(mm, 'madvise'):
+                # read the whole shard ahead in large sequential requests
+                mm.madvise(mmap.MADV_WILLNEED)
+            self._shards[shard] = mm
+        return self._shards[shard]
+
+    def _read_image(self, index, decode_size=None):
+        shard, offset, size, height, width = [int(v) for v in self.table[index % len(self.table)]]
+        data = np.frombuffer(self._shard(shard), dtype=np.uint8, count=size, offset=offset)
+        if height:
+            # the packed boxes are at the packed resolution already
+            return data.reshape(height, width, 3).copy(), (1.0, 1.0)
+        return decode_reduced(data, decode_size)
+
+    def _target(self, index):
+        return self.annotations[index % len(self.annotations)]
+
+    def _ground_truths(self):
+        ground_trues = {}
+        for i, img_id in enumerate(self.ids[:len(self.annotations)]):
+            ground_trues[img_id] = [{'name': self.seq_to_name[int(row[4])], 'bbox': row[:4].tolist(), 'difficult': 0}
+                                    for row in self.annotations[i]]
+        return ground_trues
+
+    def __getstate__(self):
+        # mmap objects do not pickle, the workers map the shards again
+        state = self.__dict__.copy()
+        state['_shards'], state['_shards_pid'] = None, None
+        return state
@@ -2,13 +2,18 @@ import os
 import pickle
 import os.path
 import sys
+import multiprocessing
 import torch
 import torch.utils.data as data
 import torchvision.transforms as transforms
 from PIL import Image, ImageDraw, ImageFont
 import cv2
 import numpy as np
+from functools import partial
 from .voc_eval import voc_eval
+from .annotation_index import AnnotationIndex
+from .image_cache import ImageCache
+from lib.utils.image_io import imread_reduced
 if sys.version_info[0] == 2:
     import xml.etree.cElementTree as ET
 else:
@@ -27,6 +32,10 @@ COLORS = ((255, 0, 0, 128), (0, 255, 0, 128), (0, 0, 255, 128),
           (0, 255, 255, 128), (255, 0, 255, 128), (255, 255, 0, 128))
 
 
+def _read_target(anno_file, target_transform):
+    return target_transform(ET.parse(anno_file).getroot())
+
+
 class VOCSegmentation(data.Dataset):
 
     """VOC Segmentation Dataset Object
@@ -108,7 +117,7 @@ class AnnotationTransform(object):
         Returns:
             a list containing lists of bounding boxes  [bbox coords, class name]
         """
-        res = np.empty((0,5)) 
+        res = []
         for obj in target.iter('object'):
             difficult = int(obj.find('difficult').text) == 1
             if not self.keep_difficult and difficult:
@@ -125,10 +134,10 @@ class AnnotationTransform(object):
                 bndbox.append(cur_pt)
             label_idx = self.class_to_ind[name]
             bndbox.append(label_idx)
-            res = np.vstack((res,bndbox))  # [xmin, ymin, xmax, ymax, label_ind]
+            res.append(bndbox)  # [xmin, ymin, xmax, ymax, label_ind]
             # img_id = target.find('filename').text[:-4]
 
-        return res  # [[xmin, ymin, xmax, ymax, label_ind], ... ]
+        return np.array(res, dtype=np.float64).reshape(-1, 5)  # [[xmin, ymin, xmax, ymax, label_ind], ... ]
 
 
 class VOCDetection(data.Dataset):
@@ -147,10 +156,18 @@ class VOCDetection(data.Dataset):
             (eg: take in caption string, return tensor of word indices)
         dataset_name (string, optional): which dataset to load
             (default: 'VOC2007')
+        annotation_index (bool, optional): read the targets from an
+            AnnotationIndex kept in root/annotations_cache instead of parsing
+            the xml files, needs an AnnotationTransform target_transform
+        image_cache (tuple, optional): (byte budget, max side) of the decoded
+            images shared by the workers, no cache when the budget is 0
+        decode_size (tuple, optional): (width, height) the images must keep,
+            the jpegs are decoded reduced down to it
     """
 
     def __init__(self, root, image_sets, preproc=None, target_transform=AnnotationTransform(),
-                 dataset_name='VOC0712'):
+                 dataset_name='VOC0712', annotation_index=False, image_cache=(0, 0),
+                 decode_size=None):
         self.root = root
         self.image_set = image_sets
         self.preproc = preproc
@@ -164,16 +181,43 @@ class VOCDetection(data.Dataset):
             rootpath = os.path.join(self.root, 'VOC' + year)
             for line in open(os.path.join(rootpath, 'ImageSets', 'Main', name + '.txt')):
                 self.ids.append((rootpath, line.strip()))
+        self.annotations = None
+        if annotation_index and isinstance(target_transform, AnnotationTransform):
+            self.annotations = self._load_annotation_index()
+        self.decode_size = decode_size
+        cache_bytes, cache_max_side = image_cache
+        self.image_cache = ImageCache(len(self.ids), cache_bytes, cache_max_side) if cache_bytes > 0 else None
+
+    def _load_annotation_index(self):
+        index_dir = os.path.join(self.root, 'annotations_cache',
+                                 'index_' + '_'.join(year + name for year, name in self.image_set))
+        transform = self.target_transform
+        return AnnotationIndex.build(index_dir, [os.path.join(*img_id) for img_id in self.ids],
+                                     [self._annopath % img_id for img_id in self.ids],
+                                     partial(_read_target, target_transform=transform),
+                                     tag=repr((sorted(transform.class_to_ind.items()), transform.keep_difficult)),
+                                     workers=multiprocessing.cpu_count())
+
+    def _target(self, index):
+        """target_transform-ed annotation of image index"""
+        if self.annotations is not None:
+            return self.annotations[index]
+        target = ET.parse(self._annopath % self.ids[index]).getroot()
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        return target
 
     def __getitem__(self, index):
-        img_id = self.ids[index]
-        target = ET.parse(self._annopath % img_id).getroot()
-        img = cv2.imread(self._imgpath % img_id, cv2.IMREAD_COLOR)
+        target = self._target(index)
+        if self.image_cache is not None:
+            img, (scale_x, scale_y) = self.image_cache.read(index, lambda: self._read_image(index, self.decode_size))
+        else:
+            img, (scale_x, scale_y) = self._read_image(index, self.decode_size)
+        if scale_x != 1 or scale_y != 1:
+            target[:, 0:4:2] *= scale_x
+            target[:, 1:4:2] *= scale_y
         height, width, _ = img.shape
 
-        if self.target_transform is not None:
-            target = self.target_transform(target)
-
 
         if self.preproc is not None:
             img, target = self.preproc(img, target)
@@ -187,6 +231,13 @@ class VOCDetection(data.Dataset):
     def __len__(self):
         return len(self.ids)
 
+    def _read_image(self, index, decode_size=None):
+        """image index and its (x, y) scale to the full resolution, reduced
+        towards decode_size (width, height) when given"""
+        if decode_size:
+            return imread_reduced(self._imgpath % self.ids[index], decode_size)
+        return cv2.imread(self._imgpath % self.ids[index], cv2.IMREAD_COLOR), (1.0, 1.0)
+
     def pull_image(self, index):
         '''Returns the original image object at index in PIL form
 
@@ -213,13 +264,10 @@ class VOCDetection(data.Dataset):
             list:  [img_id, [(label, bbox coords),...]]
                 eg: ('001718', [('dog', (96, 13, 438, 332))])
         '''
-        img_id = self.ids[index]
-        anno = ET.parse(self._annopath % img_id).getroot()
+        anno = self._target(index)
         # gt = self.target_transform(anno, 1, 1)
         # gt = self.target_transform(anno)
         # return img_id[1], gt
-        if self.target_transform is not None:
-            anno = self.target_transform(anno)
         return anno
         
 
@@ -237,8 +285,7 @@ class VOCDetection(data.Dataset):
         '''
         img_id = self.ids[index]
         img = cv2.imread(self._imgpath % img_id, cv2.IMREAD_COLOR)
-        anno = ET.parse(self._annopath % img_id).getroot()
-        gt = self.target_transform(anno)
+        gt = self._target(index)
         height, width, _ = img.shape
         boxes = gt[:,:-1]
         labels = gt[:,-1]
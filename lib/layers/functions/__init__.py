@@ -1,5 +1,5 @@
-from .detection import Detect
+from .detection import Detect, DetectionBatch
 from .prior_box import PriorBox
 
 
-__all__ = ['Detect', 'PriorBox']
+__all__ = ['Detect', 'DetectionBatch', 'PriorBox']
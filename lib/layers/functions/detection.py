@@ -1,9 +1,11 @@
 import torch
 import torch.nn as nn
+import numpy as np
 import torch.backends.cudnn as cudnn
 from torch.autograd import Function
 from torch.autograd import Variable
-from lib.utils.box_utils import decode,nms
+from lib.utils.box_utils import PriorSet, decode, batched_nms, rank_in_group
+from lib.utils.nms.nms_factory import gen_nms_fn
 # from lib.utils.nms.nms_wrapper import nms
 from lib.utils.timer import Timer
 
@@ -20,8 +22,51 @@ class Detect(Function):
         self.nms_thresh = cfg.IOU_THRESHOLD 
         self.top_k = cfg.MAX_DETECTIONS 
         self.variance = cfg.VARIANCE
+        self.vectorized = cfg.VECTORIZED
+        self.per_class_nms = cfg.PER_CLASS_NMS
+        self.nms = gen_nms_fn(cfg.NMS_BACKEND)
+        self.pre_nms_top_k = cfg.PRE_NMS_TOP_K
+        self.pre_nms_top_k_per_class = cfg.PRE_NMS_TOP_K_PER_CLASS
+        self.logits = cfg.SIGMOID_LOGITS
+        self.top1_class = cfg.TOP1_CLASS
+        # decode only needs the center form of a PriorSet
+        if isinstance(priors, PriorSet):
+            priors = priors.center
+        if self.logits:
+            # sigmoid(x) > t  <=>  x > logit(t)
+            self.conf_thresh = float(np.log(self.conf_thresh / (1. - self.conf_thresh)))
         self.priors = priors
 
+    def candidates(self, conf_preds):
+        """Mask of the scores that go into nms: above SCORE_THRESHOLD, the best
+        class of the prior when TOP1_CLASS is set and, when PRE_NMS_TOP_K /
+        PRE_NMS_TOP_K_PER_CLASS are set, among the k highest scores of the
+        image / of the class in the image.
+        Args:
+            conf_preds: (tensor) Class scores (or logits) without background,
+                Shape: [batch,num_classes-1,num_priors]
+        """
+        mask = conf_preds.gt(self.conf_thresh)
+        if self.top1_class:
+            _, best = conf_preds.max(1, keepdim=True)
+            mask &= conf_preds.new_zeros(conf_preds.size()).scatter_(1, best, 1) > 0
+        k = self.pre_nms_top_k_per_class
+        if 0 < k < conf_preds.size(2):
+            _, idx = conf_preds.topk(k, dim=2)
+            mask &= conf_preds.new_zeros(conf_preds.size()).scatter_(2, idx, 1) > 0
+        k = self.pre_nms_top_k
+        if 0 < k < mask[0].numel():
+            flat = conf_preds.masked_fill(mask == 0, float('-inf')).reshape(conf_preds.size(0), -1)
+            _, idx = flat.topk(k, dim=1)
+            mask &= (flat.new_zeros(flat.size()).scatter_(1, idx, 1) > 0).view_as(mask)
+        return mask
+
+    def activate(self, scores):
+        """Scores of the gathered candidates, activated here when the model
+        hands raw logits over (SIGMOID_LOGITS).
+        """
+        return scores.sigmoid() if self.logits else scores
+
     # def forward(self, predictions, prior):
     #     """
     #     Args:
@@ -108,6 +153,7 @@ class Detect(Function):
                                         self.num_classes).transpose(2, 1)
             #self.output.expand_(num, self.num_classes, self.top_k, 5)
         output = torch.zeros(num, self.num_classes, self.top_k, 5)
+        cand_mask = self.candidates(conf_preds[:, 1:])
 
         _t = {'decode': Timer(), 'misc': Timer(), 'box_mask':Timer(), 'score_mask':Timer(),'nms':Timer(), 'cpu':Timer(),'sort':Timer()}
         gpunms_time = 0
@@ -119,27 +165,27 @@ class Detect(Function):
         _t['misc'].tic()
         # Decode predictions into bboxes.
         for i in range(num):
-            _t['decode'].tic()
-            decoded_boxes = decode(loc_data[i], prior_data, self.variance)
-            decode_time += _t['decode'].toc()
             # For each class, perform nms
             conf_scores = conf_preds[i].clone()
             num_det = 0
             for cl in range(1, self.num_classes):
                 _t['cpu'].tic()
-                c_mask = conf_scores[cl].gt(self.conf_thresh).nonzero().view(-1)
+                c_mask = cand_mask[i, cl-1].nonzero().view(-1)
                 cpu_tims+=_t['cpu'].toc()
                 if c_mask.dim() == 0:
                     continue
                 _t['score_mask'].tic()
-                scores = conf_scores[cl][c_mask]
+                scores = self.activate(conf_scores[cl][c_mask])
                 scores_time+=_t['score_mask'].toc()
                 if scores.dim() == 0:
                     continue
                 _t['box_mask'].tic()
                 # l_mask = c_mask.unsqueeze(1).expand_as(decoded_boxes)
                 # boxes = decoded_boxes[l_mask].view(-1, 4)
-                boxes = decoded_boxes[c_mask, :]
+                # decode the candidates of the class only
+                _t['decode'].tic()
+                boxes = decode(loc_data[i][c_mask], prior_data[c_mask], self.variance)
+                decode_time += _t['decode'].toc()
                 box_time+=_t['box_mask'].toc()
                 # idx of highest scoring and non-overlapping boxes per class
                 _t['nms'].tic()
@@ -148,7 +194,7 @@ class Detect(Function):
                 # cls_dets = cls_dets[order]
                 # keep = nms(cls_dets, self.nms_thresh)
                 # cls_dets = cls_dets[keep.view(-1).long()]
-                ids, count = nms(boxes, scores, self.nms_thresh, self.top_k)
+                ids, count = self.nms(boxes, scores, self.nms_thresh, self.top_k)
 
                 gpunms_time += _t['nms'].toc()
                 output[i, cl, :count] = \
@@ -164,6 +210,78 @@ class Detect(Function):
 
 
     def forward(self, predictions):
+        """Dispatch to the post-processing engine selected by POST_PROCESS.
+        VECTORIZED picks the batched engine, PER_CLASS_NMS picks per-class nms
+        (forward_1) over the class-agnostic nms (forward_agnostic).
+        """
+        if self.vectorized:
+            return self.forward_vectorized(predictions)
+        if self.per_class_nms:
+            return self.forward_1(predictions)
+        return self.forward_agnostic(predictions)
+
+    def detect(self, predictions):
+        """Same detections as forward, returned as a DetectionBatch instead
+        of the dense [batch, num_classes, top_k, 5] tensor.
+        """
+        if not self.vectorized:
+            return DetectionBatch.from_dense(self.forward(predictions))
+        num = predictions[0].size(0)
+        return DetectionBatch.from_columns(num, *self._detect_vectorized(predictions))
+
+    def forward_vectorized(self, predictions):
+        """Batched version of forward_agnostic/forward_1: thresholds and gathers
+        all images and classes at once, decodes the surviving candidates only
+        and runs the nms of every group through batched_nms.
+        Args:
+            loc_data: (tensor) Loc preds from loc layers
+                Shape: [batch,num_priors*4]
+            conf_data: (tensor) Shape: Conf preds from conf layers
+                Shape: [batch*num_priors,num_classes]
+            prior_data: (tensor) Prior boxes and variances from priorbox layers
+                Shape: [1,num_priors,4]
+        """
+        num = predictions[0].size(0)  # batch size
+        output = torch.zeros(num, self.num_classes, self.top_k, 5)
+        batch_idx, cls_idx, scores, boxes = self._detect_vectorized(predictions)
+        # the kept boxes are sorted by descending score, so the rank inside
+        # each (image, class) group is the output slot
+        slot = rank_in_group(batch_idx * self.num_classes + cls_idx)
+        output[batch_idx, cls_idx, slot] = torch.cat((scores.unsqueeze(1), boxes), 1)
+        return output
+
+    def _detect_vectorized(self, predictions):
+        """Image index, class, score and box of the detections kept by the
+        vectorized engine, sorted by descending score.
+        """
+        loc, conf = predictions
+
+        loc_data = loc.data
+        conf_data = conf.data
+        prior_data = self.priors.data
+
+        num = loc_data.size(0)  # batch size
+        num_priors = prior_data.size(0)
+
+        # size batch x num_classes-1 x num_priors, background excluded
+        conf_preds = conf_data.view(num, num_priors, self.num_classes).transpose(2, 1)[:, 1:]
+        # candidates come out ordered by (image, class, prior), which is the
+        # order the per-image loop concatenates them in
+        batch_idx, cls_idx, prior_idx = self.candidates(conf_preds).nonzero().t()
+        if batch_idx.numel() == 0:
+            return batch_idx, cls_idx, conf_data.new_zeros(0), loc_data.new_zeros(0, 4)
+        scores = self.activate(conf_preds[batch_idx, cls_idx, prior_idx])
+        cls_idx = cls_idx + 1
+
+        # decode only the gathered candidates, not every prior of the batch
+        boxes = decode(loc_data[batch_idx, prior_idx], prior_data[prior_idx], self.variance)
+
+        cls_groups = batch_idx * self.num_classes + cls_idx
+        nms_groups = cls_groups if self.per_class_nms else batch_idx
+        keep = batched_nms(boxes, scores, nms_groups, self.nms_thresh, self.top_k, self.nms)
+        return batch_idx[keep], cls_idx[keep], scores[keep], boxes[keep]
+
+    def forward_agnostic(self, predictions):
         """
         Args:
             loc_data: (tensor) Loc preds from loc layers
@@ -190,6 +308,7 @@ class Detect(Function):
                                         self.num_classes).transpose(2, 1)
             #self.output.expand_(num, self.num_classes, self.top_k, 5)
         output = torch.zeros(num, self.num_classes, self.top_k, 5)
+        cand_mask = self.candidates(conf_preds[:, 1:])
 
         _t = {'decode': Timer(), 'misc': Timer(), 'box_mask':Timer(), 'score_mask':Timer(),'nms':Timer(), 'cpu':Timer(),'sort':Timer()}
         gpunms_time = 0
@@ -200,9 +319,6 @@ class Detect(Function):
         _t['misc'].tic()
         # Decode predictions into bboxes.
         for i in range(num):
-            _t['decode'].tic()
-            decoded_boxes = decode(loc_data[i], prior_data, self.variance)
-            decode_time += _t['decode'].toc()
             # For each class, perform nms
             conf_scores = conf_preds[i].clone()
             all_scores=None
@@ -210,18 +326,19 @@ class Detect(Function):
             all_boxes=None
             for cl in range(1, self.num_classes):
                 _t['cpu'].tic()
-                c_mask = conf_scores[cl].gt(self.conf_thresh).nonzero().view(-1)
+                c_mask = cand_mask[i, cl-1].nonzero().view(-1)
                 cpu_tims+=_t['cpu'].toc()
                 if c_mask.numel() == 0:
                     continue
                 _t['score_mask'].tic()
-                scores = conf_scores[cl][c_mask]
+                scores = self.activate(conf_scores[cl][c_mask])
                 scores_time+=_t['score_mask'].toc()
                 if scores.numel() == 0:
                     continue
                 klasses = torch.ones([len(scores)],dtype=torch.int32)*cl
                 _t['box_mask'].tic()
-                boxes = decoded_boxes[c_mask, :]
+                # decode the candidates of the class only
+                boxes = decode(loc_data[i][c_mask], prior_data[c_mask], self.variance)
                 box_time+=_t['box_mask'].toc()
 
                 if all_boxes is None:
@@ -236,7 +353,7 @@ class Detect(Function):
 
             if all_klasses is not None:
                 # idx of highest scoring and non-overlapping boxes per class
-                ids, count = nms(all_boxes, all_scores, self.nms_thresh, self.top_k)
+                ids, count = self.nms(all_boxes, all_scores, self.nms_thresh, self.top_k)
                 all_klasses = all_klasses[ids[:count]]
                 all_scores =  all_scores[ids[:count]]
                 all_boxes =  all_boxes[ids[:count]]
@@ -251,4 +368,88 @@ class Detect(Function):
                     boxes  = all_boxes[mask]
                     output[i, cl, :count] = \
                         torch.cat((scores.unsqueeze(1), boxes), 1)
-        return output
\ No newline at end of file
+        return output
+
+
+def _offsets(counts):
+    """per-image offsets from the number of detections of every image"""
+    return torch.cat((counts.new_zeros(1), counts.cumsum(0)))
+
+
+class DetectionBatch(object):
+    """Detections of a batch of images stored in flat columns. The detections
+    of image i are the rows offsets[i]:offsets[i+1] of boxes, scores and
+    labels, sorted by label and then by descending score like the dense
+    output of Detect.forward.
+
+    Arguments:
+        boxes (tensor): point form boxes, Shape: [num_dets,4].
+        scores (tensor): detection scores, Shape: [num_dets].
+        labels (LongTensor): class index, 0 is the background, Shape: [num_dets].
+        offsets (LongTensor): first row of every image, Shape: [batch+1].
+    """
+    def __init__(self, boxes, scores, labels, offsets):
+        self.boxes = boxes
+        self.scores = scores
+        self.labels = labels
+        self.offsets = offsets
+        counts = offsets[1:] - offsets[:-1]
+        self.images = torch.arange(counts.numel(), dtype=torch.long,
+                                   device=offsets.device).repeat_interleave(counts)
+
+    @classmethod
+    def from_columns(cls, num, images, labels, scores, boxes):
+        """Build the batch from detections in any image order. Detections of
+        the same image and label keep their relative order.
+        """
+        n = images.numel()
+        position = torch.arange(n, dtype=torch.long, device=images.device)
+        span = int(labels.max()) + 1 if n > 0 else 1
+        _, order = ((images * span + labels) * n + position).sort(0)
+        counts = torch.bincount(images, minlength=num)
+        return cls(boxes[order], scores[order], labels[order], _offsets(counts))
+
+    @classmethod
+    def from_dense(cls, output):
+        """Build the batch from the dense [batch, num_classes, top_k, 5]
+        output of Detect.forward.
+        """
+        images, labels, slots = (output[:, :, :, 0] > 0).nonzero().t()
+        dets = output[images, labels, slots]
+        counts = torch.bincount(images, minlength=output.size(0))
+        return cls(dets[:, 1:], dets[:, 0], labels, _offsets(counts))
+
+    def __len__(self):
+        return self.offsets.numel() - 1
+
+    def image(self, index):
+        """boxes, scores and labels of the detections of one image"""
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        return self.boxes[start:end], self.scores[start:end], self.labels[start:end]
+
+    def filter(self, threshold):
+        """The detections with a score of at least threshold."""
+        keep = (self.scores >= threshold).nonzero().view(-1)
+        counts = torch.bincount(self.images[keep], minlength=len(self))
+        return DetectionBatch(self.boxes[keep], self.scores[keep], self.labels[keep], _offsets(counts))
+
+    def scale(self, sizes):
+        """The detections with boxes rescaled from relative to pixel coordinates.
+        Args:
+            sizes: (width, height) shared by all the images, or one
+                (width, height) per image.
+        """
+        scale = torch.as_tensor(sizes, dtype=self.boxes.dtype, device=self.boxes.device).view(-1, 2).repeat(1, 2)
+        if scale.size(0) > 1:
+            scale = scale[self.images]
+        return DetectionBatch(self.boxes * scale, self.scores, self.labels, self.offsets)
+
+    def class_arrays(self, index, num_classes):
+        """Detections of one image split by class, as numpy arrays with rows
+        [xmin, ymin, xmax, ymax, score]; the all_boxes layout used by
+        evaluate_detections.
+        """
+        boxes, scores, labels = self.image(index)
+        dets = torch.cat((boxes, scores.unsqueeze(1)), 1).cpu().numpy()
+        bounds = np.searchsorted(labels.cpu().numpy(), np.arange(num_classes + 1))
+        return [dets[bounds[j]:bounds[j + 1]] for j in range(num_classes)]
@@ -1,15 +1,24 @@
 from __future__ import division
+import os
+import hashlib
+import inspect
+import numpy as np
 import torch
+from lib.utils.box_utils import PriorSet
 from math import sqrt as sqrt
 from math import ceil as ceil
 from itertools import product as product
 
+# part of the cache key, bump it when the priors generated for a setting change
+PRIOR_CACHE_VERSION = 1
+
 class PriorBox(object):
     """Compute priorbox coordinates in center-offset form for each source
     feature map.
     """
-    def __init__(self, image_size, feature_maps, aspect_ratios, scale, archor_stride=None, archor_offest=None, clip=True):
+    def __init__(self, image_size, feature_maps, aspect_ratios, scale, archor_stride=None, archor_offest=None, clip=True, cache_dir=None):
         super(PriorBox, self).__init__()
+        self.cache_dir = cache_dir
         self.image_size = image_size #[height, width]
         self.feature_maps = feature_maps #[(height, width), ...]
         self.aspect_ratios = aspect_ratios
@@ -73,7 +82,122 @@ class PriorBox(object):
        return anchor_number_list
 
 
+    def prior_set(self, device=None):
+        """PriorSet of the priors with their per feature map ranges, placed on
+        device (by default the device of the default tensor type).
+        """
+        anchors = PriorBox.get_anchor_number(self.aspect_ratios)
+        level_sizes = [f[0] * f[1] * num for f, num in zip(self.feature_maps, anchors)]
+        grids = [(f[0], f[1], num, self.steps[k], self.offset[k])
+                 for k, (f, num) in enumerate(zip(self.feature_maps, anchors))]
+        priors = self.forward().to(device or torch.Tensor().device)
+        if sum(level_sizes) != priors.size(0):
+            # the sub-anchor tiling does not follow get_anchor_number, no grid layout
+            return PriorSet(priors)
+        return PriorSet(priors, level_sizes, grids)
+
+    def cache_file(self):
+        """Path of the cached priors, keyed by everything the priors depend on"""
+        if not self.cache_dir:
+            return None
+        key = repr((PRIOR_CACHE_VERSION, _generator_digest(),
+                    list(self.image_size), [list(f) for f in self.feature_maps], list(self.scales),
+                    [list(ar) for ar in self.aspect_ratios], self.steps, self.offset, self.clip))
+        return os.path.join(self.cache_dir, 'priors_{}.npy'.format(hashlib.sha1(key.encode('utf-8')).hexdigest()))
+
     def forward(self):
+        """Priors in center-offset form, Shape: [num_priors,4], of the default
+        tensor type like forward_loop. They are loaded memory-mapped from
+        cache_dir when they were generated before.
+        """
+        cache_file = self.cache_file()
+        if cache_file and os.path.exists(cache_file):
+            return torch.from_numpy(np.load(cache_file, mmap_mode='c')).to(torch.Tensor())
+        output = self.generate()
+        if cache_file:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            # write aside and rename, concurrent starts never read a partial file
+            tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+            with open(tmp_file, 'wb') as f:
+                np.save(f, output.numpy())
+            os.rename(tmp_file, cache_file)
+        return output.to(torch.Tensor())
+
+    def generate(self):
+        """Vectorized forward_loop: the priors of every anchor of a feature map
+        are computed for all the locations at once with the same float64
+        arithmetic, so the result is identical, order included.
+        """
+        aspect=self.image_size[1]/self.image_size[0] # w/h
+        levels = [self._level_priors(k, f, aspect) for k, f in enumerate(self.feature_maps)]
+        if any(level is None for level in levels):
+            # sub-anchor tiling differs between locations of a map
+            return self.forward_loop()
+        output = torch.from_numpy(np.concatenate([level.reshape(-1, 4) for level in levels])).float()
+        if self.clip:
+            output.clamp_(max=1, min=0)
+        return output
+
+    def _level_priors(self, k, f, aspect):
+        """Priors of feature map k as a float64 array, Shape: [f[0]*f[1],num_anchors,4]"""
+        i, j = np.meshgrid(np.arange(f[0]), np.arange(f[1]), indexing='ij')
+        cx = (j * self.steps[k][1] + self.offset[k][1]).ravel()
+        cy = (i * self.steps[k][0] + self.offset[k][0]).ravel()
+        s_k = self.scales[k]
+        s_k_y = s_k*aspect
+
+        anchors = []
+        def add(x, y, w, h):
+            anchors.append(np.stack(np.broadcast_arrays(x, y, w, h), 1))
+
+        for ar in self.aspect_ratios[k]:
+            ar_sqrt = sqrt(ar)
+            anchor_w = s_k*ar_sqrt
+            anchor_h = s_k_y / ar_sqrt
+            if 3.0 > ar > 0.333:
+                add(cx, cy, anchor_w, anchor_h)
+            elif ar <= 0.333:
+                centers = self._tiles(cx-s_k*0.5, cx+s_k*0.5, anchor_w)
+                if centers is None:
+                    return None
+                for x in centers:
+                    add(x, cy, anchor_w, anchor_h)
+            else: #ar >= 3.0
+                centers = self._tiles(cy - s_k_y*0.5, cy + s_k_y*0.5, anchor_h)
+                if centers is None:
+                    return None
+                for y in centers:
+                    add(cx, y, anchor_w, anchor_h)
+
+        s_k_prime = sqrt(s_k * self.scales[k + 1])
+        add(cx, cy, s_k_prime, s_k_prime*aspect)
+        return np.stack(anchors, 1)
+
+    @staticmethod
+    def _tiles(low, high, size):
+        """Centers of the sub-anchors of length size tiled from low to high for
+        all the locations, stepping like the while loops of forward_loop. The
+        last sub-anchor is aligned to high when it does not fit. Returns None
+        when the locations do not all get the same number of sub-anchors.
+        """
+        centers = []
+        while low.size > 0:
+            fit = low + size <= high
+            if not fit.all():
+                if fit.any():
+                    return None
+                break
+            centers.append(low + size*0.5)
+            low = low + size
+        last = (low < high) & (low + size > high)
+        if last.any():
+            if not last.all():
+                return None
+            centers.append(high - size*0.5)
+        return centers
+
+    def forward_loop(self):
         mean = []
         aspect=self.image_size[1]/self.image_size[0] # w/h
         #aspect=1.0
@@ -155,3 +279,18 @@ class PriorBox(object):
         if self.clip:
             output.clamp_(max=1, min=0)
         return output
+
+
+_GENERATOR_DIGEST = None
+
+def _generator_digest():
+    """sha1 of the PriorBox source, so that a change to the generation code
+    never reuses priors cached by an older version"""
+    global _GENERATOR_DIGEST
+    if _GENERATOR_DIGEST is None:
+        try:
+            source = inspect.getsource(PriorBox)
+        except (IOError, OSError, TypeError):
+            source = ''
+        _GENERATOR_DIGEST = hashlib.sha1(source.encode('utf-8')).hexdigest()
+    return _GENERATOR_DIGEST
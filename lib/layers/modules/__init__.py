@@ -1,5 +1,6 @@
 from .l2norm import L2Norm
 from .multibox_loss import MultiBoxLoss
 from .focal_loss   import  FocalLoss
+from .image_input import ImageInput, image_input_hook
 
-__all__ = ['L2Norm', 'MultiBoxLoss',"FocalLoss"]
+__all__ = ['L2Norm', 'MultiBoxLoss',"FocalLoss", 'ImageInput', 'image_input_hook']
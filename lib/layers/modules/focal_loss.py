@@ -2,8 +2,8 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from torch.autograd import Variable
-from lib.utils.box_utils import match, match_with_ignorance, log_sum_exp, one_hot_embedding
+from torch.autograd import Variable, Function
+from lib.utils.box_utils import as_prior_set, pad_targets, unpad_targets, match_batch, match, match_with_ignorance, log_sum_exp, one_hot_embedding
 
 # I do not fully understand this part, It completely based on https://github.com/kuangliu/pytorch-retinanet/blob/master/loss.py
 
@@ -12,6 +12,51 @@ def _one_hot(num_classes, labels):
     t = I[labels]
     return t
 
+# rows of the [num_priors, num_classes] confidences handled at once by the fused loss
+FOCAL_CHUNK_ROWS = 8192
+
+def _sigmoid_focal_terms(x, ids, eps=1e-5):
+    """sigmoid, clamped p and pt of the rows x for their target ids, the
+    target column is found by comparison instead of a one-hot matrix"""
+    s = x.sigmoid()
+    p = s.clamp(eps, 1.0-eps)
+    is_target = torch.arange(x.size(1), device=x.device) == ids.unsqueeze(1)
+    pt = torch.where(is_target, p, 1 - p)
+    return s, is_target, pt
+
+class _SigmoidFocalLoss(Function):
+    """Sum of the sigmoid focal loss of focal_loss_sigmoid with row weights,
+    Shape: inputs [N,C], ids [N], weights [N]. Forward and backward walk the
+    rows in chunks of FOCAL_CHUNK_ROWS and only keep the inputs for backward,
+    the per entry terms are recomputed instead of stored.
+    """
+    @staticmethod
+    def forward(ctx, inputs, ids, weights, gamma, eps=1e-5):
+        ctx.save_for_backward(inputs, ids, weights)
+        ctx.gamma, ctx.eps = gamma, eps
+        loss = inputs.new_zeros(())
+        for start in range(0, inputs.size(0), FOCAL_CHUNK_ROWS):
+            rows = slice(start, start + FOCAL_CHUNK_ROWS)
+            _, _, pt = _sigmoid_focal_terms(inputs[rows], ids[rows], eps)
+            loss += (torch.pow(1 - pt, gamma) * -pt.log()).sum(1).mul(weights[rows]).sum()
+        return loss
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        inputs, ids, weights = ctx.saved_tensors
+        gamma, eps = ctx.gamma, ctx.eps
+        grad = torch.empty_like(inputs)
+        for start in range(0, inputs.size(0), FOCAL_CHUNK_ROWS):
+            rows = slice(start, start + FOCAL_CHUNK_ROWS)
+            s, is_target, pt = _sigmoid_focal_terms(inputs[rows], ids[rows], eps)
+            # d/dpt of -(1-pt)^gamma*log(pt), pt is p for the target and 1-p otherwise
+            d_pt = gamma * torch.pow(1 - pt, gamma - 1) * pt.log() - torch.pow(1 - pt, gamma) / pt
+            d_p = torch.where(is_target, d_pt, -d_pt)
+            # the clamp of p lets no gradient through outside [eps, 1-eps]
+            d_x = d_p * s * (1 - s) * ((s >= eps) & (s <= 1.0-eps)).type_as(s)
+            grad[rows] = d_x * weights[rows].unsqueeze(1)
+        return grad * grad_output, None, None, None, None
+
 class FocalLoss(nn.Module):
     """SSD Weighted Loss Function
     Focal Loss for Dense Object Detection.
@@ -37,7 +82,9 @@ class FocalLoss(nn.Module):
         self.threshold = cfg.MATCHED_THRESHOLD
         self.unmatched_threshold = cfg.UNMATCHED_THRESHOLD
         self.variance = cfg.VARIANCE
-        self.priors = priors
+        self.priors = as_prior_set(priors)
+        self.grid_match = cfg.GRID_MATCH
+        self.batch_match = cfg.BATCH_MATCH
         #cfg.alpha=0.70
         #cfg.gamma=2.0
         #for harpic, with dense  sku
@@ -47,10 +94,13 @@ class FocalLoss(nn.Module):
         self.alpha_scalar=cfg_loss.ALPHA
         self.gamma_scalar=cfg_loss.GAMMA
 
-        self.focal_loss = self.focal_loss_softmax if cfg_loss.CONF_DISTR=="softmax" else self.focal_loss_sigmoid
+        if cfg_loss.FUSED:
+            self.focal_loss = self.focal_loss_softmax_fused if cfg_loss.CONF_DISTR=="softmax" else self.focal_loss_sigmoid_fused
+        else:
+            self.focal_loss = self.focal_loss_softmax if cfg_loss.CONF_DISTR=="softmax" else self.focal_loss_sigmoid
 
 
-    def forward(self, predictions, targets):
+    def forward(self, predictions, targets, matched=None):
         """Multibox Loss
         Args:
             predictions (tuple): A tuple containing loc preds, conf preds,
@@ -59,28 +109,41 @@ class FocalLoss(nn.Module):
                 loc shape: torch.size(batch_size,num_priors,4)
                 priors shape: torch.size(num_priors,4)
             ground_truth (tensor): Ground truth boxes and labels for a batch,
-                shape: [batch_size,num_objs,5] (last idx is the label).
+                shape: [batch_size,num_objs,5] (last idx is the label), or
+                the (padded, lengths) of padded_collate.
+            matched (tuple): loc_t and conf_t of the batch when they were
+                matched already (MatchingCollate).
         """
         loc_data, conf_data = predictions
         batch_num = loc_data.size(0)
         priors = self.priors
         # priors = priors[:loc_data.size(1), :]
-        num_priors = (priors.size(0))
+        num_priors = len(priors)
         
         # match priors (default boxes) and ground truth boxes
-        loc_t = torch.Tensor(batch_num, num_priors, 4)
-        conf_t = torch.LongTensor(batch_num, num_priors)
-        for idx in range(batch_num):
-            truths = targets[idx][:,:-1].data
-            labels = targets[idx][:,-1].data
-            defaults = priors.data
-            #match(self.threshold,truths,defaults,self.variance,labels,loc_t,conf_t,idx)
-            match_with_ignorance(self.threshold,self.unmatched_threshold, \
-                                 truths,defaults,self.variance,labels,loc_t,conf_t,idx)
-
-        if self.use_gpu:
-            loc_t = loc_t.cuda()
-            conf_t = conf_t.cuda()
+        if matched is not None:
+            loc_t, conf_t = [t.to(loc_data.device) for t in matched]
+        elif self.batch_match:
+            if priors.center.device != loc_data.device:
+                priors = self.priors = priors.to(loc_data.device)
+            truths, labels, lengths = pad_targets(targets, loc_data.device)
+            loc_t, conf_t = match_batch(self.threshold, self.unmatched_threshold,
+                                        truths, labels, lengths, priors, self.variance)
+        else:
+            loc_t = torch.Tensor(batch_num, num_priors, 4)
+            conf_t = torch.LongTensor(batch_num, num_priors)
+            targets = unpad_targets(targets)
+            for idx in range(batch_num):
+                truths = targets[idx][:,:-1].data
+                labels = targets[idx][:,-1].data
+                defaults = priors
+                #match(self.threshold,truths,defaults,self.variance,labels,loc_t,conf_t,idx)
+                match_with_ignorance(self.threshold,self.unmatched_threshold, \
+                                     truths,defaults,self.variance,labels,loc_t,conf_t,idx,self.grid_match)
+
+            if self.use_gpu:
+                loc_t = loc_t.cuda()
+                conf_t = conf_t.cuda()
         # wrap targets
         loc_t = Variable(loc_t, requires_grad=False)
         conf_t = Variable(conf_t,requires_grad=False)
@@ -160,6 +223,26 @@ class FocalLoss(nn.Module):
 
         #return  (pos_loss+neg_loss)*400
 
+    def focal_loss_softmax_fused(self, inputs, targets):
+        '''
+        focal_loss_softmax without the softmax and one-hot [N,C] matrices, the
+        log probability of the target class is gathered from the logits.
+        targets are not modified.
+        '''
+        ids = targets.view(-1, 1)
+        loss_mask = ids >= 0
+        ids = ids.clamp(min=0)
+
+        log_p = inputs.gather(1, ids) - torch.logsumexp(inputs, 1, keepdim=True)
+        probs = log_p.exp()
+        alpha = inputs.new_full(ids.size(), self.alpha_scalar)
+        alpha_weight = torch.where(ids>0, alpha, 1-alpha)
+        batch_loss = -alpha_weight*(torch.pow((1-probs), self.gamma))*log_p
+
+        batch_loss_2=batch_loss[loss_mask]
+        loss = 2 * batch_loss_2.sum()*(ids.shape[0]/(batch_loss_2.shape[0]*targets.shape[0]))
+        return loss
+
     def focal_loss_sigmoid(self, inputs, targets):
         '''
         targets: [batch_num, anchor_num], element type is long, <0 means ignore it, 0 mean bg, 1,2,3...is  class_num
@@ -206,4 +289,18 @@ class FocalLoss(nn.Module):
         #loss = 20*loss1.sum()/pos_num
         return loss
 
+    def focal_loss_sigmoid_fused(self, inputs, targets):
+        '''
+        focal_loss_sigmoid computed by _SigmoidFocalLoss, chunk by chunk and
+        without the one-hot targets. The ignored priors are not gathered out,
+        they get a zero weight.
+        '''
+        ids = targets.view(-1)
+        ids_mask = ids>=0 # -2 is the ignored box
+        alpha_tensor = inputs.new_full(ids.size(), self.alpha_scalar)
+        alpha_weight = torch.where(ids>0, alpha_tensor, 1-alpha_tensor) * ids_mask.type_as(inputs)
+        loss1 = _SigmoidFocalLoss.apply(inputs, ids, alpha_weight, self.gamma_scalar)
+        loss = loss1*(6000/(ids_mask.sum().item()))
+        return loss
+
 
@@ -0,0 +1,46 @@
+import torch
+import torch.nn as nn
+
+
+class ImageInput(nn.Module):
+    """Input layer taking the resized uint8 images: converts them to the
+    float NCHW input minus mean the networks expect. The uint8 batches are
+    NHWC (as loaded by cv2) with hwc, NCHW otherwise; float inputs pass
+    through, so the preprocessed float tensors keep working.
+
+    The mean is a buffer, so it follows the model to the device, to half and
+    into the DataParallel replicas, but it is left out of the state dict:
+    the checkpoints stay the same with and without the input layer.
+
+    Arguments:
+        mean: (tuple) the PIXEL_MEANS
+        hwc: (bool) layout of the uint8 images, as for preproc
+    """
+    def __init__(self, mean, hwc=False):
+        super(ImageInput, self).__init__()
+        self.hwc = hwc
+        self.register_buffer('mean', torch.Tensor(mean).view(1, -1, 1, 1))
+
+    def forward(self, x):
+        if x.dtype != torch.uint8:
+            return x
+        if self.hwc:
+            x = x.permute(0, 3, 1, 2)
+        return x.to(self.mean.dtype) - self.mean
+
+    def _save_to_state_dict(self, destination, prefix, keep_vars):
+        # register_buffer(persistent=False) needs torch 1.6
+        super(ImageInput, self)._save_to_state_dict(destination, prefix, keep_vars)
+        destination.pop(prefix + 'mean', None)
+
+    def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict,
+                              missing_keys, unexpected_keys, error_msgs):
+        super(ImageInput, self)._load_from_state_dict(state_dict, prefix, local_metadata, strict,
+                                                      missing_keys, unexpected_keys, error_msgs)
+        if prefix + 'mean' in missing_keys:
+            missing_keys.remove(prefix + 'mean')
+
+
+def image_input_hook(model, inputs):
+    """forward pre hook of a model with an image_input"""
+    return (model.image_input(inputs[0]),) + tuple(inputs[1:])
@@ -3,7 +3,25 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.autograd import Variable
-from lib.utils.box_utils import match, log_sum_exp
+from lib.utils.box_utils import as_prior_set, pad_targets, unpad_targets, match_batch, match, log_sum_exp
+
+
+def hard_negatives(loss_c, num_neg):
+    """Mask of the num_neg highest losses of each row, the negatives the
+    rank of the double sort selects, found with a single topk.
+    Args:
+        loss_c: (tensor) confidence loss, positives zeroed, Shape: [batch,num_priors]
+        num_neg: (tensor) negatives to keep per image, Shape: [batch,1]
+    Return:
+        mask of the selected negatives, Shape: [batch,num_priors]
+    """
+    k = int(num_neg.max().item())
+    keep = torch.arange(k, device=loss_c.device).unsqueeze(0) < num_neg
+    neg = keep.new_zeros(loss_c.size())
+    if k == 0:
+        return neg
+    _, loss_idx = loss_c.topk(k, 1)
+    return neg.scatter_(1, loss_idx, keep)
 
 
 class MultiBoxLoss(nn.Module):
@@ -38,9 +56,12 @@ class MultiBoxLoss(nn.Module):
         self.threshold = cfg.MATCHED_THRESHOLD
         self.unmatched_threshold = cfg.UNMATCHED_THRESHOLD
         self.variance = cfg.VARIANCE
-        self.priors = priors
+        self.priors = as_prior_set(priors)
+        self.grid_match = cfg.GRID_MATCH
+        self.batch_match = cfg.BATCH_MATCH
+        self.topk_negatives = cfg.TOPK_NEGATIVES
 
-    def forward(self, predictions, targets):
+    def forward(self, predictions, targets, matched=None):
         """Multibox Loss
         Args:
             predictions (tuple): A tuple containing loc preds, conf preds,
@@ -49,31 +70,49 @@ class MultiBoxLoss(nn.Module):
                 loc shape: torch.size(batch_size,num_priors,4)
                 priors shape: torch.size(num_priors,4)
             ground_truth (tensor): Ground truth boxes and labels for a batch,
-                shape: [batch_size,num_objs,5] (last idx is the label).
+                shape: [batch_size,num_objs,5] (last idx is the label), or
+                the (padded, lengths) of padded_collate.
+            matched (tuple): loc_t and conf_t of the batch when they were
+                matched already (MatchingCollate), the ignored priors (-2)
+                are neither positives nor negatives.
         """
         loc_data, conf_data = predictions
         num = loc_data.size(0)
         priors = self.priors
         # priors = priors[:loc_data.size(1), :]
-        num_priors = (priors.size(0))
+        num_priors = len(priors)
         num_classes = self.num_classes
 
         # match priors (default boxes) and ground truth boxes
-        loc_t = torch.Tensor(num, num_priors, 4)
-        conf_t = torch.LongTensor(num, num_priors)
-        for idx in range(num):
-            truths = targets[idx][:,:-1].data
-            labels = targets[idx][:,-1].data
-            defaults = priors.data
-            match(self.threshold,truths,defaults,self.variance,labels,loc_t,conf_t,idx)
+        if matched is not None:
+            loc_t, conf_t = [t.to(loc_data.device) for t in matched]
+        elif self.batch_match:
+            if priors.center.device != loc_data.device:
+                priors = self.priors = priors.to(loc_data.device)
+            truths, labels, lengths = pad_targets(targets, loc_data.device)
+            # match is match_with_ignorance without an ignored band
+            loc_t, conf_t = match_batch(self.threshold, self.threshold,
+                                        truths, labels, lengths, priors, self.variance)
+        else:
+            loc_t = torch.Tensor(num, num_priors, 4)
+            conf_t = torch.LongTensor(num, num_priors)
+            targets = unpad_targets(targets)
+            for idx in range(num):
+                truths = targets[idx][:,:-1].data
+                labels = targets[idx][:,-1].data
+                defaults = priors
+                match(self.threshold,truths,defaults,self.variance,labels,loc_t,conf_t,idx,self.grid_match)
 
-        if self.use_gpu:
-            loc_t = loc_t.cuda()
-            conf_t = conf_t.cuda()
+            if self.use_gpu:
+                loc_t = loc_t.cuda()
+                conf_t = conf_t.cuda()
         # wrap targets
         loc_t = Variable(loc_t, requires_grad=False)
         conf_t = Variable(conf_t,requires_grad=False)
 
+        # the workers match with ignorance, -2 marks the ignored priors
+        ignored = conf_t < 0
+        conf_t = conf_t.clamp(min=0)
         pos = conf_t > 0
         # num_pos = pos.sum()
 
@@ -93,11 +132,16 @@ class MultiBoxLoss(nn.Module):
         # Hard Negative Mining
         loss_c = loss_c.view(num, -1)
         loss_c[pos] = 0 # filter out pos boxes for now
-        _,loss_idx = loss_c.sort(1, descending=True)
-        _,idx_rank = loss_idx.sort(1)
+        loss_c[ignored] = 0
         num_pos = pos.long().sum(1,keepdim=True) #new sum needs to keep the same dim
         num_neg = torch.clamp(self.negpos_ratio*num_pos, max=pos.size(1)-1)
-        neg = idx_rank < num_neg.expand_as(idx_rank)
+        if self.topk_negatives:
+            neg = hard_negatives(loss_c.data, num_neg)
+        else:
+            _,loss_idx = loss_c.sort(1, descending=True)
+            _,idx_rank = loss_idx.sort(1)
+            neg = idx_rank < num_neg.expand_as(idx_rank)
+        neg[ignored] = 0
 
         # Confidence Loss Including Positive and Negative Examples
         pos_idx = pos.unsqueeze(2).expand_as(conf_data)
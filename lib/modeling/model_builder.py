@@ -43,6 +43,7 @@ networks_map = {
                }
 
 from lib.layers.functions.prior_box import PriorBox
+from lib.layers.modules.image_input import ImageInput, image_input_hook
 import torch
 
 def _forward_features_size(model, img_size):
@@ -53,8 +54,10 @@ def _forward_features_size(model, img_size):
     return [(o.size()[2], o.size()[3]) for o in feature_maps]
 
 
-def create_model(cfg, conf_distr):
+def create_model(cfg, conf_distr, pixel_means=None):
     '''
+    With cfg.UINT8_INPUT the model also takes the resized uint8 NHWC images
+    and subtracts pixel_means itself (see ImageInput).
     '''
     #
     base = networks_map[cfg.NETS]
@@ -69,13 +72,34 @@ def create_model(cfg, conf_distr):
     model = ssds_map[cfg.SSDS](base=base, feature_layer=cfg.FEATURE_LAYER,
                                mbox=number_box, num_classes=cfg.NUM_CLASSES,
                                conf_distr=conf_distr)
+    if cfg.UINT8_INPUT:
+        # a child module, so that it follows the model to the device and to half;
+        # the uint8 images come from preproc(uint8=True, hwc=True)
+        model.image_input = ImageInput(pixel_means, hwc=True)
+        model.register_forward_pre_hook(image_input_hook)
     #
     feature_maps = _forward_features_size(model, cfg.IMAGE_SIZE)
     print('==>Feature map size:')
     print(feature_maps)
     #
     priorbox = PriorBox(image_size=cfg.IMAGE_SIZE, feature_maps=feature_maps, aspect_ratios=cfg.ASPECT_RATIOS,
-                    scale=cfg.SIZES, archor_stride=cfg.STEPS, clip=cfg.CLIP)
+                    scale=cfg.SIZES, archor_stride=cfg.STEPS, clip=cfg.CLIP, cache_dir=cfg.PRIOR_CACHE_DIR)
     # priors = Variable(priorbox.forward(), volatile=True)
 
     return model, priorbox
+
+
+def set_conf_logits(model, cfg):
+    '''
+    Lets model hand its raw class logits to Detect when POST_PROCESS.SIGMOID_LOGITS
+    is set. Only the heads with a conf_logits switch (ssd_lite) support it, and
+    only sigmoid trained logits (LOSS.CONF_DISTR sigmoid) may be thresholded and
+    activated as sigmoids.
+    '''
+    if cfg.POST_PROCESS.SIGMOID_LOGITS:
+        if cfg.LOSS.CONF_DISTR != 'sigmoid':
+            raise ValueError('POST_PROCESS.SIGMOID_LOGITS needs LOSS.CONF_DISTR sigmoid, not %s' % cfg.LOSS.CONF_DISTR)
+        if not hasattr(model, 'conf_logits'):
+            raise ValueError('POST_PROCESS.SIGMOID_LOGITS is not supported by the %s head' % cfg.MODEL.SSDS)
+    if hasattr(model, 'conf_logits'):
+        model.conf_logits = cfg.POST_PROCESS.SIGMOID_LOGITS
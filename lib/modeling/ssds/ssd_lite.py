@@ -25,6 +25,8 @@ class SSDLite(nn.Module):
                  num_classes, conf_dist):
         super(SSDLite, self).__init__()
         self.onnx_export=False
+        # eval phase returns raw conf logits, activated later by Detect (POST_PROCESS.SIGMOID_LOGITS)
+        self.conf_logits=False
         self.num_classes = num_classes
         # SSD network
         self.base = nn.ModuleList(base)
@@ -129,12 +131,12 @@ class SSDLite(nn.Module):
                 self.softmax(conf.view(1, -1, self.num_classes)),  # conf preds
             )
         elif phase == 'eval':
-
+            conf = conf.view(-1, self.num_classes)
             output = (
                 #3d tensor  batch * num_prior * 4
                 loc.view(loc.size(0), -1, 4),                   # loc preds
                 #2d tensor (batch*num_prior) * 4
-                self.softmax(conf.view(-1, self.num_classes)),  # conf preds
+                conf if self.conf_logits else self.softmax(conf),  # conf preds
             )
         else:
             output = (
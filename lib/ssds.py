@@ -8,7 +8,7 @@ import torch.backends.cudnn as cudnn
 from lib.layers import *
 from lib.utils.timer import Timer
 from lib.utils.data_augment import preproc
-from lib.modeling.model_builder import create_model
+from lib.modeling.model_builder import create_model, set_conf_logits
 from lib.utils.config_parse import cfg
 
 class ObjectDetector:
@@ -17,8 +17,10 @@ class ObjectDetector:
 
         # Build model
         print('===> Building model')
-        self.model, self.priorbox = create_model(cfg.MODEL,cfg.LOSS.CONF_DISTR)
-        self.priors = Variable(self.priorbox.forward(), volatile=True)
+        self.model, self.priorbox = create_model(cfg.MODEL,cfg.LOSS.CONF_DISTR, cfg.DATASET.PIXEL_MEANS)
+        set_conf_logits(self.model, cfg)
+        self.prior_set = self.priorbox.prior_set()
+        self.priors = Variable(self.prior_set.center, volatile=True)
 
         # Print the model architecture and parameters
         if viz_arch is True:
@@ -39,10 +41,13 @@ class ObjectDetector:
             if self.half:
                 self.model = self.model.half()
                 self.priors = self.priors.half()
+                self.prior_set = self.prior_set.to(torch.half)
         
         # Build preprocessor and detector
-        self.preprocessor = preproc(cfg.MODEL.IMAGE_SIZE, cfg.DATASET.PIXEL_MEANS, -2)
-        self.detector = Detect(cfg.POST_PROCESS, self.priors)
+        # only resized when the model takes the uint8 images
+        self.uint8_input = cfg.MODEL.UINT8_INPUT
+        self.preprocessor = preproc(cfg.MODEL.IMAGE_SIZE, cfg.DATASET.PIXEL_MEANS, -2, uint8=self.uint8_input, hwc=True)
+        self.detector = Detect(cfg.POST_PROCESS, self.prior_set)
 
         # Load weight:
         if cfg.RESUME_CHECKPOINT == '':
@@ -59,7 +64,6 @@ class ObjectDetector:
     def predict(self, img, threshold=0.6, check_time=False):
         # make sure the input channel is 3 
         assert img.shape[2] == 3
-        scale = torch.Tensor([img.shape[1::-1], img.shape[1::-1]])
         
         _t = {'preprocess': Timer(), 'net_forward': Timer(), 'detect': Timer(), 'output': Timer()}
         
@@ -68,7 +72,7 @@ class ObjectDetector:
         x = Variable(self.preprocessor(img)[0].unsqueeze(0),volatile=True)
         if self.use_gpu:
             x = x.cuda()
-        if self.half:
+        if self.half and not self.uint8_input:
             x = x.half()
         preprocess_time = _t['preprocess'].toc()
 
@@ -79,22 +83,16 @@ class ObjectDetector:
 
         # detect
         _t['detect'].tic()
-        detections = self.detector.forward(out)
+        detections = self.detector.detect(out)
         detect_time = _t['detect'].toc()
         
         # output
         _t['output'].tic()
-        labels, scores, coords = [list() for _ in range(3)]
-        # for batch in range(detections.size(0)):
-        #     print('Batch:', batch)
-        batch=0
-        for classes in range(detections.size(1)):
-            num = 0
-            while detections[batch,classes,num,0] >= threshold:
-                scores.append(detections[batch,classes,num,0])
-                labels.append(classes-1)
-                coords.append(detections[batch,classes,num,1:]*scale)
-                num+=1
+        # single image batch: keep the confident detections in pixel coordinates
+        detections = detections.filter(threshold).scale(img.shape[1::-1])
+        labels = (detections.labels - 1).tolist()
+        scores = detections.scores.tolist()
+        coords = list(detections.boxes)
         output_time = _t['output'].toc()
         total_time = preprocess_time + net_forward_time + detect_time + output_time
         
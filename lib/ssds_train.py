@@ -20,9 +20,9 @@ from tensorboardX import SummaryWriter
 
 from lib.layers import *
 from lib.utils.timer import Timer
-from lib.utils.data_augment import preproc
-from lib.modeling.model_builder import create_model
-from lib.dataset.dataset_factory import load_data
+from lib.utils.data_augment import preproc, normalize_batch
+from lib.modeling.model_builder import create_model, set_conf_logits
+from lib.dataset.dataset_factory import load_data, MatchingCollate
 from lib.utils.config_parse import cfg
 from lib.utils.eval_utils import *
 from lib.utils.visualize_utils import *
@@ -54,9 +54,18 @@ class Solver(object):
          # Build model
         print('===> Building model, num_classes is '+str(cfg.MODEL.NUM_CLASSES))
 
-        self.model, self.priorbox = create_model(cfg.MODEL,cfg.LOSS.CONF_DISTR)
-        self.priors = Variable(self.priorbox.forward(), volatile=True)
-        self.detector = Detect(cfg.POST_PROCESS, self.priors)
+        self.model, self.priorbox = create_model(cfg.MODEL,cfg.LOSS.CONF_DISTR, cfg.DATASET.PIXEL_MEANS)
+        if self.test_loader and cfg.MODEL.UINT8_INPUT:
+            # the test paths feed the resized uint8 images to the model
+            self.test_loader.dataset.preproc = preproc(cfg.MODEL.IMAGE_SIZE, cfg.DATASET.PIXEL_MEANS, -2, uint8=True, hwc=True)
+        if self.train_loader and cfg.DATASET.MATCH_IN_WORKERS:
+            # the priors are known now, let the workers match the targets
+            self.train_loader.collate_fn = MatchingCollate(self.priorbox.prior_set('cpu'), cfg.MATCHER,
+                                                            cfg.DATASET.PADDED_TARGETS)
+        set_conf_logits(self.model, cfg)
+        self.prior_set = self.priorbox.prior_set()
+        self.priors = Variable(self.prior_set.center, volatile=True)
+        self.detector = Detect(cfg.POST_PROCESS, self.prior_set)
 
         # Utilize GPUs for computation
         self.use_gpu = torch.cuda.is_available()
@@ -91,7 +100,7 @@ class Solver(object):
 
         # metric
         #self.criterion = MultiBoxLoss(cfg.MATCHER, self.priors, self.use_gpu)
-        self.criterion = FocalLoss(cfg.MATCHER, self.priors, self.use_gpu, cfg.LOSS)
+        self.criterion = FocalLoss(cfg.MATCHER, self.prior_set, self.use_gpu, cfg.LOSS)
 
         # Set the logger
         self.writer = SummaryWriter(log_dir=cfg.LOG_DIR)
@@ -334,7 +343,9 @@ class Solver(object):
         #model.train(False)
         #images = torch.randn(1, 3, 533, 400)
         images = torch.randn(1, 3, 800 , 600)
-        #images = torch.randn(1, 800 , 600, 3)
+        if self.cfg.MODEL.UINT8_INPUT:
+            # the exported graph takes the uint8 NHWC image
+            images = torch.zeros(1, 800 , 600, 3, dtype=torch.uint8)
         # detection_model = nn.Sequential(
         #     nn.transpose(0,3, 1,2,3)
         #     model
@@ -364,20 +375,29 @@ class Solver(object):
         _t_all = Timer()
         for iteration in iter(range((epoch_size))):
             _t_all.tic()
-            images, targets = next(batch_iterator)
+            batch = next(batch_iterator)
+            images, targets = batch[:2]
+            # loc_t and conf_t when the loader matched the targets
+            matched = batch[2:] or None
             if use_gpu:
-                images = Variable(images.cuda(),requires_grad=False)
-                targets = [Variable(anno.cuda(), requires_grad=False) for anno in targets]
+                images = Variable(images.cuda(non_blocking=True),requires_grad=False)
+                if isinstance(targets, tuple):
+                    # padded targets, one copy for the batch
+                    targets = tuple(t.cuda(non_blocking=True) for t in targets)
+                else:
+                    targets = [Variable(anno.cuda(), requires_grad=False) for anno in targets]
             else:
                 images = Variable(images)
-                targets = [Variable(anno, requires_grad=False) for anno in targets]
+                if not isinstance(targets, tuple):
+                    targets = [Variable(anno, requires_grad=False) for anno in targets]
+            images = normalize_batch(images, self.cfg.DATASET.PIXEL_MEANS)
             _t.tic()
             # forward
             out = model(images, phase='train')
 
             # backprop
             optimizer.zero_grad()
-            loss_l, loss_c = criterion(out, targets)
+            loss_l, loss_c = criterion(out, targets, matched)
 
             # some bugs in coco train2017. maybe the annonation bug.
             if loss_l.item() == float("Inf"):
@@ -415,10 +435,10 @@ class Solver(object):
         writer.add_scalar('Train/lr', lr, epoch)
 
     def check_priors(self, images, targets, writer):
-        """targets is the list , len is batch no"""
+        """targets is the list , len is batch no, or the padded_collate tuple"""
         mean = torch.Tensor(self.cfg.DATASET.PIXEL_MEANS).cpu()
         priors = self.priors
-        for idx, truths in enumerate(targets):
+        for idx, truths in enumerate(unpad_targets(targets)):
             truths=truths[:,:4].cuda()
             overlaps = jaccard(
                 truths,
@@ -487,11 +507,16 @@ class Solver(object):
             images, targets = next(batch_iterator)
             #self.check_priors(images, targets, writer)
             if use_gpu:
-                images = Variable(images.cuda())
-                targets = [Variable(anno.cuda(), volatile=True) for anno in targets]
+                images = Variable(images.cuda(non_blocking=True))
+                if isinstance(targets, tuple):
+                    targets = tuple(t.cuda(non_blocking=True) for t in targets)
+                else:
+                    targets = [Variable(anno.cuda(), volatile=True) for anno in targets]
             else:
                 images = Variable(images)
-                targets = [Variable(anno, volatile=True) for anno in targets]
+                if not isinstance(targets, tuple):
+                    targets = [Variable(anno, volatile=True) for anno in targets]
+            images = normalize_batch(images, self.cfg.DATASET.PIXEL_MEANS)
 
 
             _t.tic()
@@ -501,10 +526,11 @@ class Solver(object):
             # loss
             loss_l, loss_c = criterion(out, targets)
 
-            out = (out[0], model.softmax(out[1].view(-1, model.num_classes)))
+            conf = out[1].view(-1, model.num_classes)
+            out = (out[0], conf if detector.logits else model.softmax(conf))
 
             # detect
-            detections = detector.forward(out)
+            detections = detector.detect(out)
 
             time = _t.toc()
 
@@ -559,20 +585,10 @@ class Solver(object):
         out = model(images, phase='eval')
 
         # detect
-        detections = detector.forward(out)
-        _scores=[]
-        _labels=[]
-        _coords=[]
-        batch = 0
-        for j in range(1, num_classes):
-            for det in detections[0][j]:
-                if det[0] > 0.45:
-                    d = det.cpu().numpy()
-                    score, box = d[0], d[1:]
-                    box *= scale
-                    _labels.append(j-1)
-                    _coords.append(box)
-                    _scores.append(score)
+        detections = detector.detect(out).filter(0.45).scale(scale[:2])
+        _labels = (detections.labels - 1).tolist()
+        _scores = detections.scores.tolist()
+        _coords = detections.boxes.cpu().numpy()
 
         COLORS = [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
         FONT = cv2.FONT_HERSHEY_SIMPLEX
@@ -595,7 +611,6 @@ class Solver(object):
         num_images = len(dataset)
         num_classes = detector.num_classes
         all_boxes = [[[] for _ in range(num_images)] for _ in range(num_classes)]
-        empty_array = np.transpose(np.array([[],[],[],[],[]]),(1,0))
 
         _t = Timer()
 
@@ -612,23 +627,13 @@ class Solver(object):
             out = model(images, phase='eval')
 
             # detect
-            detections = detector.forward(out)
+            detections = detector.detect(out)
 
             time = _t.toc()
 
-            # TODO: make it smart:
+            cls_dets = detections.scale(scale[:2]).class_arrays(0, num_classes)
             for j in range(1, num_classes):
-                cls_dets = list()
-                for det in detections[0][j]:
-                    if det[0] > 0:
-                        d = det.cpu().numpy()
-                        score, box = d[0], d[1:]
-                        box *= scale
-                        box = np.append(box, score)
-                        cls_dets.append(box)
-                if len(cls_dets) == 0:
-                    cls_dets = empty_array
-                all_boxes[j][i] = np.array(cls_dets)
+                all_boxes[j][i] = cls_dets[j]
 
             # log per iter
             log = '\r==>Test: || {iters:d}/{epoch_size:d} in {time:.3f}s [{prograss}]\r'.format(
@@ -758,20 +763,10 @@ def create_npjson(s, image, json_path,use_gpu = True):
     out = model(images, phase='eval')
 
     # detect
-    detections = detector.forward(out)
-    _scores = []
-    _labels = []
-    _coords = []
-    batch = 0
-    for j in range(1, num_classes):
-        for det in detections[0][j]:
-            if det[0] > 0.45:
-                d = det.cpu().numpy()
-                score, box = d[0], d[1:]
-                box *= scale
-                _labels.append(j - 1)
-                _coords.append(box)
-                _scores.append(score)
+    detections = detector.detect(out).filter(0.45).scale(scale[:2])
+    _labels = (detections.labels - 1).tolist()
+    _scores = detections.scores.tolist()
+    _coords = detections.boxes.cpu().numpy()
 
     COLORS = [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
     FONT = cv2.FONT_HERSHEY_SIMPLEX
@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+from torch.nn.utils.rnn import pad_sequence
 import math
 import numpy as np
 if torch.cuda.is_available():
@@ -19,6 +20,63 @@ def point_form(boxes):
                      boxes[:, :2] + boxes[:, 2:]/2), 1)  # xmax, ymax
 
 
+# slack added to the reach of the grid cells, covers the float32 rounding of the priors
+GRID_MARGIN = 1e-4
+
+
+class PriorSet(object):
+    """Prior boxes together with the derived forms used by matching and
+    encoding, computed once on the device of the priors instead of on every
+    call.
+    Args:
+        priors: (tensor) Prior boxes in center-offset form, Shape: [num_priors,4].
+        level_sizes: (list[int]) Number of priors of every feature map, in order.
+        grids: (list) (height, width, num_anchors, step, offset) of every
+            feature map, step and offset being (y, x) pairs. The priors of a
+            map are ordered by row, column and anchor, as PriorBox makes them.
+    """
+    def __init__(self, priors, level_sizes=None, grids=None):
+        self.center = priors
+        self.point = point_form(priors)
+        self.area = (self.point[:, 2]-self.point[:, 0]) * (self.point[:, 3]-self.point[:, 1])
+        self.inv_wh = 1. / priors[:, 2:]
+        ends = np.cumsum(level_sizes or [priors.size(0)]).tolist()
+        # [start, end) of the priors of every feature map
+        self.levels = list(zip([0] + ends[:-1], ends))
+        self._grids = grids
+        self.grids = None
+        if grids is not None:
+            self.grids = [self._grid(priors[start:end], *grid) for (start, end), grid in zip(self.levels, grids)]
+
+    @staticmethod
+    def _grid(priors, height, width, num_anchors, step, offset):
+        """(width, height, num_anchors, step, offset, reach) of a feature map,
+        with (x, y) pairs. reach is the farthest a prior edge gets from the
+        center of its cell.
+        """
+        cells = priors.view(height, width, num_anchors, 4)
+        cx = torch.arange(width, dtype=priors.dtype, device=priors.device) * step[1] + offset[1]
+        cy = torch.arange(height, dtype=priors.dtype, device=priors.device) * step[0] + offset[0]
+        reach_x = ((cells[:, :, :, 0] - cx.view(1, -1, 1)).abs() + cells[:, :, :, 2] / 2).max().item()
+        reach_y = ((cells[:, :, :, 1] - cy.view(-1, 1, 1)).abs() + cells[:, :, :, 3] / 2).max().item()
+        return (width, height, num_anchors, (step[1], step[0]), (offset[1], offset[0]),
+                (reach_x + GRID_MARGIN, reach_y + GRID_MARGIN))
+
+    def __len__(self):
+        return self.center.size(0)
+
+    def to(self, *args, **kwargs):
+        """The PriorSet moved or cast like tensor.to"""
+        return PriorSet(self.center.to(*args, **kwargs), [end - start for start, end in self.levels], self._grids)
+
+
+def as_prior_set(priors):
+    """PriorSet of priors, which can also be a prior tensor or Variable"""
+    if isinstance(priors, PriorSet):
+        return priors
+    return PriorSet(priors.data)
+
+
 def center_size(boxes):
     """ Convert prior_boxes to (cx, cy, w, h)
     representation for comparison to center-size form ground truth data.
@@ -52,7 +110,7 @@ def intersect(box_a, box_b):
     return inter[:, :, 0] * inter[:, :, 1]
 
 
-def jaccard(box_a, box_b):
+def jaccard(box_a, box_b, area_b=None):
     """Compute the jaccard overlap of two sets of boxes.  The jaccard overlap
     is simply the intersection over union of two boxes.  Here we operate on
     ground truth boxes and default boxes.
@@ -61,17 +119,114 @@ def jaccard(box_a, box_b):
     Args:
         box_a: (tensor) Ground truth bounding boxes, Shape: [num_objects,4]
         box_b: (tensor) Prior boxes from priorbox layers, Shape: [num_priors,4]
+        area_b: (tensor) Precomputed areas of box_b, Shape: [num_priors]
     Return:
         jaccard overlap: (tensor) Shape: [box_a.size(0), box_b.size(0)]
     """
     inter = intersect(box_a, box_b)
     area_a = ((box_a[:, 2]-box_a[:, 0]) *
               (box_a[:, 3]-box_a[:, 1])).unsqueeze(1).expand_as(inter)  # [A,B]
-    area_b = ((box_b[:, 2]-box_b[:, 0]) *
-              (box_b[:, 3]-box_b[:, 1])).unsqueeze(0).expand_as(inter)  # [A,B]
+    if area_b is None:
+        area_b = (box_b[:, 2]-box_b[:, 0]) * (box_b[:, 3]-box_b[:, 1])
+    area_b = area_b.unsqueeze(0).expand_as(inter)  # [A,B]
     union = area_a + area_b - inter
     return inter / union  # [A,B]
 
+def grid_overlaps(truths, priors):
+    """Sparse jaccard(truths, priors.point): the priors a truth box can
+    intersect are looked up on the grids of the PriorSet, only those pairs are
+    computed. Every other pair has no intersection, hence a zero overlap.
+    Args:
+        truths: (tensor) Ground truth boxes, Shape: [num_obj,4].
+        priors: (PriorSet) Prior boxes with their grids.
+    Return:
+        truth index, prior index and jaccard overlap of the pairs, Shape: [num_pairs]
+    """
+    truth_idx, prior_idx = [], []
+    num_truths = truths.size(0)
+    for (start, end), (width, height, num_anchors, step, offset, reach) in zip(priors.levels, priors.grids):
+        step, offset, reach = [truths.new_tensor(v) for v in (step, offset, reach)]
+        # range of the cells reaching each truth box, [num_obj,2] (x, y)
+        lo = torch.floor((truths[:, :2] - offset - reach) / step).long().clamp(min=0)
+        hi = torch.min(torch.ceil((truths[:, 2:] - offset + reach) / step).long(),
+                       lo.new_tensor([width - 1, height - 1]))
+        span = (hi - lo + 1).clamp(min=0)
+        num_cells = span[:, 0] * span[:, 1]
+        truth = torch.arange(num_truths, device=truths.device).repeat_interleave(num_cells)
+        local = torch.arange(truth.numel(), device=truths.device) - (num_cells.cumsum(0) - num_cells)[truth]
+        cell_x = lo[truth, 0] + local % span[truth, 0]
+        cell_y = lo[truth, 1] + local // span[truth, 0]
+        prior = start + ((cell_y * width + cell_x) * num_anchors).unsqueeze(1) + \
+            torch.arange(num_anchors, device=truths.device)
+        truth_idx.append(truth.unsqueeze(1).expand_as(prior).contiguous().view(-1))
+        prior_idx.append(prior.view(-1))
+    truth_idx = torch.cat(truth_idx)
+    prior_idx = torch.cat(prior_idx)
+
+    # the arithmetic of intersect and jaccard, pair by pair
+    box_a = truths[truth_idx]
+    box_b = priors.point[prior_idx]
+    inter = torch.clamp(torch.min(box_a[:, 2:], box_b[:, 2:]) - torch.max(box_a[:, :2], box_b[:, :2]), min=0)
+    inter = inter[:, 0] * inter[:, 1]
+    area_a = (box_a[:, 2]-box_a[:, 0]) * (box_a[:, 3]-box_a[:, 1])
+    union = area_a + priors.area[prior_idx] - inter
+    return truth_idx, prior_idx, inter / union
+
+
+def _best_pairs(groups, overlaps, ties, num_ties):
+    """Position of the pair with the highest overlap of every group, equal
+    overlaps going to the lowest tie value, like the first index returned by max.
+    """
+    _, rank = torch.unique(overlaps, sorted=True, return_inverse=True)
+    num_ranks = int(rank.max()) + 1
+    _, order = ((groups * num_ranks + (num_ranks - 1 - rank)) * num_ties + ties).sort(0)
+    sorted_groups = groups[order]
+    starts = (sorted_groups[1:] != sorted_groups[:-1]).nonzero().view(-1) + 1
+    return order[torch.cat([starts.new_zeros(1), starts])]
+
+
+def best_overlaps(truths, priors, grid=False):
+    """Best ground truth of every prior and best prior of every ground truth.
+    With grid the overlaps are computed sparsely by grid_overlaps, with the
+    same result as the dense jaccard matrix.
+    Args:
+        truths: (tensor) Ground truth boxes, Shape: [num_obj,4].
+        priors: (PriorSet) Prior boxes.
+        grid: (bool) Use the grids of the priors.
+    Return:
+        best_truth_overlap, best_truth_idx: Shape: [num_priors]
+        best_prior_idx: Shape: [num_obj]
+    """
+    if not grid or priors.grids is None:
+        overlaps = jaccard(truths, priors.point, priors.area)
+        # [num_objects] best prior for each ground truth
+        _, best_prior_idx = overlaps.max(1)
+        # [num_priors] best ground truth for each prior
+        best_truth_overlap, best_truth_idx = overlaps.max(0)
+        return best_truth_overlap, best_truth_idx, best_prior_idx
+
+    num_truths, num_priors = truths.size(0), len(priors)
+    truth_idx, prior_idx, overlaps = grid_overlaps(truths, priors)
+    best_truth_overlap = truths.new_zeros(num_priors)
+    best_truth_idx = truth_idx.new_zeros(num_priors)
+    best_prior_overlap = truths.new_zeros(num_truths)
+    best_prior_idx = truth_idx.new_zeros(num_truths)
+    if overlaps.numel() > 0:
+        best = _best_pairs(prior_idx, overlaps, truth_idx, num_truths)
+        # a prior without overlap keeps truth 0, the first of its zero column
+        best = best[overlaps[best] > 0]
+        best_truth_overlap[prior_idx[best]] = overlaps[best]
+        best_truth_idx[prior_idx[best]] = truth_idx[best]
+        best = _best_pairs(truth_idx, overlaps, prior_idx, num_priors)
+        best_prior_overlap[truth_idx[best]] = overlaps[best]
+        best_prior_idx[truth_idx[best]] = prior_idx[best]
+    # a truth intersecting no prior takes the first maximum of its dense row
+    lost = (best_prior_overlap > 0).eq(0).nonzero().view(-1)
+    if lost.numel() > 0:
+        _, best_prior_idx[lost] = jaccard(truths[lost], priors.point, priors.area).max(1)
+    return best_truth_overlap, best_truth_idx, best_prior_idx
+
+
 def matrix_iou(a,b):
     """
     return iou of a and b, numpy version for data augenmentation
@@ -84,7 +239,7 @@ def matrix_iou(a,b):
     area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
     return area_i / (area_a[:, np.newaxis] + area_b - area_i)
 
-def match_with_ignorance(threshold, unmatched_threshold, bboxes, priors, variances, labels, loc_t, conf_t, idx):
+def match_with_ignorance(threshold, unmatched_threshold, bboxes, priors, variances, labels, loc_t, conf_t, idx, grid=False):
     """Match each prior box with the ground truth box of the highest jaccard
     overlap, encode the bounding boxes, then return the matched indices
     corresponding to both confidence and location preds.
@@ -92,30 +247,20 @@ def match_with_ignorance(threshold, unmatched_threshold, bboxes, priors, varianc
         threshold: (float) The overlap threshold used when mathing boxes.
         unmatched_threshold: (float) The overlap threshold used to consider negtive boxes.
         bboxes: (tensor) Ground truth boxes, Shape: [num_obj, 4].
-        priors: (tensor) Prior boxes from priorbox layers, Shape: [n_priors,4].
+        priors: (PriorSet or tensor) Prior boxes from priorbox layers, Shape: [n_priors,4].
         variances: (tensor) Variances corresponding to each prior coord,
             Shape: [num_priors, 4].
         labels: (tensor) All the class labels for the image, Shape: [num_obj].
         loc_t: (tensor) Tensor to be filled w/ endcoded location targets.
         conf_t: (tensor) Tensor to be filled w/ matched indices for conf preds.
         idx: (int) current batch index
+        grid: (bool) Compute the overlaps sparsely on the prior grids.
     Return:
         The matched indices corresponding to 1)location and 2)confidence preds.
     """
-    # jaccard index
-    overlaps = jaccard(
-        bboxes,
-        point_form(priors)
-    )
-    # (Bipartite Matching)
-    # [num_objects,1] best prior for each ground truth
-    best_prior_overlap, best_prior_idx = overlaps.max(1, keepdim=True)
-    # [1,num_priors] best ground truth for each prior
-    best_truth_overlap, best_truth_idx = overlaps.max(0, keepdim=True)
-    best_truth_idx.squeeze_(0)
-    best_truth_overlap.squeeze_(0)
-    best_prior_idx.squeeze_(1)
-    best_prior_overlap.squeeze_(1)
+    priors = as_prior_set(priors)
+    # (Bipartite Matching) on the jaccard index
+    best_truth_overlap, best_truth_idx, best_prior_idx = best_overlaps(bboxes, priors, grid)
 
     if True:  #skip  bipartite matching
         best_truth_overlap.index_fill_(0, best_prior_idx, 2)  # ensure best prior
@@ -151,37 +296,123 @@ def match_with_ignorance(threshold, unmatched_threshold, bboxes, priors, varianc
 
 
 
-def match(threshold, truths, priors, variances, labels, loc_t, conf_t, idx):
+# upper bound of the [images, truths, priors] overlaps match_batch holds at once
+MATCH_BATCH_ELEMENTS = 1 << 25
+
+
+def pad_targets(targets, device=None):
+    """Ground truths of a batch as padded tensors.
+    Args:
+        targets: (list) [num_obj,5] ground truth boxes and label of every image,
+            or the (padded, lengths) of padded_collate.
+        device: Device of the padded tensors, the one of targets by default.
+    Return:
+        truths, Shape: [batch,max_num_obj,4], labels, Shape: [batch,max_num_obj]
+        and the number of objects of every image, Shape: [batch]
+    """
+    if isinstance(targets, tuple):
+        padded, lengths = [t.to(device) if device is not None else t for t in targets]
+        return padded[:, :, :4], padded[:, :, 4], lengths
+    targets = [anno.data.to(device) if device is not None else anno.data for anno in targets]
+    padded = pad_sequence(targets, batch_first=True)
+    lengths = torch.tensor([anno.size(0) for anno in targets], dtype=torch.long, device=padded.device)
+    return padded[:, :, :4], padded[:, :, 4], lengths
+
+
+def unpad_targets(targets, device=None):
+    """The [num_obj,5] ground truths of every image, for the consumers of
+    the per image targets of detection_collate.
+    Args:
+        targets: (tuple) the (padded, lengths) of padded_collate, a list is
+            returned as it is.
+        device: Device the padded tensor is moved to first, in one copy.
+    """
+    if not isinstance(targets, tuple):
+        return targets
+    padded, lengths = targets
+    if device is not None:
+        padded = padded.to(device)
+    return [padded[i, :n] for i, n in enumerate(lengths.tolist())]
+
+
+def match_batch(threshold, unmatched_threshold, truths, labels, lengths, priors, variances):
+    """match_with_ignorance for a whole batch with tensor ops on the device of
+    the truths, giving bit for bit the same targets. match is the special case
+    unmatched_threshold == threshold. The images are processed in chunks that
+    keep the overlaps below MATCH_BATCH_ELEMENTS.
+    Args:
+        threshold: (float) The overlap threshold used when mathing boxes.
+        unmatched_threshold: (float) The overlap threshold used to consider negtive boxes.
+        truths: (tensor) Padded ground truth boxes, Shape: [batch,max_num_obj,4].
+        labels: (tensor) Padded class labels, Shape: [batch,max_num_obj].
+        lengths: (tensor) Number of objects of every image, Shape: [batch].
+        priors: (PriorSet) Prior boxes, on the device of the truths.
+        variances: (list[float]) Variances of priorboxes
+    Return:
+        loc_t, Shape: [batch,num_priors,4] and conf_t, Shape: [batch,num_priors]
+    """
+    priors = as_prior_set(priors)
+    batch, num_objs = labels.size()
+    chunk = max(1, MATCH_BATCH_ELEMENTS // max(num_objs * len(priors), 1))
+    if batch > chunk:
+        targets = [match_batch(threshold, unmatched_threshold, truths[i:i+chunk], labels[i:i+chunk],
+                               lengths[i:i+chunk], priors, variances) for i in range(0, batch, chunk)]
+        return torch.cat([loc for loc, _ in targets]), torch.cat([conf for _, conf in targets])
+
+    obj = torch.arange(num_objs, dtype=torch.long, device=labels.device)
+    valid = obj.unsqueeze(0) < lengths.unsqueeze(1)  # [batch,num_objs]
+    # jaccard index, the arithmetic of jaccard for every image, [batch,num_objs,num_priors]
+    box_a = truths.unsqueeze(2)
+    max_xy = torch.min(box_a[..., 2:], priors.point[:, 2:])
+    min_xy = torch.max(box_a[..., :2], priors.point[:, :2])
+    inter = torch.clamp((max_xy - min_xy), min=0)
+    inter = inter[..., 0] * inter[..., 1]
+    area_a = (box_a[..., 2]-box_a[..., 0]) * (box_a[..., 3]-box_a[..., 1])
+    overlaps = inter / (area_a + priors.area - inter)
+    # padding never wins a prior
+    overlaps.masked_fill_(valid.unsqueeze(2) == 0, -1)
+
+    # [batch,num_objs] best prior for each ground truth
+    _, best_prior_idx = overlaps.max(2)
+    # [batch,num_priors] best ground truth for each prior
+    best_truth_overlap, best_truth_idx = overlaps.max(1)
+    image, truth = valid.nonzero().t()
+    best_truth_overlap[image, best_prior_idx[image, truth]] = 2  # ensure best prior
+    # ensure every gt matches with its prior of max overlap; a gt sharing its
+    # best prior with a later gt loses it, as in the loop of match
+    shared = (best_prior_idx.unsqueeze(2) == best_prior_idx.unsqueeze(1)) & valid.unsqueeze(1) & \
+             (obj.unsqueeze(1) < obj.unsqueeze(0)).unsqueeze(0)
+    image, truth = (valid & (shared.any(2) == 0)).nonzero().t()
+    best_truth_idx[image, best_prior_idx[image, truth]] = truth
+
+    matches = truths.gather(1, best_truth_idx.unsqueeze(2).expand(batch, len(priors), 4))
+    conf = labels.gather(1, best_truth_idx)
+    conf[best_truth_overlap < threshold] = -2  # label as ignorance
+    conf[best_truth_overlap < unmatched_threshold] = 0  # label as background
+    return encode(matches, priors, variances), conf.long()
+
+
+def match(threshold, truths, priors, variances, labels, loc_t, conf_t, idx, grid=False):
     """Match each prior box with the ground truth box of the highest jaccard
     overlap, encode the bounding boxes, then return the matched indices
     corresponding to both confidence and location preds.
     Args:
         threshold: (float) The overlap threshold used when mathing boxes.
         truths: (tensor) Ground truth boxes, Shape: [num_obj, num_priors].
-        priors: (tensor) Prior boxes from priorbox layers, Shape: [n_priors,4].
+        priors: (PriorSet or tensor) Prior boxes from priorbox layers, Shape: [n_priors,4].
         variances: (tensor) Variances corresponding to each prior coord,
             Shape: [num_priors, 4].
         labels: (tensor) All the class labels for the image, Shape: [num_obj].
         loc_t: (tensor) Tensor to be filled w/ endcoded location targets.
         conf_t: (tensor) Tensor to be filled w/ matched indices for conf preds.
         idx: (int) current batch index
+        grid: (bool) Compute the overlaps sparsely on the prior grids.
     Return:
         The matched indices corresponding to 1)location and 2)confidence preds.
     """
-    # jaccard index
-    overlaps = jaccard(
-        truths,
-        point_form(priors)
-    )
-    # (Bipartite Matching)
-    # [1,num_objects] best prior for each ground truth
-    best_prior_overlap, best_prior_idx = overlaps.max(1, keepdim=True)
-    # [1,num_priors] best ground truth for each prior
-    best_truth_overlap, best_truth_idx = overlaps.max(0, keepdim=True)
-    best_truth_idx.squeeze_(0)
-    best_truth_overlap.squeeze_(0)
-    best_prior_idx.squeeze_(1)
-    best_prior_overlap.squeeze_(1)
+    priors = as_prior_set(priors)
+    # (Bipartite Matching) on the jaccard index
+    best_truth_overlap, best_truth_idx, best_prior_idx = best_overlaps(truths, priors, grid)
     best_truth_overlap.index_fill_(0, best_prior_idx, 2)  # ensure best prior
     # TODO refactor: index  best_prior_idx with long tensor
     # ensure every gt matches with its prior of max overlap
@@ -200,12 +431,19 @@ def encode(matched, priors, variances):
     Args:
         matched: (tensor) Coords of ground truth for each prior in point-form
             Shape: [num_priors, 4].
-        priors: (tensor) Prior boxes in center-offset form
+        priors: (PriorSet or tensor) Prior boxes in center-offset form
             Shape: [num_priors,4].
         variances: (list[float]) Variances of priorboxes
     Return:
         encoded boxes (tensor), Shape: [num_priors, 4]
     """
+    if isinstance(priors, PriorSet):
+        # multiply by the precomputed reciprocals of the prior sizes, matched
+        # can also hold a batch, Shape: [batch,num_priors,4]
+        g_cxcy = ((matched[..., :2] + matched[..., 2:])/2 - priors.center[:, :2]) * priors.inv_wh
+        g_cxcy /= variances[0]
+        g_wh = torch.log((matched[..., 2:] - matched[..., :2]) * priors.inv_wh) / variances[1]
+        return torch.cat([g_cxcy, g_wh], -1)  # [num_priors,4]
 
     # dist b/t match center and prior's center
     g_cxcy = (matched[:, :2] + matched[:, 2:])/2 - priors[:, :2]
@@ -246,15 +484,19 @@ def encode_multi(matched, priors, offsets, variances):
 def decode(loc, priors, variances):
     """Decode locations from predictions using priors to undo
     the encoding we did for offset regression at train time.
+    The rows are decoded independently, so loc and priors can also be
+    the gathered rows of a subset of the priors.
     Args:
         loc (tensor): location predictions for loc layers,
             Shape: [num_priors,4]
-        priors (tensor): Prior boxes in center-offset form.
+        priors (PriorSet or tensor): Prior boxes in center-offset form.
             Shape: [num_priors,4].
         variances: (list[float]) Variances of priorboxes
     Return:
         decoded bounding box predictions
     """
+    if isinstance(priors, PriorSet):
+        priors = priors.center
 
     boxes = torch.cat((
         priors[:, :2] + loc[:, :2] * variances[0] * priors[:, 2:],
@@ -308,7 +550,7 @@ def one_hot_embedding(labels, num_classes):
 # Original author: Francisco Massa:
 # https://github.com/fmassa/object-detection.torch
 # Ported to PyTorch by Max deGroot (02/01/2017)
-def nms(boxes, scores, overlap=0.5, top_k=200):
+def nms(boxes, scores, overlap=0.5, top_k=200, groups=None):
     """Apply non-maximum suppression at test time to avoid detecting too many
     overlapping bounding boxes for a given object.
     Args:
@@ -316,6 +558,8 @@ def nms(boxes, scores, overlap=0.5, top_k=200):
         scores: (tensor) The class predscores for the img, Shape:[num_priors].
         overlap: (float) The overlap thresh for suppressing unnecessary boxes.
         top_k: (int) The Maximum number of box preds to consider.
+        groups: (tensor) Group of every box, boxes of different groups
+            do not suppress each other, Shape:[num_priors].
     Return:
         The indices of the kept boxes with respect to num_priors.
     """
@@ -371,5 +615,60 @@ def nms(boxes, scores, overlap=0.5, top_k=200):
         union = (rem_areas - inter) + area[i]
         IoU = inter/union  # store result in iou
         # keep only elements with an IoU <= overlap
-        idx = idx[IoU.le(overlap)]
+        if groups is None:
+            idx = idx[IoU.le(overlap)]
+        else:
+            idx = idx[IoU.le(overlap) | groups[idx].ne(groups[i])]
     return keep, count
+
+
+def rank_in_group(groups):
+    """Position of every element among the elements of the same group,
+    counting in the order the elements appear.
+    Args:
+        groups: (tensor) Group id of every element, Shape: [N].
+    Return:
+        (LongTensor) rank of every element inside its group, Shape: [N].
+    """
+    n = groups.size(0)
+    position = torch.arange(n, dtype=torch.long, device=groups.device)
+    rank = position.clone()
+    if n == 0:
+        return rank
+    # sort by group while keeping the order of appearance inside a group
+    _, grouped = (groups.long() * n + position).sort(0)
+    sorted_groups = groups[grouped]
+    is_start = torch.ones(n, dtype=torch.uint8, device=groups.device)
+    is_start[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    starts = position[is_start.nonzero().view(-1)]
+    segment = is_start.long().cumsum(0) - 1
+    rank[grouped] = position - starts[segment]
+    return rank
+
+
+def batched_nms(boxes, scores, idxs, overlap=0.5, top_k=200, nms_fn=nms):
+    """Apply nms independently for every group of boxes. The candidates of
+    all the groups are ranked and capped at once, then a single nms call
+    suppresses inside the groups only, on the boxes as they are, so the
+    kept boxes are the ones of the per-group loop (coordinate offsets would
+    cost the boxes their float precision once the group ids reach the
+    thousands).
+    Args:
+        boxes: (tensor) The location preds, Shape: [num_boxes,4].
+        scores: (tensor) The class predscores, Shape:[num_boxes].
+        idxs: (tensor) The group (image or image/class) of every box, Shape:[num_boxes].
+        overlap: (float) The overlap thresh for suppressing unnecessary boxes.
+        top_k: (int) The Maximum number of box preds to consider per group.
+        nms_fn: (callable) nms implementation with the signature of nms.
+    Return:
+        The indices of the kept boxes, sorted by descending score.
+    """
+    if boxes.numel() == 0:
+        return idxs.new_zeros(0).long()
+    # visit the candidates in the order nms does and keep the top_k of each group
+    _, order = scores.sort(0)
+    order = order.flip(0)
+    order = order[rank_in_group(idxs[order]) < top_k]
+    # the kept boxes come in the order nms visits them, by descending score
+    ids, count = nms_fn(boxes[order], scores[order], overlap, order.numel(), idxs[order])
+    return order[ids[:count]]
@@ -76,12 +76,21 @@ __C.MODEL.CLIP = True
 # FSSD setting, NUM_FUSED for fssd
 __C.MODEL.NUM_FUSED = 3
 
+# directory caching the generated prior boxes, empty disables the cache
+__C.MODEL.PRIOR_CACHE_DIR = osp.abspath(osp.join(osp.dirname(__file__), '..', '..', 'experiments/priors/'))
+
+# the model takes the resized uint8 images and subtracts DATASET.PIXEL_MEANS itself,
+# the inference paths and the exported onnx skip the float preprocessing
+__C.MODEL.UINT8_INPUT = False
+
 __C.LOSS = AttrDict()\
 
 __C.LOSS.FOCAL_LOSS = True
 __C.LOSS.CONF_DISTR = 'softmax'
 __C.LOSS.ALPHA= 0.25
 __C.LOSS.GAMMA = 2.0
+# fused focal loss: no one-hot and per entry [num_priors, num_classes] temporaries
+__C.LOSS.FUSED = False
 
 
 # ---------------------------------------------------------------------------- #
@@ -150,6 +159,12 @@ __C.MATCHER.MATCHED_THRESHOLD = 0.5
 __C.MATCHER.UNMATCHED_THRESHOLD = 0.5
 __C.MATCHER.NEGPOS_RATIO = 3
 __C.MATCHER.VARIANCE = [0.1, 0.2]
+# compute the gt/prior overlaps sparsely on the prior grids, same matches as the dense overlaps
+__C.MATCHER.GRID_MATCH = False
+# match the whole batch at once on the device of the predictions, same targets as per image matching
+__C.MATCHER.BATCH_MATCH = False
+# hard negative mining with one topk instead of ranking every prior by two sorts
+__C.MATCHER.TOPK_NEGATIVES = False
 
 
 # ---------------------------------------------------------------------------- #
@@ -163,6 +178,22 @@ __C.POST_PROCESS.SCORE_THRESHOLD = 0.01
 __C.POST_PROCESS.IOU_THRESHOLD = 0.6
 __C.POST_PROCESS.MAX_DETECTIONS = 100
 __C.POST_PROCESS.VARIANCE = __C.MATCHER.VARIANCE 
+# batched post process, all the images and classes are handled by tensor ops
+__C.POST_PROCESS.VECTORIZED = False
+# nms per class instead of nms across all the classes of an image
+__C.POST_PROCESS.PER_CLASS_NMS = False
+# nms implementation, one of 'loop', 'matrix' or 'numpy', which keep the same boxes, or
+# 'torchvision', faster on gpu but its results can differ on equal scores and at the threshold
+__C.POST_PROCESS.NMS_BACKEND = 'loop'
+# keep only the k highest scores of an image before nms, 0 keeps all of them
+__C.POST_PROCESS.PRE_NMS_TOP_K = 0
+# keep only the k highest scores of every class of an image before nms, 0 keeps all of them
+__C.POST_PROCESS.PRE_NMS_TOP_K_PER_CLASS = 0
+# sigmoid heads (LOSS.CONF_DISTR sigmoid, ssd_lite only) hand raw logits to the post process, which
+# thresholds them against logit(SCORE_THRESHOLD) and activates the candidates only
+__C.POST_PROCESS.SIGMOID_LOGITS = False
+# reduce every prior to its highest scored class before nms
+__C.POST_PROCESS.TOP1_CLASS = False
 
 
 # ---------------------------------------------------------------------------- #
@@ -192,6 +223,27 @@ __C.DATASET.TRAIN_BATCH_SIZE = __C.TRAIN.BATCH_SIZE
 __C.DATASET.TEST_BATCH_SIZE = __C.TEST.BATCH_SIZE
 # number of workers to extract datas
 __C.DATASET.NUM_WORKERS = 8
+# match the train targets to the priors in the workers instead of in the loss
+__C.DATASET.MATCH_IN_WORKERS = False
+# read the targets from a memory-mapped annotation index saved next to the dataset
+__C.DATASET.ANNOTATION_INDEX = False
+# decode the jpegs reduced by 2, 4 or 8 as far as the input size and the crops allow (np datasets)
+__C.DATASET.REDUCED_DECODE = False
+# train augmentation: rotation, crop, expand and resize as one cv2.warpAffine
+__C.DATASET.FUSED_WARP = False
+# train augmentation: the imgaug blur, sharpen, noise and contrast ops on cv2 lookup tables and filters
+__C.DATASET.FAST_PHOTOMETRIC = False
+# train augmentation: sample the geometry first and downscale the photo to this many times
+# the input size before warping it, 0 is off (e.g. 1.25)
+__C.DATASET.PLAN_MARGIN = 0
+# train and eval batches as uint8, converted and normalized on the device (4x less ipc and copies)
+__C.DATASET.UINT8_BATCHES = False
+# train and eval targets as one padded [batch,max_num_obj,5] tensor and the lengths, one copy per batch
+__C.DATASET.PADDED_TARGETS = False
+# bytes of decoded train images cached in memory shared by the workers, 0 disables the cache (np dataset)
+__C.DATASET.IMAGE_CACHE_BYTES = 0
+# longest side of the cached images, larger images are downscaled
+__C.DATASET.IMAGE_CACHE_MAX_SIDE = 1200
 # STEPS for the proposed bounding box, for some hare sku
 __C.DATASET.AMBIGOUS_SKUS= [2,3,4]
 
@@ -14,10 +14,70 @@ import random
 import math
 import imgaug.augmenters as iaa
 from lib.utils.box_utils import matrix_iou
+from lib.utils.photometric import Photometric, linear_lut, channel_lut
 #_FOR_PMI_UKRAINE=True
 _FOR_PMI_UKRAINE=False
-def _crop(self, image, boxes, labels):
+# roi proposals tried per iou mode of _crop
+_CROP_TRIALS=50
+
+def _crop_search(width, height, boxes, min_cropped_ratio, min_iou, max_iou):
+    """Draws the _CROP_TRIALS roi proposals of a _crop mode at once and yields
+    the ones whose ious to the boxes lie in [min_iou, max_iou], in draw order,
+    as (roi, iou) with iou of Shape: [num_boxes,1].
+    """
+    # numpy draws seeded from random, which the DataLoader seeds per worker
+    rng = np.random.RandomState(random.getrandbits(32))
+    #it is very strange, pmi ukraine has stock counter function,
+    #the sku in such image is quite big, so need to crop out a small portion
+    #and resize it to [800,600] to make a fake big sku in training stage.
+    scale = rng.uniform(min_cropped_ratio, 1., _CROP_TRIALS)
+    min_ratio = np.maximum(0.85, scale*scale)
+    max_ratio = np.minimum(1/0.85, 1. / scale / scale)
+    ratio = np.sqrt(rng.uniform(min_ratio, max_ratio))
+    w = (scale * ratio * width).astype(int)
+    h = ((scale / ratio) * height).astype(int)
+    l = (rng.random_sample(_CROP_TRIALS) * (width - w)).astype(int)
+    t = (rng.random_sample(_CROP_TRIALS) * (height - h)).astype(int)
+    rois = np.stack((l, t, l + w, t + h), 1)
+
+    iou = matrix_iou(rois, boxes) # [num_trials, num_boxes]
+    valid = (min_iou <= iou.min(1)) & (iou.max(1) <= max_iou)
+    for i in np.flatnonzero(valid):
+        yield rois[i], iou[i][:, np.newaxis]
+
+def _crop_search_loop(width, height, boxes, min_cropped_ratio, min_iou, max_iou):
+    """_crop_search drawing and testing one proposal at a time"""
+    for _ in range(_CROP_TRIALS):
+        scale = random.uniform(min_cropped_ratio, 1.)
+        min_ratio = max(0.85, scale*scale)
+        max_ratio = min(1/0.85, 1. / scale / scale)
+        ratio = math.sqrt(random.uniform(min_ratio, max_ratio))
+        w = int(scale * ratio * width)
+        h = int((scale / ratio) * height)
+        l = random.randrange(width - w)
+        t = random.randrange(height - h)
+        roi = np.array((l, t, l + w, t + h))
+
+        iou = matrix_iou(boxes, roi[np.newaxis])
+        if min_iou <= iou.min() and iou.max() <= max_iou:
+            yield roi, iou
+
+def _crop(self, image, boxes, labels, search=_crop_search):
     height, width, _ = image.shape
+    roi, boxes_t, labels_t, blackouts = _crop_roi(self, height, width, boxes, labels, search)
+    if roi is None:
+        return image, boxes, labels
+    image_t = image[roi[1]:roi[3], roi[0]:roi[2]]
+    for box, value in blackouts:
+        #print("black out the box because iou <0.7")
+        image_t[int(box[1]):int(box[3]), int(box[0]):int(box[2])] = value
+    return image_t, boxes_t, labels_t
+
+def _crop_roi(self, height, width, boxes, labels, search=_crop_search):
+    """The geometry of _crop: the roi (l, t, r, b) cut out of an image of
+    height x width (None to keep it whole), the boxes and labels in the roi
+    and the (box, value) rectangles of the roi to black out.
+    """
     min_cropped_ratio=0.4 if _FOR_PMI_UKRAINE else 0.70
     if len(boxes)== 0 or (len(boxes)==1 and labels[0]==0):
         scale = random.uniform(0.70, 1.)
@@ -32,13 +92,12 @@ def _crop(self, image, boxes, labels):
         l = random.randrange(width - w)
         t = random.randrange(height - h)
         roi = np.array((l, t, l + w, t + h))
-        image_t = image[roi[1]:roi[3], roi[0]:roi[2]]
-        return image_t, boxes, labels
+        return roi, boxes, labels, []
 
     area=np.prod(boxes[:, 2:] - boxes[:, :2], axis=1)/(height*width)
     big_sku = np.mean(area)>=0.05
     if big_sku:
-        return image, boxes, labels
+        return None, boxes, labels, []
     while True:
         mode = random.choice((
             None,
@@ -56,7 +115,7 @@ def _crop(self, image, boxes, labels):
         ))
 
         if mode is None:
-            return image, boxes, labels
+            return None, boxes, labels, []
 
         min_iou, max_iou = mode
         if min_iou is None:
@@ -64,32 +123,7 @@ def _crop(self, image, boxes, labels):
         if max_iou is None:
             max_iou = float('inf')
 
-        for _ in range(50):
-            #scale = random.uniform(0.50, 1.)
-            #it is very strange, pmi ukraine has stock counter function,
-            #the sku in such image is quite big, so need to crop out a small portion
-            #and resize it to [800,600] to make a fake big sku in training stage.
-            scale = random.uniform(min_cropped_ratio, 1.)
-            min_ratio = max(0.85, scale*scale)
-            max_ratio = min(1/0.85, 1. / scale / scale)
-            ratio = math.sqrt(random.uniform(min_ratio, max_ratio))
-            #just keep aspect ratio
-            #ratio = 1.0
-            w = int(scale * ratio * width)
-            h = int((scale / ratio) * height)
-
-
-            l = random.randrange(width - w)
-            t = random.randrange(height - h)
-            roi = np.array((l, t, l + w, t + h))
-
-            iou = matrix_iou(boxes, roi[np.newaxis])
-            
-            if not (min_iou <= iou.min() and iou.max() <= max_iou):
-                continue
-
-            image_t = image[roi[1]:roi[3], roi[0]:roi[2]]
-
+        for roi, iou in search(width, height, boxes, min_cropped_ratio, min_iou, max_iou):
             #centers = (boxes[:, :2] + boxes[:, 2:]) / 2
             #mask = np.logical_and(roi[:2] < centers, centers < roi[2:]).all(axis=1)
             mask = (iou>(1/2400)).squeeze(1)
@@ -128,9 +162,7 @@ def _crop(self, image, boxes, labels):
                     print(bad_mask)
 
             bad_boxes_t=boxes_t[bad_mask]
-            for box in bad_boxes_t:
-                #print("black out the box because iou <0.7")
-                image_t[int(box[1]):int(box[3]), int(box[0]):int(box[2])] = random.randint(0,255)
+            blackouts = [(box, random.randint(0,255)) for box in bad_boxes_t]
 
             boxes_t = boxes_t[~bad_mask]
             labels_t = labels_t [~bad_mask]
@@ -139,18 +171,17 @@ def _crop(self, image, boxes, labels):
                 boxes_t = targets[:, :-1].copy()
                 labels_t = targets[:, -1].copy()
 
-            return image_t, boxes_t,labels_t
+            return roi, boxes_t, labels_t, blackouts
+
+
+def min_crop_ratio():
+    """smallest side of a _crop roi relative to the side of the image"""
+    min_cropped_ratio=0.4 if _FOR_PMI_UKRAINE else 0.70
+    # the aspect ratio factor is at least sqrt(0.8) on both sides
+    return min_cropped_ratio * math.sqrt(0.8)
 
 
 def _distort(image):
-    def _convert(image, alpha=1, beta=0):
-        tmp = image.astype(float) * alpha + beta
-        tmp = np.uint8(np.clip(tmp,0,255))
-        #tmp[tmp < 0] = 0
-        #tmp[tmp > 255] = 255
-        image[:] = tmp
-
-    image = image.copy()
     need_convert=False
     beta=0
     alpha=1
@@ -163,7 +194,7 @@ def _distort(image):
         need_convert=True
 
     if need_convert:
-       _convert(image, alpha=alpha, beta=beta)
+       image = cv2.LUT(image, linear_lut(alpha, beta))
 
     #dont change hue
     #if random.randrange(2):
@@ -174,7 +205,7 @@ def _distort(image):
     # change saturation
     if random.randrange(2):
         image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        _convert(image[:, :, 1], alpha=random.uniform(0.8, 1.3))
+        image = cv2.LUT(image, channel_lut(linear_lut(random.uniform(0.8, 1.3)), 1))
         image = cv2.cvtColor(image, cv2.COLOR_HSV2BGR)
 
 
@@ -182,21 +213,43 @@ def _distort(image):
 
 
 def _expand(image, boxes, fill, p):
-    if random.random() > p:
+    height, width, depth = image.shape
+    canvas = _expand_canvas(height, width, boxes, p)
+    if canvas is None:
         return image, boxes
+    w, h, left, top = canvas
+
+    boxes_t = boxes.copy()
+    boxes_t[:, :2] += (left, top)
+    boxes_t[:, 2:] += (left, top)
+
+
+    expand_image = np.empty(
+        (h, w, depth),
+        dtype=image.dtype)
+    expand_image[:, :] = fill
+    expand_image[top:top + height, left:left + width] = image
+    image = expand_image
+
+    return image, boxes_t
+
+def _expand_canvas(height, width, boxes, p):
+    """The geometry of _expand: (w, h, left, top) of the canvas the image of
+    height x width is placed on, None when it is not expanded."""
+    if random.random() > p:
+        return None
     b_w = (boxes[:, 2] - boxes[:, 0])*1.
     b_h = (boxes[:, 3] - boxes[:, 1])*1.
 
-    min_area=np.min(b_w * b_h)/(image.shape[0]*image.shape[1])
+    min_area=np.min(b_w * b_h)/(height*width)
     #if min_area< 1/40.0*1/50: #too small
     #    return image, boxes
     max_expand_ratio=2.0 if _FOR_PMI_UKRAINE else 1.4
 
     max_pad_scale=np.clip(math.sqrt(min_area)/(1/36.0),1.0, max_expand_ratio)
     if max_pad_scale <=1.0:
-        return image, boxes
+        return None
 
-    height, width, depth = image.shape
     for _ in range(50):
         scale = random.uniform(1.0, max_pad_scale)
 
@@ -212,20 +265,8 @@ def _expand(image, boxes, fill, p):
 
         left = random.randint(0, w - width)
         top = random.randint(0, h - height)
-
-        boxes_t = boxes.copy()
-        boxes_t[:, :2] += (left, top)
-        boxes_t[:, 2:] += (left, top)
-
-
-        expand_image = np.empty(
-            (h, w, depth),
-            dtype=image.dtype)
-        expand_image[:, :] = fill
-        expand_image[top:top + height, left:left + width] = image
-        image = expand_image
-
-        return image, boxes_t
+        return w, h, left, top
+    return None
 
 
 def _mirror(image, boxes):
@@ -265,13 +306,11 @@ def _elastic(image, p, alpha=None, sigma=None, random_state=None):
     return cv2.remap(image, x, y, interpolation=cv2.INTER_LINEAR, borderValue= 0, borderMode=cv2.BORDER_REFLECT)
 
 
-def preproc_for_test(image, w_h_insize, mean):
+def preproc_for_test(image, w_h_insize, mean, hwc=False):
     interp_methods = [cv2.INTER_LINEAR, cv2.INTER_CUBIC, cv2.INTER_AREA, cv2.INTER_NEAREST, cv2.INTER_LANCZOS4]
     interp_method = interp_methods[random.randrange(5)]
     image = cv2.resize(image, (w_h_insize[0], w_h_insize[1]),interpolation=interp_method)
-    image = image.astype(np.float32)
-    image -= mean
-    return image.transpose(2, 0, 1)
+    return _preproc_for_test_with_resized_img(image, mean, hwc)
 
 def _preproc_resize(image, w_h_insize):
     interp_methods = [cv2.INTER_LINEAR, cv2.INTER_CUBIC, cv2.INTER_AREA, cv2.INTER_NEAREST, cv2.INTER_LANCZOS4]
@@ -279,11 +318,28 @@ def _preproc_resize(image, w_h_insize):
     image = cv2.resize(image, (w_h_insize[0], w_h_insize[1]),interpolation=interp_method)
     return image
 
-def _preproc_for_test_with_resized_img(resized_image, mean):
+def _preproc_for_test_with_resized_img(resized_image, mean, hwc=False):
+    if mean is None:
+        # uint8 CHW, normalize_batch subtracts the mean on the device, or
+        # uint8 HWC for the models of MODEL.UINT8_INPUT
+        return resized_image if hwc else resized_image.transpose(2, 0, 1)
     image = resized_image.astype(np.float32)
     image -= mean
     return image.transpose(2, 0, 1)
 
+def normalize_batch(images, mean):
+    """float batch of images minus mean, for the uint8 batches of the
+    preproc of uint8=True; float batches are returned as they are.
+
+    Args:
+        images: (tensor) Shape: [batch,3,height,width]
+        mean: (tuple) the PIXEL_MEANS
+    """
+    if images.dtype != torch.uint8:
+        return images
+    mean = torch.tensor(mean, dtype=torch.float32, device=images.device).view(1, -1, 1, 1)
+    return images.float().sub_(mean)
+
 def draw_bbox(image, bbxs, color=(0, 255, 0)):
     img = image.copy()
     #img = img[...,::-1]
@@ -293,30 +349,41 @@ def draw_bbox(image, bbxs, color=(0, 255, 0)):
     img = img[..., ::-1]
     return img
 
-def rotation(src_img_size , src_img, src_box_info_old):
-    tar_box_info_final = src_box_info_old.copy()
-    tar_img = src_img.copy()
-    src_height_old = int(src_img_size[0])
-    src_width_old = int(src_img_size[1])
-    a = random.randint(1 , 5)
-    ii = 0
+def _rotation_geometry(height, width, a):
+    """The geometry of rotation by a degrees: the affine matrix from the
+    source pixels to the rotated image (the top padding included), the
+    rotated width and height and the top padding."""
     angle_pi = a * math.pi / 180.0
-    crop_center = (0 , 0)
-    M = cv2.getRotationMatrix2D(crop_center, a, 1.0)
-
-    right = int(src_height_old * math.sin(angle_pi))
-    top = int(src_width_old * math.sin(angle_pi))
-    src_width = int(right + src_width_old)
-    src_height = int(top + src_height_old)
-    img_new = cv2.copyMakeBorder(src_img,top,0,0,right,cv2.BORDER_CONSTANT,value=[0,0,0])
-
-    tar_img = cv2.warpAffine(img_new, M,(src_width, src_height))
-
-    tar_box_info = np.zeros((2, 2))
+    right = int(height * math.sin(angle_pi))
+    top = int(width * math.sin(angle_pi))
+    M = cv2.getRotationMatrix2D((0 , 0), a, 1.0)
+    M[:, 2] += M[:, 1] * top
+    return M, int(right + width), int(top + height), top
+
+def _rotate_boxes(boxes, a, top, width, height):
+    """The boxes of rotation: the ends of the middle lines of the boxes rotated
+    by a degrees in the image padded by top, clipped to the rotated width and height.
+    Computed in float64 like the python floats of _rotate_boxes_loop and stored
+    in the dtype of boxes."""
+    angle_pi = a * math.pi / 180.0
+    cos, sin = math.cos(angle_pi), math.sin(angle_pi)
+    boxes_t = boxes.copy()
+    boxes = boxes.astype(np.float64)
+    y_mid = ((boxes[:, 3] - boxes[:, 1]) / 2) + boxes[:, 1] + top
+    x_mid = ((boxes[:, 2] - boxes[:, 0]) / 2) + boxes[:, 0]
+    for i in (0, 2):
+        boxes_t[:, i] = np.clip(boxes[:, i] * cos + y_mid * sin, 0, width)
+    for i in (1, 3):
+        boxes_t[:, i] = np.clip((boxes[:, i] + top) * cos - x_mid * sin, 0, height)
+    return boxes_t
+
+def _rotate_boxes_loop(boxes, a, top, width, height):
+    """_rotate_boxes one box and coordinate at a time"""
+    angle_pi = a * math.pi / 180.0
+    boxes_t = boxes.copy()
     tar_box_info1 = np.zeros((2, 2))
     tar_box_info2 = np.zeros((2, 2))
-    for z,item in enumerate(src_box_info_old):
-        src_box_info = item
+    for z,src_box_info in enumerate(boxes):
         src_box_info1 = [src_box_info[0], (((src_box_info[3] - src_box_info[1]) / 2) + src_box_info[1] + top), src_box_info[2],
                          ((src_box_info[3] - src_box_info[1]) / 2) + src_box_info[1] + top]
         src_box_info2 = [((src_box_info[2] - src_box_info[0]) / 2) + src_box_info[0], src_box_info[1] + top,
@@ -327,28 +394,57 @@ def rotation(src_img_size , src_img, src_box_info_old):
             tar_box_info2[i][1] = ((src_box_info2[2 * i + 1]) * math.cos(angle_pi) - (src_box_info2[2 * i]) * math.sin(angle_pi))
             if tar_box_info1[i][0] < 0:
                 tar_box_info1[i][0] = 0
-            elif tar_box_info1[i][0] > src_width:
-                tar_box_info1[i][0] = src_width
+            elif tar_box_info1[i][0] > width:
+                tar_box_info1[i][0] = width
             if tar_box_info2[i][1] < 0:
                 tar_box_info2[i][1] = 0
-            elif tar_box_info2[i][1] > src_height:
-                tar_box_info2[i][1] = src_height
+            elif tar_box_info2[i][1] > height:
+                tar_box_info2[i][1] = height
 
-        tar_box_info = tar_box_info1[0][0],tar_box_info2[0][1],tar_box_info1[1][0],tar_box_info2[1][1]
-        tar_box_info_final[z]=tar_box_info
-        ii+=1
-    return tar_img , tar_box_info_final[0:ii]
+        boxes_t[z] = tar_box_info1[0][0],tar_box_info2[0][1],tar_box_info1[1][0],tar_box_info2[1][1]
+    return boxes_t
+
+def rotation(src_img_size , src_img, src_box_info_old):
+    src_height_old = int(src_img_size[0])
+    src_width_old = int(src_img_size[1])
+    a = random.randint(1 , 5)
+    angle_pi = a * math.pi / 180.0
+    crop_center = (0 , 0)
+    M = cv2.getRotationMatrix2D(crop_center, a, 1.0)
+
+    right = int(src_height_old * math.sin(angle_pi))
+    top = int(src_width_old * math.sin(angle_pi))
+    src_width = int(right + src_width_old)
+    src_height = int(top + src_height_old)
+    img_new = cv2.copyMakeBorder(src_img,top,0,0,right,cv2.BORDER_CONSTANT,value=[0,0,0])
+
+    tar_img = cv2.warpAffine(img_new, M,(src_width, src_height))
+
+    tar_box_info_final = _rotate_boxes(src_box_info_old, a, top, src_width, src_height)
+    return tar_img , tar_box_info_final
 
 class preproc(object):
 
-    def __init__(self, resize, rgb_means, p, writer=None, ambigous_skus=[],ambigous_skus_crop_ratio=0.35):
+    def __init__(self, resize, rgb_means, p, writer=None, ambigous_skus=[],ambigous_skus_crop_ratio=0.35, fused=False, fast_photometric=False,
+                 plan_margin=0, uint8=False, hwc=False):
         self.means = rgb_means
+        # None returns uint8 images, the mean is subtracted on the device
+        self.input_means = None if uint8 else rgb_means
+        # with uint8, keep the HWC layout the models of MODEL.UINT8_INPUT take
+        self.hwc = hwc
+        # rotation, crop, expand and resize as a single warp
+        self.fused = fused
+        # plan the geometry first and downscale the image to plan_margin times
+        # the input size before it, the pixel-wise ops run at about the input size
+        self.plan_margin = plan_margin
         self.w_h_resize = [resize[1],resize[0]]  #opencv's resize, which is w,h
         self.p = p
         self.writer = writer # writer used for tensorboard visualization
         self.epoch = 0
         self.ambigous_skus = ambigous_skus
         self.ambigous_skus_crop_ratio = ambigous_skus_crop_ratio
+        # cv2 reimplementation of the imgaug seq
+        self.photometric = Photometric(p) if fast_photometric else None
         if p>=0 and p <=1:
             sometimes = lambda aug: iaa.Sometimes(p, aug)
             self.seq = iaa.Sequential(
@@ -387,7 +483,7 @@ class preproc(object):
             targets = np.zeros((1,5))
             #targets[0] = image.shape[0]
             #targets[0] = image.shape[1]
-            image = preproc_for_test(image, self.w_h_resize, self.means)
+            image = preproc_for_test(image, self.w_h_resize, self.input_means, self.hwc)
             return torch.from_numpy(image), targets
 
         #print(targets)
@@ -406,7 +502,7 @@ class preproc(object):
             boxes[:, 1::2] /= height
             labels = np.expand_dims(labels,1)
             targets = np.hstack((boxes,labels))
-            image = preproc_for_test(image, self.w_h_resize, self.means)
+            image = preproc_for_test(image, self.w_h_resize, self.input_means, self.hwc)
             return torch.from_numpy(image), targets
 
         image_o = image.copy()
@@ -422,42 +518,46 @@ class preproc(object):
         if self.writer is not None:
             image_show = draw_bbox(image, boxes)
             self.writer.add_image('preprocess/input_image', image_show, self.epoch, dataformats='HWC')
-        ran = random.randint(0 , 1)
-        if ran == 1:
-            image, boxes = rotation(image.shape, image, boxes)
-
-        image_t, boxes, labels = _crop(self, image, boxes, labels)
-        if self.writer is not None:
-            image_show = draw_bbox(image_t, boxes)
-            self.writer.add_image('preprocess/crop_image', image_show, self.epoch,dataformats='HWC')
-
-        distorted = False
-        h, w ,_ = image_t.shape
-        if h*w < self.w_h_resize[0]* self.w_h_resize[1]:
-            distorted = True
-            image_t = _distort(image_t)
+        if self.fused or self.plan_margin:
+            image_t, boxes, labels, width, height = self._warp(image, boxes, labels, self.plan_margin)
+            distorted = False
+        else:
+            ran = random.randint(0 , 1)
+            if ran == 1:
+                image, boxes = rotation(image.shape, image, boxes)
+
+            image_t, boxes, labels = _crop(self, image, boxes, labels)
             if self.writer is not None:
                 image_show = draw_bbox(image_t, boxes)
-                self.writer.add_image('preprocess/distort_image', image_show, self.epoch, dataformats='HWC')
+                self.writer.add_image('preprocess/crop_image', image_show, self.epoch,dataformats='HWC')
+
+            distorted = False
+            h, w ,_ = image_t.shape
+            if h*w < self.w_h_resize[0]* self.w_h_resize[1]:
+                distorted = True
+                image_t = _distort(image_t)
+                if self.writer is not None:
+                    image_show = draw_bbox(image_t, boxes)
+                    self.writer.add_image('preprocess/distort_image', image_show, self.epoch, dataformats='HWC')
         
-        # image_t = _elastic(image_t, self.p)
-        # if self.writer is not None:
-        #     image_show = draw_bbox(image_t, boxes)
-        #     self.writer.add_image('preprocess/elastic_image', image_show, self.epoch)
+            # image_t = _elastic(image_t, self.p)
+            # if self.writer is not None:
+            #     image_show = draw_bbox(image_t, boxes)
+            #     self.writer.add_image('preprocess/elastic_image', image_show, self.epoch)
 
-        image_t, boxes = _expand(image_t, boxes, self.means, self.p)
-        if self.writer is not None:
-            image_show = draw_bbox(image_t, boxes)
-            self.writer.add_image('preprocess/expand_image', image_show, self.epoch, dataformats='HWC')
+            image_t, boxes = _expand(image_t, boxes, self.means, self.p)
+            if self.writer is not None:
+                image_show = draw_bbox(image_t, boxes)
+                self.writer.add_image('preprocess/expand_image', image_show, self.epoch, dataformats='HWC')
 
-        #image_t, boxes = _mirror(image_t, boxes)
-        #if self.writer is not None:
-        #    image_show = draw_bbox(image_t, boxes)
-        #    self.writer.add_image('preprocess/mirror_image', image_show, self.epoch)
+            #image_t, boxes = _mirror(image_t, boxes)
+            #if self.writer is not None:
+            #    image_show = draw_bbox(image_t, boxes)
+            #    self.writer.add_image('preprocess/mirror_image', image_show, self.epoch)
 
 
-        height, width, _ = image_t.shape
-        image_t = _preproc_resize(image_t, self.w_h_resize)
+            height, width, _ = image_t.shape
+            image_t = _preproc_resize(image_t, self.w_h_resize)
         if not distorted:
             image_t = _distort(image_t)
             if self.writer is not None:
@@ -467,8 +567,11 @@ class preproc(object):
                 image_show = draw_bbox(image_t, boxes1)
                 self.writer.add_image('preprocess/distort_image', image_show, self.epoch, dataformats='HWC')
 
-        seq_det = self.seq.to_deterministic()
-        image_t = seq_det.augment_images([image_t])[0]
+        if self.photometric is not None:
+            image_t = self.photometric(image_t)
+        else:
+            seq_det = self.seq.to_deterministic()
+            image_t = seq_det.augment_images([image_t])[0]
         if self.writer is not None:
             boxes1 = boxes.copy()
             boxes1[:, 0::2] *= self.w_h_resize[0]/width
@@ -481,7 +584,7 @@ class preproc(object):
             # print('image adding')
             self.release_writer()
 
-        image_t = _preproc_for_test_with_resized_img(image_t, self.means)
+        image_t = _preproc_for_test_with_resized_img(image_t, self.input_means, self.hwc)
 
         boxes = boxes.copy()
         boxes[:, 0::2] /= width
@@ -501,7 +604,7 @@ class preproc(object):
         #image_t, boxes_t = rotation(image_t.shape, image_t, boxes_t)
 
         if len(boxes_t)==0:
-            image = preproc_for_test(image_o, self.w_h_resize, self.means)
+            image = preproc_for_test(image_o, self.w_h_resize, self.input_means, self.hwc)
             return torch.from_numpy(image),targets_o
 
         labels_t = np.expand_dims(labels_t,1)
@@ -530,6 +633,94 @@ class preproc(object):
 
 
 
+    def _plan(self, height, width, boxes, labels):
+        """Samples the rotation, _crop and _expand of __call__ for an image
+        of height x width without touching its pixels.
+
+        Return:
+            the 3x3 affine matrix from the image to the expanded canvas, the
+            boxes and labels on the canvas, the (box, value) rectangles to
+            black out, the (l, t, r, b) of the image on the canvas (None when
+            not expanded) and the canvas width and height
+        """
+        A = np.eye(3)
+        def translation(x, y):
+            return np.array([[1., 0., x], [0., 1., y], [0., 0., 1.]])
+
+        if random.randint(0 , 1) == 1:
+            a = random.randint(1 , 5)
+            M, width, height, top = _rotation_geometry(height, width, a)
+            boxes = _rotate_boxes(boxes, a, top, width, height)
+            A = np.vstack((M, (0., 0., 1.))).dot(A)
+
+        roi, boxes, labels, blackouts = _crop_roi(self, height, width, boxes, labels)
+        if roi is not None:
+            A = translation(-roi[0], -roi[1]).dot(A)
+            width, height = int(roi[2] - roi[0]), int(roi[3] - roi[1])
+
+        inner = None
+        canvas = _expand_canvas(height, width, boxes, self.p)
+        if canvas is not None:
+            w, h, left, top = canvas
+            boxes = boxes.copy()
+            boxes[:, :2] += (left, top)
+            boxes[:, 2:] += (left, top)
+            blackouts = [(box + (left, top, left, top), value) for box, value in blackouts]
+            A = translation(left, top).dot(A)
+            inner = (left, top, left + width, top + height)
+            width, height = w, h
+        return A, boxes, labels, blackouts, inner, width, height
+
+    def _warp(self, image, boxes, labels, margin=0):
+        """rotation, _crop, _expand and _preproc_resize of __call__ composed
+        into one affine matrix and applied by a single cv2.warpAffine. The
+        boxes and labels go through the same steps as in __call__; they are
+        returned with the width and height of the canvas before the resize,
+        which __call__ normalizes them by.
+
+        With margin 0 the image is warped straight into the output size.
+        Otherwise the geometry is planned first, the image downscaled so that
+        the canvas is margin times the output size, warped at that size and
+        resized to the output like _preproc_resize.
+        """
+        src_height, src_width, _ = image.shape
+        A, boxes, labels, blackouts, inner, width, height = self._plan(src_height, src_width, boxes, labels)
+
+        out_w, out_h = self.w_h_resize
+        interp_methods = [cv2.INTER_LINEAR, cv2.INTER_CUBIC, cv2.INTER_AREA, cv2.INTER_NEAREST, cv2.INTER_LANCZOS4]
+        interp_method = interp_methods[random.randrange(5)]
+        if margin:
+            s = min(1., margin * max(out_w / float(width), out_h / float(height)))
+            size = (max(1, int(round(width * s))), max(1, int(round(height * s))))
+            if s < 1:
+                small = (max(1, int(round(src_width * s))), max(1, int(round(src_height * s))))
+                image = cv2.resize(image, small, interpolation=cv2.INTER_AREA)
+                A = A.dot(np.diag((src_width / float(small[0]), src_height / float(small[1]), 1.)))
+            warp_method = cv2.INTER_LINEAR
+        else:
+            size = (out_w, out_h)
+            # warpAffine has no area interpolation
+            warp_method = cv2.INTER_LINEAR if interp_method == cv2.INTER_AREA else interp_method
+        scale = np.array((size[0] / float(width), size[1] / float(height)) * 2)
+        A = np.diag((scale[0], scale[1], 1.)).dot(A)
+        image_t = cv2.warpAffine(image, A[:2], size, flags=warp_method,
+                                 borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+
+        if inner is not None:
+            l, t, r, b = np.round(np.array(inner) * scale).astype(int)
+            fill = np.empty((1, 1, 3), dtype=image_t.dtype)
+            fill[:, :] = self.means
+            image_t[:t] = fill
+            image_t[b:] = fill
+            image_t[t:b, :l] = fill
+            image_t[t:b, r:] = fill
+        for box, value in blackouts:
+            l, t, r, b = np.round(np.array(box).astype(int) * scale).astype(int)
+            image_t[t:b, l:r] = value
+        if margin:
+            image_t = cv2.resize(image_t, (out_w, out_h), interpolation=interp_method)
+        return image_t, boxes, labels, width, height
+
     def add_writer(self, writer, epoch=None):
         self.writer = writer
         self.epoch = epoch if epoch is not None else self.epoch + 1
@@ -1,6 +1,9 @@
 import torch
 import numpy as np
 
+from lib.layers.functions.detection import DetectionBatch
+from lib.utils.box_utils import unpad_targets
+
 def iou_gt(detect, ground_turths):
     det_size = (detect[2] - detect[0])*(detect[3] - detect[1])
     detect = detect.resize_(1,4)
@@ -91,6 +94,9 @@ def iou_gt(detect, ground_turths):
 def cal_tp_fp(detects, ground_turths, label, score, npos, gt_label, iou_threshold=0.5, conf_threshold=0.01):
     '''
     '''
+    if isinstance(detects, DetectionBatch):
+        return cal_tp_fp_batch(detects, ground_turths, label, score, npos, gt_label, iou_threshold, conf_threshold)
+    ground_turths = unpad_targets(ground_turths)
     for det, gt in zip(detects, ground_turths):
         for i, det_c in enumerate(det):            
             gt_c = [_gt[:4].data.resize_(1,4) for _gt in gt if int(_gt[4]) == i] 
@@ -149,9 +155,56 @@ def cal_tp_fp(detects, ground_turths, label, score, npos, gt_label, iou_threshol
     return label, score, npos, gt_label
 
 
+def cal_tp_fp_batch(detects, ground_turths, label, score, npos, gt_label, iou_threshold=0.5, conf_threshold=0.01):
+    '''
+    cal_tp_fp for a DetectionBatch: the iou of all the detections and ground
+    truths of a class is computed at once and the greedy matching is solved
+    with arrays. A detection is a true positive when it is the highest scored
+    detection whose best ground truth is that box with iou >= iou_threshold,
+    which is what the greedy loop of cal_tp_fp marks.
+    '''
+    detects = detects.filter(conf_threshold)
+    # one copy of the padded targets to the host
+    ground_turths = unpad_targets(ground_turths, 'cpu')
+    for index, gt in enumerate(ground_turths):
+        boxes, scores, labels = [x.cpu().numpy() for x in detects.image(index)]
+        gt = gt.data.cpu().numpy()
+        bounds = np.searchsorted(labels, np.arange(len(label) + 1))
+        for i in range(len(label)):
+            gt_c = gt[gt[:, 4].astype(int) == i, :4]
+            det_c = boxes[bounds[i]:bounds[i+1]]
+            npos[i] += len(gt_c)
+            # No detection or no ground truth
+            if len(gt_c) == 0 or len(det_c) == 0:
+                gt_label[i] += [False] * len(gt_c)
+                continue
+
+            inter_max = np.maximum(det_c[:, None, :2], gt_c[None, :, :2])
+            inter_min = np.minimum(det_c[:, None, 2:], gt_c[None, :, 2:])
+            inter_size = np.prod(np.maximum(inter_min - inter_max, 0.), axis=2)
+            det_size = np.prod(det_c[:, 2:] - det_c[:, :2], axis=1)
+            gt_size = np.prod(gt_c[:, 2:] - gt_c[:, :2], axis=1)
+            iou_c = inter_size / (det_size[:, None] + gt_size[None, :] - inter_size)
+
+            max_overlap_gt_ids = np.argmax(iou_c, axis=1)
+            matched = np.where(iou_c[np.arange(len(det_c)), max_overlap_gt_ids] >= iou_threshold)[0]
+            # detections are sorted by score, keep the first match of every gt
+            _, first = np.unique(max_overlap_gt_ids[matched], return_index=True)
+            labels_c = np.zeros(len(det_c), dtype=int)
+            labels_c[matched[first]] = 1
+            is_gt_box_detected = np.zeros(len(gt_c), dtype=bool)
+            is_gt_box_detected[max_overlap_gt_ids[matched[first]]] = True
+
+            label[i] += labels_c.tolist()
+            score[i] += scores[bounds[i]:bounds[i+1]].tolist()
+            gt_label[i] += is_gt_box_detected.tolist()
+
+    return label, score, npos, gt_label
+
+
 def cal_size(detects, ground_turths, size):
-    for det, gt in zip(detects, ground_turths):
-        for i, det_c in enumerate(det):  
+    for gt in unpad_targets(ground_turths):
+        for i in range(len(size)):
             gt_c = [_gt[:4].data.resize_(1,4) for _gt in gt if int(_gt[4]) == i] 
             if len(gt_c) == 0:
                 continue
@@ -0,0 +1,76 @@
+"""Reduced resolution jpeg decoding. libjpeg can scale a jpeg by 1/2, 1/4 or
+1/8 in the DCT domain while decoding (cv2.IMREAD_REDUCED_COLOR_*), which is
+several times faster than a full decode followed by cv2.resize.
+"""
+import cv2
+import numpy as np
+
+_REDUCED = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+# start of frame markers, the others of 0xC0-0xCF are DHT, JPG and DAC
+_SOF = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+
+
+def jpeg_size(data):
+    """(width, height) from the frame header of the jpeg bytes data, None when
+    data is not a jpeg"""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    n = len(buf)
+    if n < 4 or buf[0] != 0xFF or buf[1] != 0xD8:
+        return None
+    i = 2
+    while i + 4 <= n:
+        if buf[i] != 0xFF:
+            return None
+        marker = int(buf[i + 1])
+        if marker == 0xFF: # fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7: # markers without a length
+            i += 2
+            continue
+        if marker in _SOF:
+            if i + 9 > n:
+                return None
+            return int(buf[i + 7]) << 8 | int(buf[i + 8]), int(buf[i + 5]) << 8 | int(buf[i + 6])
+        i += 2 + (int(buf[i + 2]) << 8 | int(buf[i + 3]))
+    return None
+
+
+def reduction(size, min_size):
+    """largest libjpeg reduction (factor, imread flag) that keeps an image of
+    size (width, height) at least min_size (width, height)"""
+    for factor, flag in _REDUCED:
+        if size[0] // factor >= min_size[0] and size[1] // factor >= min_size[1]:
+            return factor, flag
+    return 1, cv2.IMREAD_COLOR
+
+
+def decode_reduced(data, min_size=None):
+    """Decodes the jpeg bytes data at the lowest resolution libjpeg offers
+    that is at least min_size (width, height), other formats and no min_size
+    are decoded at full resolution.
+
+    Return:
+        the BGR image and the factors (x, y) it is scaled by relative to the
+        full resolution, the ones the boxes must be multiplied by
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    size = jpeg_size(buf) if min_size else None
+    if size is None:
+        return cv2.imdecode(buf, cv2.IMREAD_COLOR), (1.0, 1.0)
+    factor, flag = reduction(size, min_size)
+    image = cv2.imdecode(buf, flag)
+    if factor == 1:
+        return image, (1.0, 1.0)
+    height, width = image.shape[:2]
+    if (width > height) != (size[0] > size[1]):
+        # turned by the exif orientation
+        size = size[::-1]
+    return image, (width / float(size[0]), height / float(size[1]))
+
+
+def imread_reduced(path, min_size=None):
+    """cv2.imread of path through decode_reduced"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return decode_reduced(data, min_size)
@@ -0,0 +1,130 @@
+import torch
+import numpy as np
+
+
+def _candidate_order(scores, top_k):
+    """Indices of the top_k highest scores, highest first. Uses the same sort
+    as box_utils.nms so that equal scores are visited in the same order.
+    """
+    _, idx = scores.sort(0)  # sort in ascending order
+    return idx[-top_k:].flip(0)
+
+
+def _suppression(x1, y1, x2, y2, area, rows, cols, overlap, groups=None):
+    """Mask of shape [len(rows), len(cols)], set where box rows[i] suppresses
+    box cols[j]. The arithmetic follows box_utils.nms step by step so that
+    both give the same IoU bit for bit. With groups only boxes of the same
+    group suppress each other.
+    """
+    xx1 = torch.max(x1[cols].unsqueeze(0), x1[rows].unsqueeze(1))
+    yy1 = torch.max(y1[cols].unsqueeze(0), y1[rows].unsqueeze(1))
+    xx2 = torch.min(x2[cols].unsqueeze(0), x2[rows].unsqueeze(1))
+    yy2 = torch.min(y2[cols].unsqueeze(0), y2[rows].unsqueeze(1))
+    w = torch.clamp(xx2 - xx1, min=0.0)
+    h = torch.clamp(yy2 - yy1, min=0.0)
+    inter = w*h
+    union = (area[cols].unsqueeze(0) - inter) + area[rows].unsqueeze(1)
+    # a NaN IoU (empty boxes) suppresses, as IoU.le(overlap) does in nms
+    over = (inter/union).le(overlap) == 0
+    if groups is not None:
+        over &= groups[rows].unsqueeze(1) == groups[cols].unsqueeze(0)
+    return over
+
+
+def _sweep(alive, over):
+    """The greedy decisions of a block: the candidates are visited in order,
+    one still alive is kept and removes the later candidates of its row of
+    the suppression bitmask. Like the CUDA nms kernels the bitmask is swept
+    on the host, one row per kept box.
+    Args:
+        alive: (ndarray) bool, the candidates not suppressed yet, Shape: [n].
+        over: (ndarray) bool suppression bitmask of the block, Shape: [n,n].
+    Return:
+        The positions of the kept candidates.
+    """
+    for i in range(alive.shape[0]):
+        if alive[i]:
+            alive[i + 1:] &= ~over[i, i + 1:]
+    return np.flatnonzero(alive)
+
+
+def nms_matrix(boxes, scores, overlap=0.5, top_k=200, groups=None, block_size=1024):
+    """Greedy non-maximum suppression computed with IoU matrices instead of
+    one pass per kept box. Candidates are processed in blocks of block_size:
+    a block is first filtered by the boxes kept so far, then the greedy
+    decisions inside the block are taken by one sweep over its suppression
+    bitmask.
+    Args:
+        boxes: (tensor) The location preds for the img, Shape: [num_priors,4].
+        scores: (tensor) The class predscores for the img, Shape:[num_priors].
+        overlap: (float) The overlap thresh for suppressing unnecessary boxes.
+        top_k: (int) The Maximum number of box preds to consider.
+        groups: (tensor) Group of every box, boxes of different groups
+            do not suppress each other, Shape:[num_priors].
+        block_size: (int) Number of candidates per IoU matrix block.
+    Return:
+        The indices of the kept boxes with respect to num_priors, and their count.
+    """
+    keep = torch.zeros(scores.size(0), dtype=torch.long, device=scores.device)
+    if boxes.numel() == 0:
+        return keep, 0
+    order = _candidate_order(scores, top_k)
+    x1, y1, x2, y2 = boxes[order].t()
+    area = torch.mul(x2 - x1, y2 - y1)
+    if groups is not None:
+        groups = groups[order]
+
+    kept = order.new_zeros(0)
+    for start in range(0, order.size(0), block_size):
+        block = torch.arange(start, min(start + block_size, order.size(0)),
+                             dtype=torch.long, device=order.device)
+        alive = torch.ones(block.size(0), dtype=torch.uint8, device=order.device) == 1
+        if kept.numel() > 0:
+            alive &= _suppression(x1, y1, x2, y2, area, kept, block, overlap, groups).any(0) == 0
+        over = _suppression(x1, y1, x2, y2, area, block, block, overlap, groups)
+        survive = _sweep(alive.cpu().numpy().astype(bool), over.cpu().numpy().astype(bool))
+        kept = torch.cat([kept, block[torch.from_numpy(survive).to(order.device)]])
+
+    count = kept.numel()
+    keep[:count] = order[kept]
+    return keep, count
+
+
+def nms_numpy(boxes, scores, overlap=0.5, top_k=200, groups=None):
+    """NumPy greedy non-maximum suppression, same interface and result as
+    box_utils.nms. The candidate order is taken from torch so that equal
+    scores are visited in the same order by every backend.
+    """
+    keep = torch.zeros(scores.size(0), dtype=torch.long, device=scores.device)
+    if boxes.numel() == 0:
+        return keep, 0
+    order = _candidate_order(scores, top_k)
+    dets = boxes[order].cpu().numpy()
+    x1, y1, x2, y2 = dets[:, 0], dets[:, 1], dets[:, 2], dets[:, 3]
+    area = (x2 - x1) * (y2 - y1)
+    if groups is not None:
+        groups = groups[order].cpu().numpy()
+
+    kept = []
+    idx = np.arange(dets.shape[0])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        while idx.size > 0:
+            i = idx[0]
+            kept.append(i)
+            idx = idx[1:]
+            xx1 = np.maximum(x1[idx], x1[i])
+            yy1 = np.maximum(y1[idx], y1[i])
+            xx2 = np.minimum(x2[idx], x2[i])
+            yy2 = np.minimum(y2[idx], y2[i])
+            w = np.maximum(xx2 - xx1, dets.dtype.type(0))
+            h = np.maximum(yy2 - yy1, dets.dtype.type(0))
+            inter = w*h
+            union = (area[idx] - inter) + area[i]
+            survive = inter/union <= overlap
+            if groups is not None:
+                survive |= groups[idx] != groups[i]
+            idx = idx[survive]
+
+    count = len(kept)
+    keep[:count] = order[torch.from_numpy(np.array(kept, dtype=np.int64)).to(order.device)]
+    return keep, count
@@ -0,0 +1,61 @@
+from lib.utils.box_utils import nms
+from lib.utils.nms.nms_cpu import nms_matrix, nms_numpy, _candidate_order
+import torch
+try:
+    from torchvision.ops import nms as torchvision_nms
+    from torchvision.ops import batched_nms as torchvision_batched_nms
+except ImportError:
+    torchvision_nms = None
+
+
+def nms_torchvision(boxes, scores, overlap=0.5, top_k=200, groups=None):
+    """torchvision.ops.nms, or torchvision.ops.batched_nms with groups, behind
+    the interface of box_utils.nms. Not a drop in: it suppresses at IoU >
+    overlap with its own rounding, orders equal scores its own way and
+    separates the groups by coordinate offsets, so the kept boxes can differ
+    from the other backends on ties and at the threshold."""
+    keep = torch.zeros(scores.size(0), dtype=torch.long, device=scores.device)
+    if boxes.numel() == 0:
+        return keep, 0
+    order = _candidate_order(scores, top_k)
+    if groups is None:
+        ids = torchvision_nms(boxes[order], scores[order], overlap)
+    else:
+        ids = torchvision_batched_nms(boxes[order], scores[order], groups[order], overlap)
+    count = ids.numel()
+    keep[:count] = order[ids]
+    return keep, count
+
+
+# every backend takes (boxes, scores, overlap, top_k, groups=None) and returns
+# (keep, count), these keep the boxes nms keeps
+nms_map = {
+                'loop': nms,
+                'matrix': nms_matrix,
+                'numpy': nms_numpy,
+            }
+# backends whose results can differ from nms, only used when named explicitly
+approximate_nms_map = {}
+if torchvision_nms is not None:
+    approximate_nms_map['torchvision'] = nms_torchvision
+
+
+def gen_nms_fn(name):
+    """Returns a nms func.
+
+    Args:
+    name: The name of the nms backend.
+
+    Returns:
+    func: nms_fn
+
+    Raises:
+    ValueError: If nms backend `name` is not recognized.
+    """
+    if name in approximate_nms_map:
+        print('nms backend {} can keep other boxes than nms on ties and at the threshold'.format(name))
+        return approximate_nms_map[name]
+    if name not in nms_map:
+        raise ValueError('The nms backend unknown %s' % name)
+    func = nms_map[name]
+    return func
@@ -0,0 +1,100 @@
+"""Photometric augmentation on uint8 images without float round-trips.
+Intensity maps (brightness, contrast, saturation) are 256 entry lookup
+tables applied by cv2.LUT, the imgaug ops of preproc are reimplemented
+with cv2 and numpy with the same parameter ranges.
+"""
+import random
+import cv2
+import numpy as np
+
+_IDENTITY = np.arange(256, dtype=np.float64)
+
+
+def linear_lut(alpha=1, beta=0):
+    """uint8 table of v * alpha + beta, clipped and truncated like
+    np.uint8(np.clip(image.astype(float) * alpha + beta, 0, 255))"""
+    return np.clip(_IDENTITY * alpha + beta, 0, 255).astype(np.uint8)
+
+
+def channel_lut(lut, channel, channels=3):
+    """table for cv2.LUT of a channels image applying lut to channel only"""
+    table = np.tile(np.arange(256, dtype=np.uint8)[:, None], (1, channels))
+    table[:, channel] = lut
+    return table.reshape(256, 1, channels)
+
+
+def gaussian_blur(image, sigma):
+    if sigma < 0.01:
+        return image
+    return cv2.GaussianBlur(image, (0, 0), sigmaX=sigma, sigmaY=sigma)
+
+
+def average_blur(image, k):
+    if k <= 1:
+        return image
+    return cv2.blur(image, (k, k))
+
+
+def sharpen(image, alpha, lightness):
+    """imgaug Sharpen: the identity kernel blended by alpha with the
+    laplacian kernel of center 8 + lightness"""
+    kernel = np.full((3, 3), -alpha, dtype=np.float32)
+    kernel[1, 1] = (1 - alpha) + alpha * (8 + lightness)
+    return cv2.filter2D(image, -1, kernel)
+
+
+def additive_noise(image, scale, per_channel):
+    """imgaug AdditiveGaussianNoise of loc 0: one noise value per pixel and
+    channel when per_channel, otherwise one per pixel for all channels"""
+    if scale <= 0:
+        return image
+    shape = image.shape if per_channel else image.shape[:2] + (1,)
+    # numpy draws seeded from random, which the DataLoader seeds per worker
+    rng = np.random.RandomState(random.getrandbits(32))
+    noise = rng.normal(0, scale, shape).round().astype(np.int16)
+    out = image.astype(np.int16)
+    out += noise
+    return np.clip(out, 0, 255, out=out).astype(np.uint8)
+
+
+def contrast(image, alpha):
+    """imgaug ContrastNormalization: 128 + alpha * (v - 128)"""
+    return cv2.LUT(image, linear_lut(alpha, 128 * (1 - alpha)))
+
+
+class Photometric(object):
+    """The imgaug Sequential of preproc on cv2 and numpy: one of a gaussian
+    blur (sigma in [0, 1]) and an average blur (k in [2, 5]), then with
+    probability p each of a sharpen (alpha in [0, 0.5], lightness in
+    [0.75, 1.5]), an additive gaussian noise (scale in [0, 0.02*255],
+    per channel half of the time) and a contrast normalization (alpha in
+    [0.8, 1.2]), the four in random order.
+
+    Arguments:
+        p (float): probability of each of the sometimes ops
+    """
+
+    def __init__(self, p):
+        self.p = p
+
+    def _blur(self, image):
+        if random.randrange(2):
+            return average_blur(image, random.randint(2, 5))
+        return gaussian_blur(image, random.uniform(0, 1.0))
+
+    def _sharpen(self, image):
+        return sharpen(image, random.uniform(0, 0.5), random.uniform(0.75, 1.5))
+
+    def _noise(self, image):
+        return additive_noise(image, random.uniform(0, 0.02 * 255), random.random() < 0.5)
+
+    def _contrast(self, image):
+        return contrast(image, random.uniform(0.8, 1.2))
+
+    def __call__(self, image):
+        ops = [(self._blur, 1.0), (self._sharpen, self.p), (self._noise, self.p), (self._contrast, self.p)]
+        random.shuffle(ops)
+        for op, p in ops:
+            if random.random() < p:
+                image = op(image)
+        return image
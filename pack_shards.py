@@ -0,0 +1,17 @@
+import argparse
+
+from lib.dataset.sharded_np_dataset import pack_shards
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack an np dataset into shards for the np_shards dataset')
+    parser.add_argument("--dataset_dir", type=str, required=True, help="the np dataset folder (with templates.json and photos)")
+    parser.add_argument("--shard_mb", type=int, default=256, help="size of a shard in MB")
+    parser.add_argument("--max_side", type=int, default=0,
+                        help="store raw pixels downscaled to this side instead of the jpeg bytes, 0 keeps the jpegs")
+    args = parser.parse_args()
+    print("shards written to " + pack_shards(args.dataset_dir, args.shard_mb << 20, args.max_side))
+
+
+if __name__ == '__main__':
+    main()
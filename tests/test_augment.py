@@ -0,0 +1,139 @@
+import math
+import random
+
+import pytest
+
+torch = pytest.importorskip('torch')
+np = pytest.importorskip('numpy')
+cv2 = pytest.importorskip('cv2')
+pytest.importorskip('imgaug')
+
+from lib.utils.data_augment import preproc, rotation, _crop, _expand, _preproc_resize, _distort, \
+    _rotate_boxes, _rotate_boxes_loop
+from lib.utils.photometric import linear_lut
+
+MEANS = (104, 117, 123)
+
+
+def _image(height=900, width=1200):
+    """smooth image, where a warp and its staged version differ little"""
+    y, x = np.mgrid[:height, :width].astype(np.float64)
+    channels = [np.sin(x / 37.), np.cos(y / 29.), np.sin((x + y) / 53.)]
+    return np.uint8(np.stack(channels, -1) * 100 + 127.5)
+
+
+def _targets(height=900, width=1200, num=40, seed=0):
+    state = np.random.RandomState(seed)
+    wh = state.uniform(30, 120, (num, 2))
+    xy = state.uniform(0, 1, (num, 2)) * ([width, height] - wh)
+    return np.hstack((xy, xy + wh)), state.randint(1, 37, num).astype(np.float64)
+
+
+def _staged(transform, image, boxes, labels):
+    """rotation, _crop, _expand and _preproc_resize as __call__ chains them"""
+    if random.randint(0, 1) == 1:
+        image, boxes = rotation(image.shape, image, boxes)
+    image, boxes, labels = _crop(transform, image, boxes, labels)
+    image, boxes = _expand(image, boxes, transform.means, transform.p)
+    height, width, _ = image.shape
+    return _preproc_resize(image, transform.w_h_resize), boxes, labels, width, height
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_fused_warp_matches_the_staged_ops(seed):
+    transform = preproc([300, 300], MEANS, 0.6, fused=True)
+    image = _image()
+    boxes, labels = _targets(seed=seed)
+    random.seed(seed)
+    image_s, boxes_s, labels_s, width_s, height_s = _staged(transform, image.copy(), boxes.copy(), labels.copy())
+    random.seed(seed)
+    image_f, boxes_f, labels_f, width_f, height_f = transform._warp(image.copy(), boxes.copy(), labels.copy())
+
+    assert (width_f, height_f) == (width_s, height_s)
+    assert np.array_equal(boxes_f, boxes_s)
+    assert np.array_equal(labels_f, labels_s)
+    assert image_f.shape == image_s.shape
+    # interpolation and the half pixel at the canvas edges
+    assert np.abs(image_f.astype(np.float64) - image_s).mean() < 8
+
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_planned_warp_matches_the_staged_ops(seed):
+    transform = preproc([300, 300], MEANS, 0.6, plan_margin=1.25)
+    image = _image()
+    boxes, labels = _targets(seed=seed)
+    random.seed(seed)
+    image_s, boxes_s, labels_s, width_s, height_s = _staged(transform, image.copy(), boxes.copy(), labels.copy())
+    random.seed(seed)
+    image_p, boxes_p, labels_p, width_p, height_p = transform._warp(image.copy(), boxes.copy(), labels.copy(), 1.25)
+
+    # the boxes are planned on the full resolution, the downscale only touches the pixels
+    assert (width_p, height_p) == (width_s, height_s)
+    assert np.array_equal(boxes_p, boxes_s)
+    assert np.array_equal(labels_p, labels_s)
+    assert image_p.shape == image_s.shape
+    assert np.abs(image_p.astype(np.float64) - image_s).mean() < 8
+
+def _convert(image, alpha=1, beta=0):
+    # the float64 round-trip _distort used before the lookup tables
+    image[:] = np.uint8(np.clip(image.astype(float) * alpha + beta, 0, 255))
+
+
+def _distort_float(image):
+    image = image.copy()
+    need_convert = False
+    beta = 0
+    alpha = 1
+    if random.randrange(2):
+        beta = random.uniform(-10, 20)
+        need_convert = True
+    if random.randrange(2):
+        alpha = random.uniform(0.8, 1.3)
+        need_convert = True
+    if need_convert:
+        _convert(image, alpha=alpha, beta=beta)
+    if random.randrange(2):
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        _convert(image[:, :, 1], alpha=random.uniform(0.8, 1.3))
+        image = cv2.cvtColor(image, cv2.COLOR_HSV2BGR)
+    return image
+
+
+@pytest.mark.parametrize('alpha,beta', [(1, 0), (0.8, -10), (1.3, 20), (0.93, 7.5), (1.17, -3.2)])
+def test_linear_lut_matches_the_float_conversion(alpha, beta):
+    values = np.arange(256, dtype=np.uint8)
+    expected = values.copy()
+    _convert(expected, alpha, beta)
+    assert np.array_equal(linear_lut(alpha, beta), expected)
+
+
+@pytest.mark.parametrize('seed', range(16))
+def test_lut_distort_matches_the_float_distort(seed):
+    image = np.random.RandomState(seed).randint(0, 256, (60, 80, 3)).astype(np.uint8)
+    random.seed(seed)
+    expected = _distort_float(image)
+    random.seed(seed)
+    assert np.array_equal(_distort(image.copy()), expected)
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32'])
+@pytest.mark.parametrize('num_boxes', [1, 10, 300])
+def test_rotate_boxes_matches_the_loop(dtype, num_boxes):
+    """float64 boxes are bit identical, float32 boxes (the AnnotationIndex
+    dtype) may differ by the float32 rounding of the loop, a few ulps of the
+    image side"""
+    width, height = 2400, 1800
+    tolerance = 8 * np.finfo(np.float32).eps * (width + height) if dtype == 'float32' else 0.
+    state = np.random.RandomState(num_boxes)
+    # boxes up to the image sides, some are clipped after the rotation
+    wh = state.uniform(20, 400, (num_boxes, 2))
+    xy = state.uniform(0, 1, (num_boxes, 2)) * ([width, height] - wh)
+    boxes = np.hstack((xy, xy + wh)).astype(dtype)
+    for a in range(1, 6):
+        top = int(width * math.sin(a * math.pi / 180.0))
+        right = int(height * math.sin(a * math.pi / 180.0))
+        expected = _rotate_boxes_loop(boxes, a, top, width + right, height + top)
+        rotated = _rotate_boxes(boxes, a, top, width + right, height + top)
+        assert rotated.dtype == boxes.dtype
+        assert np.abs(rotated.astype(np.float64) - expected).max() <= tolerance
@@ -0,0 +1,40 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+np = pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+pytest.importorskip('imgaug')
+
+from lib.dataset.dataset_factory import detection_collate, padded_collate
+from lib.utils.box_utils import pad_targets, unpad_targets
+from lib.utils.data_augment import _preproc_for_test_with_resized_img, normalize_batch
+
+MEANS = (103.94, 116.78, 123.68)
+
+
+def _batch(mean, size=4):
+    state = np.random.RandomState(0)
+    images = state.randint(0, 256, (size, 60, 80, 3)).astype(np.uint8)
+    return [(torch.from_numpy(_preproc_for_test_with_resized_img(image, mean)), state.rand(5, 5))
+            for image in images]
+
+
+def test_uint8_batches_normalize_to_the_float_batches():
+    images, _ = detection_collate(_batch(None))
+    assert images.dtype == torch.uint8
+    reference, _ = detection_collate(_batch(MEANS))
+    assert torch.allclose(normalize_batch(images, MEANS), reference)
+    assert normalize_batch(reference, MEANS) is reference
+
+
+def test_padded_collate_pads_the_list_targets():
+    state = np.random.RandomState(1)
+    batch = [(torch.zeros(3, 8, 8, device='cpu'), state.rand(n, 5)) for n in [3, 0, 17, 1]]
+    _, targets = detection_collate(batch)
+    _, padded = padded_collate(batch)
+    assert all(t.device.type == 'cpu' for t in padded)
+    assert padded[1].dtype == torch.long
+    for a, b in zip(pad_targets(targets), pad_targets(padded)):
+        assert torch.equal(a, b)
+    for a, b in zip(targets, unpad_targets(padded)):
+        assert torch.equal(a, b)
@@ -0,0 +1,48 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from lib.utils.config_parse import cfg, AttrDict
+from lib.layers.functions.detection import Detect, DetectionBatch
+from lib.utils.nms.nms_factory import nms_map
+
+NUM_CLASSES = 6
+
+
+def _predictions(batch=3, num_priors=2000):
+    torch.manual_seed(0)
+    loc = torch.randn(batch, num_priors, 4) * 0.5
+    conf = torch.softmax(torch.randn(batch * num_priors, NUM_CLASSES) * 3, dim=1)
+    priors = torch.cat((torch.rand(num_priors, 2), torch.rand(num_priors, 2) * 0.2 + 0.01), 1)
+    return (loc, conf), priors
+
+
+def _detector(priors, **options):
+    post = AttrDict(cfg.POST_PROCESS)
+    post.NUM_CLASSES = NUM_CLASSES
+    post.MAX_DETECTIONS = 50
+    post.SCORE_THRESHOLD = 0.05
+    post.update(options)
+    return Detect(post, priors)
+
+
+@pytest.mark.parametrize('backend', sorted(nms_map))
+@pytest.mark.parametrize('per_class', [False, True])
+@pytest.mark.parametrize('top_k', [0, 500])
+def test_vectorized_gives_the_output_of_the_loop(backend, per_class, top_k):
+    predictions, priors = _predictions()
+    options = dict(NMS_BACKEND=backend, PER_CLASS_NMS=per_class, PRE_NMS_TOP_K=top_k)
+    reference = _detector(priors, **options).forward(predictions)
+    output = _detector(priors, VECTORIZED=True, **options).forward(predictions)
+    assert (reference[:, :, :, 0] > 0).any()
+    assert torch.equal(output, reference)
+
+
+@pytest.mark.parametrize('vectorized', [False, True])
+def test_detect_gives_the_dense_detections(vectorized):
+    predictions, priors = _predictions()
+    reference = DetectionBatch.from_dense(_detector(priors).forward(predictions))
+    detections = _detector(priors, VECTORIZED=vectorized).detect(predictions)
+    assert len(reference.scores) > 0
+    for name in ['boxes', 'scores', 'labels', 'offsets', 'images']:
+        assert torch.equal(getattr(detections, name), getattr(reference, name))
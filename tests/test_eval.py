@@ -0,0 +1,59 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from lib.layers.functions.detection import DetectionBatch
+from lib.utils.eval_utils import cal_tp_fp
+
+NUM_CLASSES = 5
+
+
+def _dense_detections(batch=4, top_k=20):
+    """a dense Detect output: the detections of every image and class by
+    descending score, then zeros"""
+    torch.manual_seed(0)
+    output = torch.zeros(batch, NUM_CLASSES, top_k, 5, device='cpu')
+    for i in range(batch):
+        for c in range(1, NUM_CLASSES):
+            count = int(torch.randint(0, top_k, (1,), device='cpu'))
+            scores, _ = torch.rand(count, device='cpu').sort(0, descending=True)
+            wh = torch.rand(count, 2, device='cpu') * 0.3 + 0.02
+            xy = torch.rand(count, 2, device='cpu') * (1 - wh)
+            output[i, c, :count] = torch.cat((scores.unsqueeze(1), xy, xy + wh), 1)
+    return output
+
+
+def _ground_truths(output):
+    """half of the detections of every class moved a little, so that some
+    detections match, some miss and some are duplicates"""
+    targets = []
+    for i in range(output.size(0)):
+        truths = [torch.zeros(0, 5, device='cpu')]
+        for c in range(1, NUM_CLASSES):
+            boxes = output[i, c, :, 1:][output[i, c, :, 0] > 0]
+            boxes = boxes[:boxes.size(0) // 2]
+            boxes = boxes + (torch.rand(boxes.size(), device='cpu') - 0.5) * 0.05
+            truths.append(torch.cat((boxes, torch.full((boxes.size(0), 1), float(c), device='cpu')), 1))
+        targets.append(torch.cat(truths))
+    return targets
+
+
+def _tp_fp(detections, targets):
+    label = [list() for _ in range(NUM_CLASSES)]
+    score = [list() for _ in range(NUM_CLASSES)]
+    gt_label = [list() for _ in range(NUM_CLASSES)]
+    npos = [0] * NUM_CLASSES
+    return cal_tp_fp(detections, targets, label, score, npos, gt_label)
+
+
+def test_batch_gives_the_tp_fp_of_the_loop():
+    output = _dense_detections()
+    targets = _ground_truths(output)
+    label, score, npos, gt_label = _tp_fp(DetectionBatch.from_dense(output.clone()),
+                                          [t.clone() for t in targets])
+    reference = _tp_fp(output, targets)
+    assert sum(map(sum, reference[0])) > 0
+    assert label == reference[0]
+    assert score == [[float(s) for s in scores] for scores in reference[1]]
+    assert npos == reference[2]
+    assert gt_label == reference[3]
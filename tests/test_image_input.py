@@ -0,0 +1,37 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+np = pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+pytest.importorskip('imgaug')
+
+import torch.nn as nn
+
+from lib.layers.modules.image_input import ImageInput
+from lib.utils.data_augment import _preproc_for_test_with_resized_img
+
+MEANS = (103.94, 116.78, 123.68)
+
+
+def _image():
+    return np.random.RandomState(0).randint(0, 256, (80, 60, 3)).astype(np.uint8)
+
+
+@pytest.mark.parametrize('hwc', [True, False])
+def test_image_input_gives_the_float_input(hwc):
+    image = _image()
+    reference = torch.from_numpy(_preproc_for_test_with_resized_img(image, MEANS)).unsqueeze(0)
+    x = torch.from_numpy(_preproc_for_test_with_resized_img(image, None, hwc)).unsqueeze(0)
+    out = ImageInput(MEANS, hwc=hwc).cpu()(x)
+    assert out.size() == reference.size()
+    assert torch.allclose(out, reference)
+    assert ImageInput(MEANS, hwc=hwc).cpu()(reference) is reference
+
+
+def test_image_input_is_left_out_of_the_state_dict():
+    model = nn.Sequential(nn.Conv2d(3, 4, 1))
+    checkpoint = model.state_dict()
+    model.add_module('image_input', ImageInput(MEANS, hwc=True))
+    assert list(model.state_dict().keys()) == list(checkpoint.keys())
+    model.load_state_dict(checkpoint)
+    assert torch.equal(model.image_input.mean.cpu().view(-1), torch.tensor(MEANS, device='cpu'))
@@ -0,0 +1,87 @@
+import types
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from lib.layers.modules.focal_loss import FocalLoss
+from lib.layers.modules.multibox_loss import MultiBoxLoss, hard_negatives
+from lib.utils.config_parse import cfg, AttrDict
+
+NUM_CLASSES = 5
+NUM_PRIORS = 300
+
+
+def _matcher_cfg(**options):
+    cfg = dict(NUM_CLASSES=NUM_CLASSES, BACKGROUND_LABEL=0, NEGPOS_RATIO=3,
+               MATCHED_THRESHOLD=0.5, UNMATCHED_THRESHOLD=0.4, VARIANCE=[0.1, 0.2],
+               GRID_MATCH=False, BATCH_MATCH=False, TOPK_NEGATIVES=False)
+    cfg.update(options)
+    return types.SimpleNamespace(**cfg)
+
+
+def _priors():
+    xy = torch.rand(NUM_PRIORS, 2, device='cpu')
+    return torch.cat((xy, torch.rand(NUM_PRIORS, 2, device='cpu') * 0.2 + 0.05), 1)
+
+
+def _matched(num, seed):
+    """loc_t and conf_t as match_with_ignorance gives them, a few positives
+    and some ignored (-2) priors per image"""
+    torch.manual_seed(seed)
+    loc_t = torch.randn(num, NUM_PRIORS, 4, device='cpu')
+    conf_t = torch.zeros(num, NUM_PRIORS, device='cpu').long()
+    conf_t[:, :10] = torch.randint(1, NUM_CLASSES, (num, 10), device='cpu')
+    conf_t[:, 10:40] = -2
+    return loc_t, conf_t
+
+
+@pytest.mark.parametrize('topk_negatives', [False, True])
+def test_multibox_loss_skips_the_ignored_priors(topk_negatives):
+    criterion = MultiBoxLoss(_matcher_cfg(TOPK_NEGATIVES=topk_negatives), _priors(), use_gpu=False)
+    matched = _matched(4, 0)
+    loc = torch.randn(4, NUM_PRIORS, 4, device='cpu')
+    conf = torch.randn(4, NUM_PRIORS, NUM_CLASSES, device='cpu')
+    loss_l, loss_c = criterion((loc, conf), None, matched)
+    assert torch.isfinite(loss_l) and torch.isfinite(loss_c)
+
+    # confident background logits on the ignored priors would make them the
+    # hardest negatives, they must not change the loss
+    loud = conf.clone()
+    loud[:, 10:40] = 0
+    loud[:, 10:40, 1] = 50
+    loss_l_loud, loss_c_loud = criterion((loc, loud), None, matched)
+    assert torch.equal(loss_l, loss_l_loud)
+    assert torch.equal(loss_c, loss_c_loud)
+
+
+@pytest.mark.parametrize('distr', ['sigmoid', 'softmax'])
+def test_fused_focal_loss_matches_the_reference(distr):
+    results = []
+    conf_t = _matched(4, 1)[1]
+    conf = torch.randn(conf_t.numel(), NUM_CLASSES, device='cpu') * 2
+    for fused in [False, True]:
+        loss_cfg = AttrDict(cfg.LOSS)
+        loss_cfg.update(dict(CONF_DISTR=distr, FUSED=fused))
+        criterion = FocalLoss(_matcher_cfg(), _priors(), False, loss_cfg)
+        inputs = conf.clone().requires_grad_()
+        loss = criterion.focal_loss(inputs, conf_t.clone())
+        loss.backward()
+        results.append((loss.detach(), inputs.grad))
+    (loss, grad), (fused_loss, fused_grad) = results
+    assert torch.allclose(fused_loss, loss, rtol=1e-5, atol=1e-6)
+    assert torch.allclose(fused_grad, grad, rtol=1e-4, atol=1e-7)
+
+
+@pytest.mark.parametrize('batch', [1, 8])
+@pytest.mark.parametrize('ratio', [0, 3, 10])
+def test_hard_negatives_matches_the_double_sort(batch, ratio):
+    torch.manual_seed(batch)
+    loss_c = torch.rand(batch, NUM_PRIORS, device='cpu')
+    pos = torch.rand(batch, NUM_PRIORS, device='cpu') < 0.02
+    loss_c[pos] = 0
+    num_neg = torch.clamp(ratio * pos.long().sum(1, keepdim=True), max=NUM_PRIORS - 1)
+    _, loss_idx = loss_c.sort(1, descending=True)
+    _, idx_rank = loss_idx.sort(1)
+    reference = idx_rank < num_neg.expand_as(idx_rank)
+    assert torch.equal(hard_negatives(loss_c, num_neg).long(), reference.long())
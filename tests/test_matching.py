@@ -0,0 +1,80 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from lib.layers.functions.prior_box import PriorBox
+from lib.utils.box_utils import match, match_with_ignorance, match_batch, pad_targets
+
+VARIANCE = [0.1, 0.2]
+
+
+def _priors():
+    feature_maps = [(38, 50), (19, 25), (10, 13), (5, 7)]
+    aspect_ratios = [[0.2, 0.5, 2, 4], [0.25, 0.5, 2, 3], [0.5, 2], [0.5, 2]]
+    return PriorBox([600, 800], feature_maps, aspect_ratios, [0.05, 0.6]).prior_set('cpu')
+
+
+def _truths(num, seed):
+    """num point form boxes of shelf sizes plus a few large and edge boxes,
+    and their labels"""
+    torch.manual_seed(seed)
+    wh = torch.rand(num, 2, device='cpu') * 0.15 + 0.005
+    wh[:num // 10] = torch.rand(num // 10, 2, device='cpu') * 0.5 + 0.3
+    xy = torch.rand(num, 2, device='cpu') * (1 - wh)
+    xy[-2:] = 0
+    boxes = torch.cat((xy, xy + wh), 1)
+    return boxes, torch.randint(1, 37, (num,), device='cpu').float()
+
+
+def _targets(matcher, truths, labels, priors, grid):
+    loc_t = torch.zeros(1, len(priors), 4, device='cpu')
+    conf_t = torch.zeros(1, len(priors), device='cpu').long()
+    matcher(truths, priors, VARIANCE, labels, loc_t, conf_t, 0, grid)
+    return loc_t, conf_t
+
+
+@pytest.mark.parametrize('matcher', [lambda *a: match_with_ignorance(0.5, 0.4, *a),
+                                     lambda *a: match(0.5, *a)], ids=['match_with_ignorance', 'match'])
+@pytest.mark.parametrize('num_gts', [1, 10, 150, 300])
+def test_grid_matching_gives_the_dense_targets(matcher, num_gts):
+    priors = _priors()
+    truths, labels = _truths(num_gts, num_gts)
+    loc_t, conf_t = _targets(matcher, truths, labels, priors, grid=True)
+    reference_loc, reference_conf = _targets(matcher, truths, labels, priors, grid=False)
+    assert (reference_conf > 0).any()
+    assert torch.equal(conf_t, reference_conf)
+    assert torch.equal(loc_t, reference_loc)
+
+
+@pytest.mark.parametrize('thresholds', [(0.5, 0.4), (0.5, 0.5)])
+def test_match_batch_gives_the_targets_of_the_per_image_matching(thresholds):
+    priors = _priors()
+    targets = []
+    for num_gts in [1, 17, 149, 60, 5, 120]:
+        truths, labels = _truths(num_gts, num_gts)
+        targets.append(torch.cat((truths, labels.unsqueeze(1)), 1))
+    threshold, unmatched_threshold = thresholds
+    reference_loc = torch.zeros(len(targets), len(priors), 4, device='cpu')
+    reference_conf = torch.zeros(len(targets), len(priors), device='cpu').long()
+    for idx, anno in enumerate(targets):
+        if threshold == unmatched_threshold:
+            match(threshold, anno[:, :4], priors, VARIANCE, anno[:, 4], reference_loc, reference_conf, idx)
+        else:
+            match_with_ignorance(threshold, unmatched_threshold, anno[:, :4], priors, VARIANCE, anno[:, 4],
+                                 reference_loc, reference_conf, idx)
+    loc_t, conf_t = match_batch(threshold, unmatched_threshold, *(pad_targets(targets) + (priors, VARIANCE)))
+    assert torch.equal(conf_t, reference_conf)
+    assert torch.equal(loc_t, reference_loc)
+
+
+def test_match_batch_in_chunks(monkeypatch):
+    import lib.utils.box_utils as box_utils
+    priors = _priors()
+    targets = [torch.cat((truths, labels.unsqueeze(1)), 1)
+               for truths, labels in [_truths(num, num) for num in [3, 40, 7, 90]]]
+    truths, labels, lengths = pad_targets(targets)
+    reference = match_batch(0.5, 0.4, truths, labels, lengths, priors, VARIANCE)
+    # one image per chunk
+    monkeypatch.setattr(box_utils, 'MATCH_BATCH_ELEMENTS', 1)
+    for a, b in zip(match_batch(0.5, 0.4, truths, labels, lengths, priors, VARIANCE), reference):
+        assert torch.equal(a, b)
@@ -0,0 +1,52 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from lib.utils.box_utils import nms
+from lib.utils.nms.nms_factory import nms_map
+
+
+def _random_boxes(num, max_size=0.2):
+    wh = torch.rand(num, 2) * max_size + 0.005
+    xy = torch.rand(num, 2) * (1 - wh)
+    return torch.cat((xy, xy + wh), 1)
+
+
+def _kept(result):
+    keep, count = result
+    return keep[:count].cpu()
+
+
+@pytest.mark.parametrize('name', sorted(nms_map))
+@pytest.mark.parametrize('num', [1, 100, 2000])
+def test_backend_keeps_the_boxes_of_nms(name, num):
+    torch.manual_seed(num)
+    boxes = _random_boxes(num)
+    scores = torch.rand(num)
+    for top_k in [num, 50]:
+        reference = _kept(nms(boxes, scores, 0.6, top_k))
+        assert torch.equal(_kept(nms_map[name](boxes, scores, 0.6, top_k)), reference)
+
+
+@pytest.mark.parametrize('name', sorted(nms_map))
+def test_backend_on_a_suppression_chain(name):
+    # every box suppresses the next one only, so the kept boxes alternate
+    x = torch.arange(1500).float() * 0.1
+    boxes = torch.stack((x, torch.zeros(1500), x + 0.25, torch.ones(1500)), 1)
+    scores = 1 - torch.arange(1500).float() / 1500
+    reference = _kept(nms(boxes, scores, 0.5, 1500))
+    assert reference.numel() == 750
+    assert torch.equal(_kept(nms_map[name](boxes, scores, 0.5, 1500)), reference)
+
+
+@pytest.mark.parametrize('name', sorted(nms_map))
+def test_backend_with_groups_keeps_the_boxes_of_every_group(name):
+    torch.manual_seed(0)
+    boxes = _random_boxes(1000, 0.4)
+    scores = torch.rand(1000)
+    groups = torch.randint(0, 7, (1000,))
+    kept = _kept(nms_map[name](boxes, scores, 0.5, 1000, groups))
+    for group in range(7):
+        members = (groups == group).nonzero().view(-1)
+        reference = members.cpu()[_kept(nms(boxes[members], scores[members], 0.5, members.numel()))]
+        assert torch.equal(kept[groups.cpu()[kept] == group], reference)
@@ -0,0 +1,28 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from lib.layers.functions.prior_box import PriorBox
+
+
+def _priorbox(cache_dir=None):
+    # tiled sub-anchors for the extreme ratios, and a non square input
+    feature_maps = [(38, 50), (19, 25), (10, 13), (5, 7)]
+    aspect_ratios = [[0.2, 0.5, 2, 4], [0.25, 0.5, 2, 3], [0.5, 2], [0.5, 2]]
+    return PriorBox([600, 800], feature_maps, aspect_ratios, [0.05, 0.6], cache_dir=cache_dir)
+
+
+def test_generate_gives_the_priors_of_the_loop():
+    priorbox = _priorbox()
+    assert torch.equal(priorbox.generate().cpu(), priorbox.forward_loop().cpu())
+
+
+def test_cached_priors_are_the_priors_of_the_loop(tmpdir):
+    priorbox = _priorbox(str(tmpdir))
+    reference = priorbox.forward_loop().cpu()
+    cold = priorbox.forward()
+    assert tmpdir.listdir()
+    warm = priorbox.forward()
+    assert cold.type() == warm.type() == torch.Tensor().type()
+    assert torch.equal(cold.cpu(), reference)
+    assert torch.equal(warm.cpu(), reference)